@@ -4,33 +4,222 @@ x - x-coordinate data.
 y - y-coordinate data.
 z - z-coordinate data; i.e., the number of planes deep into the ATAR
 E - energy deposited at the given read time
-E_per_plane - energy deposited per plane. Should be of length 50 since there are 50 planes.
+E_per_plane - energy deposited per plane. Has one entry per ATAR plane (n_planes, 50 for the current geometry).
 pixel_pdgs - particle IDs (as ints) to distinguish different decay products.
 max_E - maximum energy deposited over all planes.
 gap_times - any large time gaps in the data, which signal a decay at rest.
+pion_dar - whether the pion decayed at rest, from the pion_dar branch of the ATAR tree (None if it was not read).
 thetas - from calorimeter, represents theta values at which energy is deposited.
 phis - from calorimeter, represents phi values at which energy is deposited.
 crystal ids - a list of 6-digit numbers, the means by which we identify in which crystals energy is deposited.
 calo_edep - energy deposited at each Calo ID location.
-r_theta_phis - coordinate pairs (theta, phi) that we will plot later.
+r_theta_phis - (r, theta, phi) coordinates of each crystal in crystal_ids, as an (n, 3) array, that we will plot later. Rows are NaN for unknown crystals.
+crystal_mask - True for each crystal in crystal_ids that was found in the calorimeter geometry.
+
+Many events at once are stored in an EventBatch (see below), which can hand out single Events for plotting.
 '''
 
 import numpy as np
+from atar_geometry import X_ORIENTATION, Y_ORIENTATION
 
 class Event:
 
-    def __init__(self):
+    __slots__ = ("t_data", "x_data", "y_data", "z_data", "E_data", "E_per_plane", "pixel_pdgs", "max_E", "gap_times", "pion_dar",
+                 "thetas", "phis", "crystal_ids", "calo_edep", "r_theta_phis", "crystal_mask")
+
+    def __init__(self, n_planes=50):
         self.t_data = []
         self.x_data = []
         self.y_data = []
         self.z_data = []
         self.E_data = []
-        self.E_per_plane = np.zeros(50)
+        self.E_per_plane = np.zeros(n_planes)
         self.pixel_pdgs = []
         self.max_E = []
         self.gap_times = []
+        self.pion_dar = None
         self.thetas = []
         self.phis = []
         self.crystal_ids = []
         self.calo_edep = []
-        self.r_theta_phis = []
\ No newline at end of file
+        self.r_theta_phis = []
+        self.crystal_mask = []
+
+
+#Data types used by EventBatch.compact(). Plane, strip and orientation fit in a byte for the current ATAR geometry.
+COMPACT_DTYPES = {
+    "planes": np.uint8,
+    "strips": np.uint8,
+    "orientations": np.uint8,
+    "times": np.float32,
+    "edeps": np.float32,
+    "pdgs": np.int32,
+    "E_per_plane": np.float32,
+    "gap_times": np.float32,
+    "crystal_ids": np.int32,
+    "calo_edep": np.float32,
+}
+
+
+'''
+Holds many events as flat typed arrays instead of one Event of Python lists per event. Hits of all events are stored back to back, and the hits of
+event i are hits[hit_offsets[i]:hit_offsets[i + 1]] (CSR-style offsets), and likewise for gap times and calorimeter hits. x and y are not padded
+with NaNs; instead every hit stores its strip number and the orientation of its plane. Use compact() to get a copy with the small data types in
+COMPACT_DTYPES, which is several times smaller than the equivalent Events. batch[i] gives an Event for plotting and the like.
+entries: (n_events,) entry number of each event in the tree it came from.
+hit_offsets: (n_events + 1,) start of each event's hits in the per-hit arrays.
+planes, strips, orientations: per-hit plane number, strip number and orientation (X_ORIENTATION or Y_ORIENTATION).
+times, edeps, pdgs: per-hit time (ns), energy deposited (MeV) and particle ID.
+E_per_plane: (n_events, n_planes) energy deposited in each plane.
+max_E: (n_events,) maximum energy deposited over all planes.
+gap_offsets, gap_times: CSR-style large time gaps of each event.
+pion_dar (optional): (n_events,) the pion_dar branch.
+calo_offsets, crystal_ids, calo_edep (optional): CSR-style calorimeter hits of each event.
+'''
+class EventBatch:
+
+    def __init__(self, entries, hit_offsets, planes, strips, orientations, times, edeps, pdgs, E_per_plane, max_E, gap_offsets, gap_times,
+                 pion_dar=None, calo_offsets=None, crystal_ids=None, calo_edep=None):
+        self.entries = np.asarray(entries, dtype=np.int64)
+        self.hit_offsets = np.asarray(hit_offsets, dtype=np.int64)
+        self.planes = np.asarray(planes)
+        self.strips = np.asarray(strips)
+        self.orientations = np.asarray(orientations)
+        self.times = np.asarray(times)
+        self.edeps = np.asarray(edeps)
+        self.pdgs = np.asarray(pdgs)
+        self.E_per_plane = np.asarray(E_per_plane)
+        self.max_E = np.asarray(max_E)
+        self.gap_offsets = np.asarray(gap_offsets, dtype=np.int64)
+        self.gap_times = np.asarray(gap_times)
+        self.pion_dar = None if pion_dar is None else np.asarray(pion_dar)
+
+        #Events without calorimeter data are given empty calorimeter hits.
+        if calo_offsets is None:
+            calo_offsets = np.zeros(len(self.entries) + 1, dtype=np.int64)
+            crystal_ids, calo_edep = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        self.calo_offsets = np.asarray(calo_offsets, dtype=np.int64)
+        self.crystal_ids = np.asarray(crystal_ids)
+        self.calo_edep = np.asarray(calo_edep)
+
+        if len(self.hit_offsets) != len(self.entries) + 1 or len(self.gap_offsets) != len(self.entries) + 1 or \
+           len(self.calo_offsets) != len(self.entries) + 1:
+            raise ValueError("Every offsets array of an EventBatch must have one more element than there are events.")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, i):
+        return self.event(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.event(i)
+
+    #Number of ATAR planes of the events in this batch.
+    @property
+    def n_planes(self):
+        return self.E_per_plane.shape[1]
+
+    #Number of hits of each event.
+    @property
+    def n_hits(self):
+        return np.diff(self.hit_offsets)
+
+    #Event number (0 to len(self) - 1) of each hit, which is handy for per-event sums with np.bincount.
+    @property
+    def hit_event_index(self):
+        return np.repeat(np.arange(len(self)), self.n_hits)
+
+    #Total memory used by the arrays of this batch, in bytes.
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in vars(self).values() if isinstance(a, np.ndarray))
+
+    #A copy of this batch with the small data types in COMPACT_DTYPES.
+    def compact(self):
+        arrays = {name: getattr(self, name).astype(dtype, copy=False) for name, dtype in COMPACT_DTYPES.items()}
+        return EventBatch(self.entries, self.hit_offsets, arrays["planes"], arrays["strips"], arrays["orientations"], arrays["times"],
+                          arrays["edeps"], arrays["pdgs"], arrays["E_per_plane"], self.max_E, self.gap_offsets, arrays["gap_times"],
+                          self.pion_dar, self.calo_offsets, arrays["crystal_ids"], arrays["calo_edep"])
+
+    #A new batch with only the given events, in the given order. indices can be event numbers (0 to len(self) - 1) or a boolean mask over events.
+    def take(self, indices):
+        indices = np.arange(len(self))[indices] if np.asarray(indices).dtype == bool else np.asarray(indices, dtype=np.int64)
+
+        def take_ragged(offsets, *arrays):
+            lengths = offsets[indices + 1] - offsets[indices]
+            starts = np.repeat(offsets[indices] - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+            flat_index = starts + np.arange(lengths.sum())
+            return (np.concatenate(([0], np.cumsum(lengths))),) + tuple(a[flat_index] for a in arrays)
+
+        hit_offsets, planes, strips, orientations, times, edeps, pdgs = take_ragged(self.hit_offsets, self.planes, self.strips,
+                                                                                   self.orientations, self.times, self.edeps, self.pdgs)
+        gap_offsets, gap_times = take_ragged(self.gap_offsets, self.gap_times)
+        calo_offsets, crystal_ids, calo_edep = take_ragged(self.calo_offsets, self.crystal_ids, self.calo_edep)
+        pion_dar = None if self.pion_dar is None else self.pion_dar[indices]
+
+        return EventBatch(self.entries[indices], hit_offsets, planes, strips, orientations, times, edeps, pdgs, self.E_per_plane[indices],
+                          self.max_E[indices], gap_offsets, gap_times, pion_dar, calo_offsets, crystal_ids, calo_edep)
+
+    #Returns event i of the batch as an Event. Its per-hit data are views into the arrays of this batch rather than copies; only x_data and
+    #y_data, which are padded with NaNs for plotting, are built. The crystal coordinates come from crystal_geometry, which defaults to
+    #calo_analysis.get_crystal_geometry().
+    def event(self, i, crystal_geometry=None):
+        if i < 0:
+            i += len(self)
+        start, stop = self.hit_offsets[i], self.hit_offsets[i + 1]
+
+        event = Event(self.n_planes)
+        strips = self.strips[start:stop].astype(np.float64)
+        is_x = self.orientations[start:stop] == X_ORIENTATION
+        event.t_data = self.times[start:stop]
+        event.x_data = np.where(is_x, strips, np.nan)
+        event.y_data = np.where(is_x, np.nan, strips)
+        event.z_data = self.planes[start:stop]
+        event.E_data = self.edeps[start:stop]
+        event.pixel_pdgs = self.pdgs[start:stop]
+        event.E_per_plane = self.E_per_plane[i]
+        event.max_E = self.max_E[i]
+        event.gap_times = self.gap_times[self.gap_offsets[i]:self.gap_offsets[i + 1]]
+        if self.pion_dar is not None:
+            event.pion_dar = self.pion_dar[i]
+
+        calo_start, calo_stop = self.calo_offsets[i], self.calo_offsets[i + 1]
+        event.crystal_ids = self.crystal_ids[calo_start:calo_stop]
+        event.calo_edep = self.calo_edep[calo_start:calo_stop]
+        if len(event.crystal_ids) > 0:
+            if crystal_geometry is None:
+                import calo_analysis
+                crystal_geometry = calo_analysis.get_crystal_geometry()
+            event.r_theta_phis, event.crystal_mask = crystal_geometry.lookup(event.crystal_ids)
+        else:
+            event.r_theta_phis, event.crystal_mask = np.empty((0, 3)), np.empty(0, dtype=bool)
+
+        return event
+
+    #Pack a list of Events (e.g. from process_event()) into a batch. entries gives the entry number of each event and defaults to 0, 1, 2, ...
+    @classmethod
+    def from_events(cls, events, entries=None):
+        events = list(events)
+        n_planes = len(events[0].E_per_plane) if events else 50
+        if entries is None:
+            entries = np.arange(len(events))
+
+        def offsets(lengths):
+            return np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+
+        def flat(name, dtype):
+            return np.concatenate([np.asarray(getattr(e, name), dtype=dtype) for e in events]) if events else np.empty(0, dtype=dtype)
+
+        x_data, y_data = flat("x_data", np.float64), flat("y_data", np.float64)
+        is_x = ~np.isnan(x_data)
+        pion_dar = None if any(e.pion_dar is None for e in events) else [e.pion_dar for e in events]
+
+        return cls(entries, offsets([len(e.t_data) for e in events]),
+                   flat("z_data", np.int64), np.where(is_x, x_data, y_data).astype(np.int64), np.where(is_x, X_ORIENTATION, Y_ORIENTATION).astype(np.uint8),
+                   flat("t_data", np.float64), flat("E_data", np.float64), flat("pixel_pdgs", np.int64),
+                   np.array([e.E_per_plane for e in events], dtype=np.float64).reshape(len(events), n_planes),
+                   np.array([e.max_E for e in events], dtype=np.float64),
+                   offsets([len(e.gap_times) for e in events]), flat("gap_times", np.float64), pion_dar,
+                   offsets([len(e.crystal_ids) for e in events]), flat("crystal_ids", np.int64), flat("calo_edep", np.float64))
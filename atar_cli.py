@@ -0,0 +1,221 @@
+'''
+Command line entry point for the ATAR analysis, for batch jobs on the cluster as well as interactive use:
+
+    python atar_cli.py extract updated_remove_zeros.root -o features.npz --workers 32
+    python atar_cli.py select updated_remove_zeros.root --dar 1 --limit 100 --sampling uniform --seed 1
+    python atar_cli.py gaps updated_remove_zeros.root --thresholds 0.5 1 2 5 10 20 --workers 32
+    python atar_cli.py table pienu.root -o output_pienu.parquet --workers 32
+    python atar_cli.py cuts output_pienu.csv output_pimue.csv --save-dir plots
+    python atar_cli.py plot updated_remove_zeros.root 12 40 --save-dir plots
+    python atar_cli.py plot updated_remove_zeros.root --limit 1000 --sampling uniform --pdf review.pdf --workers 16
+
+Only argparse is imported up front. ROOT, matplotlib, pandas and the analysis modules are imported by the subcommand that needs them, so starting
+up (and --help) takes a fraction of a second. Without a display, or whenever plots are saved with --save-dir, matplotlib uses the non-interactive
+Agg backend.
+'''
+
+import argparse
+import os
+import sys
+
+
+#Switch matplotlib to the non-interactive Agg backend if plots are only saved, or if there is no display to show them on. Has to be called before
+#pyplot (or any module importing it) is imported.
+def _set_matplotlib_backend(saving = False):
+    no_display = sys.platform.startswith("linux") and not os.environ.get("DISPLAY") and not os.environ.get("WAYLAND_DISPLAY")
+    if saving or no_display:
+        import matplotlib
+        matplotlib.use("Agg")
+
+
+#The cut given by the --dar and --cut options of a subcommand.
+def _cut_from_args(args):
+    import event_selection
+    return event_selection.combine_cuts(event_selection.dar_cut(args.dar), args.cut)
+
+
+#The entries of a file passing the cut of the --dar, --cut, --limit, --sampling and --seed options.
+def _select(args):
+    import itertools
+    import numpy as np
+    import event_pipeline
+    import event_selection
+    import tree_readers
+
+    cut = _cut_from_args(args)
+    r_TFile, tree_atar, _ = tree_readers.open_trees(args.file, read_calo=False)
+    try:
+        if args.sampling == "first":
+            entries = np.array(list(itertools.islice(event_pipeline.iter_selected_entries(tree_atar, cut), args.limit)), dtype=np.int64)
+        elif args.limit is None:
+            raise SystemExit("--sampling " + args.sampling + " needs --limit.")
+        elif args.sampling == "stratified" and args.dar != 2:
+            raise SystemExit("--sampling stratified draws half decays in flight and half at rest, so it needs --dar 2.")
+        elif args.sampling == "uniform":
+            entries = event_selection.sample_entries(tree_atar, cut, args.limit, args.seed)
+        else:
+            ks = [args.limit - args.limit // 2, args.limit // 2]
+            samples = event_selection.sample_entries(tree_atar, cut, ks, args.seed, strata=[event_selection.DIF_CUT, event_selection.DAR_CUT])
+            entries = np.sort(np.concatenate(samples))
+    finally:
+        r_TFile.Close()
+    return entries
+
+
+#extract: decode (selected) entries of a file in parallel and save their features to a .npz file.
+def run_extract(args):
+    import numpy as np
+    import parallel_extraction
+
+    entries = _select(args) if args.dar != 2 or args.cut or args.limit is not None else None
+    features = parallel_extraction.extract_features(args.file, entries, args.workers, args.chunk_size, read_calo=args.calo, backend=args.backend)
+    np.savez(args.output, **features)
+    print("Saved the features of " + str(len(features.get("entries", []))) + " events to " + args.output)
+
+
+#table: write the cut study table of a file (see feature_extraction.py).
+def run_table(args):
+    import feature_extraction
+
+    entries = _select(args) if args.dar != 2 or args.cut or args.limit is not None else None
+    n_rows = feature_extraction.extract_cut_table(args.file, args.output, entries, not args.no_per_particle, args.workers, args.chunk_size,
+                                                  args.backend)
+    print("Wrote " + str(n_rows) + " rows to " + args.output)
+
+
+#gaps: print the fraction of decays at rest and in flight with a time gap above each of the given thresholds (see time_clusters.py).
+def run_gaps(args):
+    import time_clusters
+
+    features = time_clusters.extract_gap_features(args.file, n_workers=args.workers, chunk_size=args.chunk_size, backend=args.backend)
+    print(time_clusters.scan_gap_threshold(features, args.thresholds).to_string(index=False))
+
+
+#select: print (or save) the entries of a file that pass a cut.
+def run_select(args):
+    import numpy as np
+
+    entries = _select(args)
+    if args.output:
+        if args.output.endswith(".npy"):
+            np.save(args.output, entries)
+        else:
+            np.savetxt(args.output, entries, fmt="%d")
+        print("Saved " + str(len(entries)) + " entries to " + args.output)
+    else:
+        print(str(len(entries)) + " entries:")
+        print(" ".join(map(str, entries)))
+
+
+#cuts: plot the cuts of cluster_data_analysis.py for the PiENu and PiMuE feature files and print their suppression factors.
+def run_cuts(args):
+    _set_matplotlib_backend(args.save_dir is not None)
+    import cluster_data_analysis
+
+    if args.save_dir:
+        os.makedirs(args.save_dir, exist_ok=True)
+    cluster_data_analysis.main(args.pienu_file, args.pimue_file, args.save_dir)
+
+
+#plot: plot the given entries of a file (or those passing a cut), one figure per event. With --save-dir or --pdf, the figures are rendered without
+#a display by several processes (see batch_render.py); otherwise they are shown one after the other.
+def run_plot(args):
+    entries = args.entries if args.entries else _select(args)
+    if args.save_dir or args.pdf:
+        import batch_render
+        batch_render.render_events(args.file, entries, args.pdf or args.save_dir, args.workers, format=args.format, backend=args.backend)
+        print("Rendered " + str(len(entries)) + " events to " + (args.pdf or args.save_dir))
+        return
+
+    _set_matplotlib_backend()
+    from matplotlib import pyplot as plt
+    import atar_exploration
+    import event_pipeline
+    import tree_readers
+    from atar_geometry import DEFAULT_ATAR_GEOMETRY
+
+    r_TFile, tree_atar, tree_calo = tree_readers.open_trees(args.file)
+    try:
+        for event in event_pipeline.iter_events(tree_atar, tree_calo, entries):
+            atar_exploration.plot_event(event, DEFAULT_ATAR_GEOMETRY.n_planes, show=False)
+    finally:
+        r_TFile.Close()
+    plt.show()
+
+
+#Add the options that select entries of a file to a subcommand.
+def _add_selection_arguments(parser, limit_help):
+    parser.add_argument("--dar", type=int, choices=(0, 1, 2), default=2, help="0 = decays in flight, 1 = decays at rest, 2 = all events (default)")
+    parser.add_argument("--cut", help="extra cut in TTree::Draw syntax, e.g. \"Length$(pixel_hits) > 10\"")
+    parser.add_argument("--limit", type=int, help=limit_help)
+    parser.add_argument("--sampling", choices=("first", "uniform", "stratified"), default="first",
+                        help="take the first --limit entries (default), a uniform random sample, or half decays in flight and half at rest")
+    parser.add_argument("--seed", type=int, help="seed of the random sampling")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="atar_cli.py", description="Analysis of simulated ATAR and calorimeter data.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    extract = subparsers.add_parser("extract", help="decode events in parallel and save their features to a .npz file")
+    extract.add_argument("file", help=".root file with the atar and calorimeter trees")
+    extract.add_argument("-o", "--output", required=True, help=".npz file to write the features to")
+    extract.add_argument("--workers", type=int, help="number of worker processes (default: number of CPUs)")
+    extract.add_argument("--chunk-size", type=int, default=10_000, help="entries decoded by a worker at a time")
+    extract.add_argument("--backend", choices=("pyroot", "uproot", "columnar"), default="pyroot", help="how the file is read (see tree_readers.py)")
+    extract.add_argument("--calo", action="store_true", help="also read the calorimeter tree")
+    _add_selection_arguments(extract, "only extract this many selected entries")
+    extract.set_defaults(run=run_extract)
+
+    table = subparsers.add_parser("table", help="write the table of the cut study (stopping position, energies, ...) to a .csv/.parquet/.npz file")
+    table.add_argument("file", help=".root file with the atar tree")
+    table.add_argument("-o", "--output", required=True, help="table to write, e.g. output_pienu.parquet")
+    table.add_argument("--workers", type=int, help="number of worker processes (default: number of CPUs)")
+    table.add_argument("--chunk-size", type=int, default=10_000, help="entries decoded by a worker at a time")
+    table.add_argument("--backend", choices=("pyroot", "uproot", "columnar"), default="pyroot", help="how the file is read (see tree_readers.py)")
+    table.add_argument("--no-per-particle", action="store_true", help="leave out the energy per plane of each type of particle")
+    _add_selection_arguments(table, "only use this many selected entries")
+    table.set_defaults(run=run_table)
+
+    gaps = subparsers.add_parser("gaps", help="scan the time gap threshold that tells decays at rest from decays in flight")
+    gaps.add_argument("file", help=".root file with the atar tree (and its pion_dar branch)")
+    gaps.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 1, 2, 5, 10, 20, 50, 100], help="gap thresholds to scan (ns)")
+    gaps.add_argument("--workers", type=int, help="number of worker processes (default: number of CPUs)")
+    gaps.add_argument("--chunk-size", type=int, default=10_000, help="entries decoded by a worker at a time")
+    gaps.add_argument("--backend", choices=("pyroot", "uproot", "columnar"), default="pyroot", help="how the file is read (see tree_readers.py)")
+    gaps.set_defaults(run=run_gaps)
+
+    select = subparsers.add_parser("select", help="list the entries of a file that pass a cut")
+    select.add_argument("file", help=".root file with the atar tree")
+    select.add_argument("-o", "--output", help="save the entries to this file (.npy, or text otherwise) instead of printing them")
+    _add_selection_arguments(select, "number of entries to select (default: all)")
+    select.set_defaults(run=run_select)
+
+    cuts = subparsers.add_parser("cuts", help="plot the cuts on the cluster's PiENu / PiMuE output and print suppression factors")
+    cuts.add_argument("pienu_file", nargs="?", default="output_pienu.csv", help="PiENu features (default: output_pienu.csv)")
+    cuts.add_argument("pimue_file", nargs="?", default="output_pimue.csv", help="PiMuE features (default: output_pimue.csv)")
+    cuts.add_argument("--save-dir", help="save the plots to this directory instead of showing them")
+    cuts.set_defaults(run=run_cuts)
+
+    plot = subparsers.add_parser("plot", help="plot events of a file")
+    plot.add_argument("file", help=".root file with the atar and calorimeter trees")
+    plot.add_argument("entries", nargs="*", type=int, help="entries to plot (default: those selected by the options below)")
+    plot.add_argument("--save-dir", help="save the plots to this directory instead of showing them")
+    plot.add_argument("--pdf", help="save the plots to this multi-page .pdf file instead of showing them")
+    plot.add_argument("--format", default="png", help="file format of plots saved to --save-dir (default: png)")
+    plot.add_argument("--workers", type=int, help="number of processes rendering saved plots (default: number of CPUs)")
+    plot.add_argument("--backend", choices=("pyroot", "uproot", "columnar"), default="pyroot", help="how the file is read (see tree_readers.py)")
+    _add_selection_arguments(plot, "number of selected entries to plot (default: 10)")
+    plot.set_defaults(run=run_plot, limit=10)
+
+    return parser
+
+
+def main(argv = None):
+    args = build_parser().parse_args(argv)
+    args.run(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
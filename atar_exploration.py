@@ -1,12 +1,19 @@
 #Note: Data collection functionality in this file is currently being moved over to the cluster.
 #This is a script version of atar_exploration.ipynb to be run via the command line.
 
-from logging.config import IDENTIFIER
-import ROOT as r
+import itertools
 import numpy as np
 from matplotlib import pyplot as plt
-from Event import Event
-import calo_analysis
+import batch_render
+import event_decoder
+import event_pipeline
+import event_selection
+import histogram
+import parallel_extraction
+import particle_groups
+from atar_geometry import DEFAULT_ATAR_GEOMETRY
+from histogram import Histogram
+from streaming_stats import StreamingStats
 
 
 '''
@@ -16,72 +23,11 @@ x and y is an n x 2 matrix, where the first column contains the times correspond
 Also extract the z (plane #) vs. time data. The third element of the tuples contained in this list and the x and y lists will contain corresponding colors to represent
 when particles have decayed.
 '''
-def process_event(tree, tree_calo, event_index):
-    #Get the specified entries from our trees so we can extract data from them.
-    tree.GetEntry(event_index)
-    tree_calo.GetEntry(event_index)
-
-    #Store pixel hits for the entry printed above in which a pion didn't decay at rest.
-    pixel_times = tree.pixel_time
-    pixel_hits = tree.pixel_hits
-    pixel_edep = tree.pixel_edep
-    
-    #Initialize lists for storing color (for labeling data points according to decay product), t, x, y, z, energy, and energy per plane using the Event class.
-    npixels_per_plane = 100
-    event = Event()
-
-    #Init time value so 1st loop below works.
-    cur_time = 0
-    
-    #Extract x vs. t, y vs. t, and z vs. t data. Also add indexed color coding to represent different particles.
-    for i in range(pixel_hits.size()):
-        plane = int(np.floor((pixel_hits[i] - 1 - 100_000) / npixels_per_plane))
-
-        cur_val = (pixel_hits[i] - 1) % npixels_per_plane
-        last_time = cur_time    #Allows us to note any large time gaps for later analysis.
-        cur_time = pixel_times[i]
-
-        event.t_data.append(cur_time)
-
-        if(plane % 2 == 0):
-            event.x_data.append(cur_val)
-            event.y_data.append(np.nan)
-        else:
-            event.y_data.append(cur_val)
-            event.x_data.append(np.nan)
-
-        event.z_data.append(plane)
-        event.E_data.append(pixel_edep[i])
-
-        # #Keep track of any gaps in time between decays.
-        if cur_time - last_time > 1.0:      #TODO: Adjust this time gap (in ns) as needed.
-            event.gap_times.append(cur_time - last_time)
-
-        #Keep track of sum of energies deposited in each plane.
-        event.E_per_plane[plane] += pixel_edep[i]
-
-    #Keep track of particle IDs.
-    event.pixel_pdgs = tree.pixel_pdg
-
-    #Keep track of maximum energy deposited per plane in this event.
-    event.max_E = max(event.E_per_plane)
-
-    #Extract all (theta, phi) pairs from the calorimeter tree.
-    global_crys_dict = calo_analysis.get_crystal_data()
-    #Get the IDs of the crystals that were hit at those (theta, phi) pairs from the calorimeter tree.
-    event.crystal_ids = list(tree_calo.crystal)
-    event.calo_edep = list(tree_calo.edep)
-
-    # Use the IDs (tree_calo.crystal) to get the corresponding values from the dictionary of (ID: (r, theta, phi)) values (global_crys_dict).
-    event.r_theta_phis = []
-    for ID in event.crystal_ids:
-        event.r_theta_phis.append(global_crys_dict.get(ID))
-
-    # print("crystal IDs: ", event.crystal_ids)
-    # print("edep: ", event.calo_edep)
-    # print("r_theta_phis: ", event.r_theta_phis)
-
-    return event
+#geometry: The ATARGeometry used to decode the pixel IDs. Defaults to the geometry of the current simulation.
+def process_event(tree, tree_calo, event_index, geometry = DEFAULT_ATAR_GEOMETRY):
+    #Read the entry from our trees and decode all of its hits at once; see event_decoder.py for how the x, y, z, t, energy per plane and gap time
+    #data are extracted. The crystal IDs of the calorimeter hits are translated into (r, theta, phi) values with calo_analysis.get_crystal_geometry().
+    return event_decoder.decode_event(tree, tree_calo, event_index, geometry)
 
 
 #Show some useful parameters describing our event.
@@ -98,61 +44,19 @@ def display_event(event):
     print("t_data: " + str(event.t_data))
 
 
-#For each color in a list of color labels for different particles, plot the corresponding data.
+#For each type of particle in the event, plot the corresponding data in its own color. The hits are grouped by particle ID in one pass (see
+#particle_groups.py); pions, positrons, electrons, antimuons and muons have fixed colors, and any other particles are labelled with their pdg.
 def plot_with_color_legend(x_coords, y_coords, pixel_pdgs):
-    #Store colors and corresponding particle type labels in one place for ease of editing.
-    colors = ["r", "b", "g", "y", "m"]
-    labels = ["Pion", "Positron", "Electron", "Antimuon", "Muon"]
-    particle_IDs = [211, -11, 11, -13, 13]
-    
-    #Store list of tuples of our data to be processed below.
-    coords = zip(x_coords, y_coords, pixel_pdgs)
-
-    #Keep track of known particles and other particles to plot.
-    cur_data_to_plot = []
-    other_to_plot = []
-    other_IDs = []
-    other_colors = ["k", "gray", "cyan", "indigo", "teal", "lime"]
-
-    #For each color, extract all pdgs of that color and display them on a scatter plot.
-    for i in range(0, len(particle_IDs)):
-        for coord in coords:
-            if coord[2] == particle_IDs[i]:                
-                cur_data_to_plot.append(coord)
-            elif coord[2] not in particle_IDs:  # Keep track of number of unidentified particles so we can plot them separately after exiting this loop.
-                other_to_plot.append(coord)
-
-                #Keep list of other IDs so we know how many labels are needed.
-                if coord[2] not in other_IDs:
-                    other_IDs.append(coord[2])
-                #str(pixel_pdg[i])
-        
-        #Plot data for corresponding color each loop, but only if the data for the corresponding color is not empty.
-        if len(cur_data_to_plot) != 0:
-            plt.scatter([coord[0] for coord in cur_data_to_plot], [coord[1] for coord in cur_data_to_plot], 10, colors[i], label = labels[i])
-
-        #Reset data to plot every loop.
-        cur_data_to_plot = []
-
-    #Plot the unidentified particles in distinct colors with their pdgs for labels.
-    for i in range(0, len(other_IDs)):
-        ID = other_IDs[i]
-        
-        #Extract x and y coordinates to plot only if they are all of the particle ID that we are currently plotting.
-        # [coord[0] for coord in other_to_plot if coord[2] == ID]
-        x = []
-        y = []
-        for coord in other_to_plot:
-            if coord[2] == ID:
-                x.append(coord[0])
-                y.append(coord[1])
-
-        plt.scatter(x, y, 10, other_colors[i], label = str(ID))
+    x_coords = np.asarray(x_coords)
+    y_coords = np.asarray(y_coords)
+    for group in particle_groups.group_hits(pixel_pdgs):
+        plt.scatter(x_coords[group.hits], y_coords[group.hits], 10, color = group.color, label = group.label)
 
 
 #Plot x vs. t, y vs. t, z vs. t, and E vs. z data from our event. The graphs will show the color-coding system used to represent different particles.
-#Display 0 to num_planes on plots including the z variable.
-def plot_event(event, num_planes):
+#Display 0 to num_planes on plots including the z variable, and all strips of the given ATAR geometry on plots of x or y.
+#show (optional): Show the figure when done. Use show = False to save the returned figure instead, e.g. when running without a display.
+def plot_event(event, num_planes, geometry = DEFAULT_ATAR_GEOMETRY, show = True):
 
     fig = plt.figure(figsize = (15, 10))
 
@@ -170,7 +74,7 @@ def plot_event(event, num_planes):
     plt.ylabel("x (pix)")
     plt.legend()
     plt.xlim(0, num_planes)
-    plt.ylim(0, 100)
+    plt.ylim(0, geometry.n_strips_per_plane)
 
     plt.subplot(2,4,2)
     plot_with_color_legend(event.z_data, event.y_data, event.pixel_pdgs)
@@ -178,7 +82,7 @@ def plot_event(event, num_planes):
     plt.xlabel("z (plane number)")
     plt.ylabel("y (pix)")
     plt.xlim(0, num_planes)
-    plt.ylim(0, 100)
+    plt.ylim(0, geometry.n_strips_per_plane)
 
     plt.subplot(2,4,3)
     plot_with_color_legend(event.t_data, event.z_data, event.pixel_pdgs)
@@ -191,7 +95,7 @@ def plot_event(event, num_planes):
     plt.subplot(2,4,4)
 
     plt.scatter(event.z_data, event.E_data, 10, label = "e_dep")
-    plt.scatter(range(50), event.E_per_plane, 10, "black", label = "e_dep per plane")
+    plt.scatter(range(len(event.E_per_plane)), event.E_per_plane, 10, "black", label = "e_dep per plane")
     plt.title("ATAR Energy Deposition Per Plane vs. z")
     plt.xlabel("z (plane number)")
     plt.ylabel("Energy (MeV / plane)")
@@ -205,9 +109,9 @@ def plot_event(event, num_planes):
     # is present - in this case, the calo ID could be marked as a single volume and we just get 1000, which we don't want to count. The points are
     # color coded by energy deposition and surrounded by a black border to make faint colors easier to distinguish from the white background.
     if len(event.crystal_ids) > 1:
-        color_range = event.calo_edep
-        thetas = [coords[1] for coords in event.r_theta_phis]
-        phis = [coords[2] for coords in event.r_theta_phis]
+        color_range = event.calo_edep[event.crystal_mask]
+        thetas = event.r_theta_phis[event.crystal_mask, 1]
+        phis = event.r_theta_phis[event.crystal_mask, 2]
 
         plt.scatter(thetas, phis, c=color_range, cmap="YlOrRd", edgecolors="black")
         plt.xlabel("Theta (rad)")
@@ -226,31 +130,40 @@ def plot_event(event, num_planes):
     #                     hspace = 0.4)
     
     plt.tight_layout()
-    plt.show()
+    if show:
+        plt.show()
+
+    return fig
 
 
 #Use cuts to select the events we want from the tree. Returns an integer list of the indices of the events that we want from the tree.
 #is_event_DAR: Value of 0 = decays in flight, 1 = decays at rest, 2 = all data used.
 #num_events:  Controls how many events we want to select.
-def select_events(tree, is_event_DAR, num_events):
-    #Apply logical cut to select whether we want DARs and to exclude empty data. n stores the number of entries that satisfy this cut.
-    if is_event_DAR == 0:
-        cut = "!pion_dar && Sum$(pixel_edep) > 0"
-    elif is_event_DAR == 1:
-        cut = "pion_dar && Sum$(pixel_edep) > 0"
+#sampling (optional):  "first" (the default) takes the first num_events matching events, "uniform" a random sample of them, and "stratified" a random
+#                      sample with half decays in flight and half decays at rest (needs is_event_DAR = 2).
+#seed (optional):  Seed for the random sampling, to get the same events again.
+def select_events(tree, is_event_DAR, num_events, sampling = "first", seed = None):
+    #Apply logical cut to select whether we want DARs and to exclude empty data.
+    cut = event_selection.dar_cut(is_event_DAR)
+
+    #Scan the tree for indices that satisfy the cut. By default we stop as soon as we have the first num_events of them; otherwise we draw a random
+    #sample from the whole tree in one pass, either from all matching events or split evenly between decays in flight and at rest.
+    if sampling == "first":
+        selected_events = list(itertools.islice(event_pipeline.iter_selected_entries(tree, cut), num_events))
+    elif sampling == "uniform":
+        selected_events = event_selection.sample_entries(tree, cut, num_events, seed).tolist()
+    elif sampling == "stratified":
+        #With only decays in flight or at rest, one of the two strata would be empty and only about half of num_events would be drawn.
+        if is_event_DAR != 2:
+            raise ValueError("sampling = 'stratified' needs is_event_DAR = 2, got " + repr(is_event_DAR))
+        ks = [num_events - num_events // 2, num_events // 2]
+        samples = event_selection.sample_entries(tree, cut, ks, seed, strata=[event_selection.DIF_CUT, event_selection.DAR_CUT])
+        selected_events = np.sort(np.concatenate(samples)).tolist()
     else:
-        cut = "Sum$(pixel_edep) > 0"
-    n = tree.Draw("Entry$", cut, "goff")
-    
-    #Get all indices that satisfy the cut.
-    events = []
-    for i in range(n):
-        events.append(tree.GetV1()[i])
-
-    selected_events = events[0:num_events]
+        raise ValueError("sampling must be 'first', 'uniform' or 'stratified', got " + repr(sampling))
     print("Indices of selected events: " + str(selected_events))
 
-    return [int(i) for i in selected_events]
+    return selected_events
 
 
 #Combines the functions we created above to give a visualization of events with the specified condition(s).
@@ -259,52 +172,78 @@ def select_events(tree, is_event_DAR, num_events):
 #display_plots = True / False controls whether event data is plotted or not.
 #num_events allows us to plot multiple events with the specified conditions from the tree.\
 #gap_times = True / False means we should show / not show gap times between decays if any are present.
-def event_visualization(tree, tree_calo, is_event_DAR, display_text_output, display_outliers, num_events):
+#n_workers (optional): When nothing is displayed, decode the events in this many processes (see parallel_extraction.py). Defaults to 1.
+#chunk_size (optional): Number of entries each worker process decodes at a time.
+#render_to (optional): Instead of showing the outliers one window at a time, render them to this .pdf file or directory of images (see
+#                      batch_render.py), with n_workers processes.
+def event_visualization(tree, tree_calo, is_event_DAR, display_text_output, display_outliers, num_events, n_workers = 1,
+                        chunk_size = parallel_extraction.DEFAULT_CHUNK_SIZE, render_to = None, geometry = DEFAULT_ATAR_GEOMETRY):
     
     #Get num_events indices for events that satisfy DAR / DIF criteria.
     event_indices = select_events(tree, is_event_DAR, num_events)
 
-    #Use max edep per plane as a heuristic to distinguish between DIFs and DARs.
-    max_Es = []
-
-    #Keep track of gap times.
-    gap_times = []
+    #If we only want the max energies and gap times, let several processes decode the events, each opening the file on its own.
+    if n_workers > 1 and not display_text_output and not display_outliers:
+        features = parallel_extraction.extract_features(tree.GetCurrentFile().GetName(), event_indices, n_workers, chunk_size, geometry)
+        return (features["max_E"].tolist(), features["gap_times"].tolist())
 
-    #For each of the event indices specified, process the corresponding event and display useful output if we want, then plot it.
-    for i in range(len(event_indices)):
-        e = process_event(tree, tree_calo, event_indices[i])
+    #Read and decode all the selected events at once. Only the events we display are turned into Event objects.
+    batch = event_decoder.decode_entries(tree, tree_calo, event_indices, geometry, compact=False)
 
+    #For each of the event indices specified, display useful output if we want, then plot it.
+    for i in range(len(batch)):
         # TODO Uncomment and fix option choice on user interface.
         if display_text_output:
-            display_event(e)
+            display_event(batch[i])
         
         # TODO Max_E should not be the only parameter by which we choose the plots we want to show.
         #Show events with abnormally large energies if we want.
-        if display_outliers and e.max_E > 1:
-            # print(e.max_E)
-            plot_event(e, 50)
-
-        for gt in e.gap_times:
-            gap_times.append(gt)
+        if display_outliers and render_to is None and batch.max_E[i] > 1:
+            plot_event(batch[i], geometry.n_planes, geometry)
+
+    if display_outliers and render_to is not None:
+        outliers = batch.max_E > 1
+        if n_workers > 1:
+            batch_render.render_events(tree.GetCurrentFile().GetName(), batch.entries[outliers], render_to, n_workers, num_planes=geometry.n_planes,
+                                       geometry=geometry)
+        else:
+            batch_render.render_batch(batch.take(outliers), render_to, num_planes=geometry.n_planes, geometry=geometry)
 
-        max_Es.append(e.max_E)
+    #Use max edep per plane as a heuristic to distinguish between DIFs and DARs, and keep track of gap times.
+    max_Es = batch.max_E.tolist()
+    gap_times = batch.gap_times.tolist()
         
     return (max_Es, gap_times)
 
 
+#Streaming version of event_visualization() for whole files: instead of returning lists of the max energies and gap times of all selected events, fill
+#histograms of them, decoding batch_size events at a time so that memory use does not grow with the number of entries.
+#max_E_edges, gap_time_edges:  Bin edges of the two histograms.
+#num_events (optional):  Only use the first num_events selected events. Defaults to all of them.
+#Returns (max_E_histogram, gap_time_histogram) as histogram.Histograms, which can be added to those of other files, saved, or passed to
+#compare_max_edep() and compare_gap_times() in place of the lists of values. Their stats hold the mean, standard deviation and approximate quantiles
+#of all values (see streaming_stats.py).
+def event_histograms(tree, tree_calo, is_event_DAR, max_E_edges, gap_time_edges, num_events = None, batch_size = event_pipeline.DEFAULT_BATCH_SIZE):
+    entries = itertools.islice(event_pipeline.iter_selected_entries(tree, event_selection.dar_cut(is_event_DAR)), num_events)
+    features = event_pipeline.map_features(event_pipeline.iter_batches(tree, tree_calo, entries, batch_size))
+
+    #Fill both histograms from the same pass over the file.
+    histograms = event_pipeline.reduce_histograms(features, {"max_E": Histogram(max_E_edges, stats=StreamingStats()),
+                                                             "gap_times": Histogram(gap_time_edges, stats=StreamingStats())})
+    return (histograms["max_E"], histograms["gap_times"])
+
+
 #Compare the maximum energy deposition of decays in flight and decays at rest. Show mean, median, and standard deviation for both sets of maximum energies, then plot them in
 #histogram form. One should notice that the DARs have a higher median energy deposited, though the means may be closer due to large outliers present in some DIF data.
 #max_Es_DIF:  Data for maximum energies from decays in flight.
 #max_Es_DAR:  Data for maximum energies from decays at rest.
-#num_bins:  Controls the number of bins used when plotting data on histograms.
+#Either can also be a histogram.Histogram of the values (e.g. from event_histograms()), in which case the mean, median and standard deviation
+#are taken from its stats (see streaming_stats.py), or estimated from its bins if it has none.
+#num_bins:  Controls the number of bins used when plotting data on histograms. Histograms keep their own bins.
 def compare_max_edep(max_Es_DIF, max_Es_DAR, num_bins):
-    max_Es_DIF_mean = np.mean(max_Es_DIF)
-    max_Es_DIF_median = np.median(max_Es_DIF)
-    max_Es_DIF_std = np.std(max_Es_DIF)
+    max_Es_DIF_mean, max_Es_DIF_median, max_Es_DIF_std = histogram.summarize(max_Es_DIF)
 
-    max_Es_DAR_mean = np.mean(max_Es_DAR)
-    max_Es_DAR_median = np.median(max_Es_DAR)
-    max_Es_DAR_std = np.std(max_Es_DAR)
+    max_Es_DAR_mean, max_Es_DAR_median, max_Es_DAR_std = histogram.summarize(max_Es_DAR)
 
     print("\nmax_Es_DIF_mean: " + str(max_Es_DIF_mean))
     print("max_Es_DIF_median: " + str(max_Es_DIF_median))
@@ -317,9 +256,10 @@ def compare_max_edep(max_Es_DIF, max_Es_DAR, num_bins):
 
     plt.figure(figsize = (20, 6))
 
-    #Plot histograms. Saving bins parameter from first plot ensures that both histograms have the same number of bins.
-    _, bins, _ = plt.hist(max_Es_DIF, bins = num_bins, color = "blue", alpha = 0.5, label = "DIF")
-    plt.hist(max_Es_DAR, bins = bins, color = "orange", alpha = 0.5, label = "DAR")
+    #Plot histograms. Lists of values are binned with the same edges, covering both of them.
+    hist_DIF, hist_DAR = histogram.as_histograms((max_Es_DIF, max_Es_DAR), num_bins)
+    hist_DIF.plot(color = "blue", alpha = 0.5, label = "DIF")
+    hist_DAR.plot(color = "orange", alpha = 0.5, label = "DAR")
     plt.title("Max Energy by Group for Decays in Flight and Decays at Rest")
     plt.xlabel("Max Energy by Group (MeV)")
     plt.ylabel("Count")
@@ -331,15 +271,12 @@ def compare_max_edep(max_Es_DIF, max_Es_DAR, num_bins):
 #gap_times: A list of times in ns.
 #gap_times_DIF:  Data for times between decays for DIFs in ns.
 #gap_times_DAR:  Data for times between decays for DARs in ns.
-#num_bins:  Controls the number of bins used when plotting data on histograms.
+#Either can also be a histogram.Histogram of the times, as for compare_max_edep().
+#num_bins:  Controls the number of bins used when plotting data on histograms. Histograms keep their own bins.
 def compare_gap_times(gap_times_DIF, gap_times_DAR, num_bins):
-    gap_times_DIF_mean = np.mean(gap_times_DIF)
-    gap_times_DIF_median = np.median(gap_times_DIF)
-    gap_times_DIF_std = np.std(gap_times_DIF)
+    gap_times_DIF_mean, gap_times_DIF_median, gap_times_DIF_std = histogram.summarize(gap_times_DIF)
 
-    gap_times_DAR_mean = np.mean(gap_times_DAR)
-    gap_times_DAR_median = np.median(gap_times_DAR)
-    gap_times_DAR_std = np.std(gap_times_DAR)
+    gap_times_DAR_mean, gap_times_DAR_median, gap_times_DAR_std = histogram.summarize(gap_times_DAR)
 
     print("\ngap_times_DIF_mean: " + str(gap_times_DIF_mean))
     print("gap_times_DIF_median: " + str(gap_times_DIF_median))
@@ -352,9 +289,10 @@ def compare_gap_times(gap_times_DIF, gap_times_DAR, num_bins):
 
     plt.figure(figsize = (20, 6))
 
-    #Plot histograms. Saving bins parameter from first plot ensures that both histograms have the same number of bins.
-    _, bins, _ = plt.hist(gap_times_DIF, bins = num_bins, color = "green", alpha = 0.5, label = "DIF")
-    plt.hist(gap_times_DAR, bins = bins, color = "brown", alpha = 0.5, label = "DAR")
+    #Plot histograms. Lists of values are binned with the same edges, covering both of them.
+    hist_DIF, hist_DAR = histogram.as_histograms((gap_times_DIF, gap_times_DAR), num_bins)
+    hist_DIF.plot(color = "green", alpha = 0.5, label = "DIF")
+    hist_DAR.plot(color = "brown", alpha = 0.5, label = "DAR")
     plt.title("Gap Times for Decays in Flight and Decays at Rest")
     plt.xlabel("Time (ns)")
     plt.ylabel("Count")
@@ -362,34 +300,43 @@ def compare_gap_times(gap_times_DIF, gap_times_DAR, num_bins):
     plt.show()
 
 
-#Compare energy deposition and gap times of DARs and DIFs for pion --> e data.
-PiEfile = r.TFile("updated_remove_zeros.root")
-PiEtree = PiEfile.Get("atar")
-PiEtree_calo = PiEfile.Get("calorimeter")
-print([x.GetName() for x in PiEtree_calo.GetListOfBranches()])
-print("\n")
-print("\n\nPion --> e Data\n\n")
-# (max_Es_DIF, gap_times_DIF) = event_visualization(PiEtree, 0, False, False, 100)
-# (max_Es_DAR, gap_times_DAR) = event_visualization(PiEtree, 1, False, False, 100)
-# compare_max_edep(max_Es_DIF, max_Es_DAR, 20)
-# compare_gap_times(gap_times_DIF, gap_times_DAR, 20)
+#The analysis this script was written for, run with python atar_exploration.py. ROOT is only imported here, so the functions above can be imported
+#without it (e.g. by atar_cli.py).
+def main():
+    import ROOT as r
+
+    #Compare energy deposition and gap times of DARs and DIFs for pion --> e data.
+    PiEfile = r.TFile("updated_remove_zeros.root")
+    PiEtree = PiEfile.Get("atar")
+    PiEtree_calo = PiEfile.Get("calorimeter")
+    print([x.GetName() for x in PiEtree_calo.GetListOfBranches()])
+    print("\n")
+    print("\n\nPion --> e Data\n\n")
+    # (max_Es_DIF, gap_times_DIF) = event_visualization(PiEtree, 0, False, False, 100)
+    # (max_Es_DAR, gap_times_DAR) = event_visualization(PiEtree, 1, False, False, 100)
+    # compare_max_edep(max_Es_DIF, max_Es_DAR, 20)
+    # compare_gap_times(gap_times_DIF, gap_times_DAR, 20)
+
+
+    #Just look at outlier plots for the pion --> e data.
+    out_data = event_visualization(PiEtree, PiEtree_calo, 0, False, True, 100)
 
 
-#Just look at outlier plots for the pion --> e data.
-out_data = event_visualization(PiEtree, PiEtree_calo, 0, False, True, 100)
+    #Compare energy deposition and gap times of DARs and DIFs for pion --> muon --> e data.
+    PiMuEfile = r.TFile("pienux_out_stripped_muons.root")
+    PiMuEtree = PiMuEfile.Get("atar")
+    # print([x.GetName() for x in tree.GetListOfBranches()])
+    # print("\n")
+    print("\n\nPion --> Muon --> e Data\n\n")
+    # (max_Es_DIF, gap_times_DIF) = event_visualization(PiMuEtree, 0, False, False, 50)
+    # (max_Es_DAR, gap_times_DAR) = event_visualization(PiMuEtree, 1, False, False, 50)
+    # compare_max_edep(max_Es_DIF, max_Es_DAR, 20)
+    # compare_gap_times(gap_times_DIF, gap_times_DAR, 20)
 
 
-#Compare energy deposition and gap times of DARs and DIFs for pion --> muon --> e data.
-PiMuEfile = r.TFile("pienux_out_stripped_muons.root")
-PiMuEtree = PiMuEfile.Get("atar")
-# print([x.GetName() for x in tree.GetListOfBranches()])
-# print("\n")
-print("\n\nPion --> Muon --> e Data\n\n")
-# (max_Es_DIF, gap_times_DIF) = event_visualization(PiMuEtree, 0, False, False, 50)
-# (max_Es_DAR, gap_times_DAR) = event_visualization(PiMuEtree, 1, False, False, 50)
-# compare_max_edep(max_Es_DIF, max_Es_DAR, 20)
-# compare_gap_times(gap_times_DIF, gap_times_DAR, 20)
+    #Just look at outlier plots for the pion --> muon --> e data.
+    out_data = event_visualization(PiMuEtree, PiEtree_calo, 0, False, True, 50)
 
 
-#Just look at outlier plots for the pion --> muon --> e data.
-out_data = event_visualization(PiMuEtree, PiEtree_calo, 0, False, True, 50)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+'''
+This class describes the layout of the simulated ATAR so that pixel IDs from the pixel_hits branch can be decoded without hardcoding the geometry.
+The ATAR is a stack of n_planes planes, each made of n_strips_per_plane strips. Pixel IDs start just after id_offset (100,000 in the current
+simulation), so with 100 strips per plane 100001 is plane 0, strip 0 and 100161 is plane 1, strip 60. The planes alternate between measuring x and y
+following orientation_pattern, which repeats every len(orientation_pattern) planes.
+
+On construction a decode table is built that maps every pixel ID of the geometry to its (plane, strip, orientation), so whole vectors of pixel hits
+are decoded with a single array index instead of floor / modulo arithmetic per hit. To study a different ATAR variant, pass a different
+ATARGeometry to the code that decodes events instead of editing any constants.
+'''
+
+import numpy as np
+
+#Orientation codes used in the decode table.
+X_ORIENTATION = 0
+Y_ORIENTATION = 1
+_orientation_codes = {"x": X_ORIENTATION, "y": Y_ORIENTATION}
+
+
+class ATARGeometry:
+
+    def __init__(self, n_planes=50, n_strips_per_plane=100, id_offset=100_000, orientation_pattern=("x", "y")):
+        if n_planes <= 0 or n_strips_per_plane <= 0:
+            raise ValueError("The ATAR needs at least one plane and one strip per plane.")
+        if len(orientation_pattern) == 0 or any(o not in _orientation_codes for o in orientation_pattern):
+            raise ValueError("orientation_pattern must be a non-empty sequence of 'x' and 'y', got " + repr(orientation_pattern))
+
+        self.n_planes = n_planes
+        self.n_strips_per_plane = n_strips_per_plane
+        self.id_offset = id_offset
+        self.orientation_pattern = tuple(orientation_pattern)
+
+        self.decode_table = self._build_decode_table()
+
+    def __repr__(self):
+        return "ATARGeometry(n_planes={}, n_strips_per_plane={}, id_offset={}, orientation_pattern={})".format(
+            self.n_planes, self.n_strips_per_plane, self.id_offset, self.orientation_pattern)
+
+    #Total number of pixels (strips over all planes) in the ATAR.
+    @property
+    def n_pixels(self):
+        return self.n_planes * self.n_strips_per_plane
+
+    #Orientation code (X_ORIENTATION or Y_ORIENTATION) of every plane, as an array of length n_planes.
+    @property
+    def plane_orientations(self):
+        pattern = np.array([_orientation_codes[o] for o in self.orientation_pattern], dtype=np.uint8)
+        return pattern[np.arange(self.n_planes) % len(pattern)]
+
+    #Build the (n_pixels, 3) table of (plane, strip, orientation), indexed by pixel ID - id_offset - 1. The smallest unsigned type that fits the
+    #geometry is used (uint8 for the current 50 x 100 ATAR) to keep the table and the decoded arrays compact.
+    def _build_decode_table(self):
+        dtype = np.min_scalar_type(max(self.n_planes, self.n_strips_per_plane) - 1)
+        pixel_index = np.arange(self.n_pixels)
+        planes = pixel_index // self.n_strips_per_plane
+
+        table = np.empty((self.n_pixels, 3), dtype=dtype)
+        table[:, 0] = planes
+        table[:, 1] = pixel_index % self.n_strips_per_plane
+        table[:, 2] = self.plane_orientations[planes]
+        return table
+
+    #Row of the decode table for each pixel ID. Raises a ValueError if any ID does not belong to this geometry.
+    def pixel_index(self, pixel_hits):
+        index = np.asarray(pixel_hits, dtype=np.int64) - (self.id_offset + 1)
+        bad = (index < 0) | (index >= self.n_pixels)
+        if bad.any():
+            raise ValueError("Pixel IDs outside of {}: {}".format(self, np.unique(index[bad] + self.id_offset + 1)[:10].tolist()))
+        return index
+
+    #Decode an array of pixel IDs. Returns (planes, strips, orientations), each an array of the same length as pixel_hits.
+    def decode(self, pixel_hits):
+        decoded = self.decode_table[self.pixel_index(pixel_hits)]
+        return decoded[:, 0], decoded[:, 1], decoded[:, 2]
+
+    #The pixel ID of a given plane and strip; the inverse of decode().
+    def pixel_id(self, plane, strip):
+        return self.id_offset + 1 + np.asarray(plane, dtype=np.int64) * self.n_strips_per_plane + np.asarray(strip, dtype=np.int64)
+
+
+#The geometry of the current simulation: 50 planes of 100 strips, pixel IDs starting at 100,000 and planes alternating x, y, x, ...
+DEFAULT_ATAR_GEOMETRY = ATARGeometry()
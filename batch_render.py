@@ -0,0 +1,224 @@
+'''
+Renders many event displays (the same panels as atar_exploration.plot_event()) to files without a display, e.g. all outliers of a file for a review
+meeting:
+
+    render_events("updated_remove_zeros.root", entries, "outliers.pdf", n_workers=16)
+    render_events("updated_remove_zeros.root", entries, "plots/", n_workers=16, format="png")
+
+plot_event() makes a new figure with new subplots for every event and waits on plt.show(). An EventRenderer instead makes one figure with the Agg
+backend (no window, no pyplot) and keeps its axes and plotted artists; drawing an event only replaces the data, colors and limits of these artists
+before the figure is saved. The events are split into chunks of consecutive entries that are rendered by a pool of worker processes (see
+parallel_extraction.py), each writing its own files: one image per event, or one PDF per chunk. The PDFs of the chunks are joined into the single
+output PDF if pypdf is installed, and otherwise left next to it as <output>.partNNNN.pdf files, in order. A single process writes the output PDF
+directly.
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import parallel_extraction
+import particle_groups
+import tree_readers
+from atar_geometry import DEFAULT_ATAR_GEOMETRY
+
+#Entries rendered by a worker at a time. Each chunk pays for setting up a figure once.
+DEFAULT_RENDER_CHUNK_SIZE = 50
+
+
+#Legend handles for the groups of hits of an event (see particle_groups.py).
+def _legend_handles(groups):
+    from matplotlib.lines import Line2D
+    return [Line2D([], [], marker="o", linestyle="", color=group.color, label=group.label) for group in groups]
+
+
+#(low, high) axis limits around values, with a margin of 5% of their range, or default if there are no finite values.
+def _limits(values, default = (0, 1)):
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return default
+    low, high = values.min(), values.max()
+    margin = 0.05 * (high - low) if high > low else 0.5
+    return (low - margin, high + margin)
+
+
+'''
+One figure with the panels of plot_event(), drawn with the Agg backend and reused for every event.
+num_planes: Planes shown on the axes of z. Defaults to the number of planes of the geometry.
+geometry: The ATARGeometry of the events; the x and y axes show all of its strips.
+'''
+class EventRenderer:
+
+    def __init__(self, num_planes = None, geometry = DEFAULT_ATAR_GEOMETRY, figsize = (15, 10), dpi = 100):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.num_planes = num_planes if num_planes is not None else geometry.n_planes
+        self.fig = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(self.fig)
+        axes = [self.fig.add_subplot(2, 4, i) for i in range(1, 6)]
+        self.ax_xz, self.ax_yz, self.ax_zt, self.ax_E, self.ax_calo = axes
+        empty = np.empty((0, 2))
+
+        #The three hit panels: one scatter each, colored hit by hit by particle type as in plot_with_color_legend().
+        self.hit_scatters = []
+        for ax, title, xlabel, ylabel in ((self.ax_xz, "x vs. z", "z (plane number)", "x (pix)"),
+                                          (self.ax_yz, "y vs. z", "z (plane number)", "y (pix)"),
+                                          (self.ax_zt, "z vs. t", "t (ns)", "z (plane number)")):
+            self.hit_scatters.append(ax.scatter(empty[:, 0], empty[:, 1], 10))
+            ax.set_title(title)
+            ax.set_xlabel(xlabel)
+            ax.set_ylabel(ylabel)
+        for ax in (self.ax_xz, self.ax_yz):
+            ax.set_xlim(0, self.num_planes)
+            ax.set_ylim(0, geometry.n_strips_per_plane)
+        self.ax_zt.set_ylim(0, self.num_planes)
+
+        self.edep_scatter = self.ax_E.scatter(empty[:, 0], empty[:, 1], 10, label="e_dep")
+        self.plane_scatter = self.ax_E.scatter(empty[:, 0], empty[:, 1], 10, "black", label="e_dep per plane")
+        self.ax_E.set_title("ATAR Energy Deposition Per Plane vs. z")
+        self.ax_E.set_xlabel("z (plane number)")
+        self.ax_E.set_ylabel("Energy (MeV / plane)")
+        self.ax_E.legend()
+
+        self.calo_scatter = self.ax_calo.scatter(empty[:, 0], empty[:, 1], c=np.empty(0), cmap="YlOrRd", edgecolors="black")
+        self.ax_calo.set_xlabel("Theta (rad)")
+        self.ax_calo.set_ylabel("Phi (rad)")
+        self.ax_calo.set_title("Energy Deposited in Calorimeter SiPMs by Theta vs. Phi")
+        self.ax_calo.set_xlim(0, 3.2)
+        self.ax_calo.set_ylim(-3.2, 3.2)
+        self.fig.colorbar(self.calo_scatter, ax=self.ax_calo).set_label("Amount of Energy Deposited")
+
+        #The title is set for every event; some text is put in it here so that the layout leaves room for it.
+        self.title = self.fig.suptitle("Entry")
+        #Lay the panels out once. Without a layout engine left on the figure, saving it draws it only once rather than twice.
+        self.fig.tight_layout()
+        self.fig.set_layout_engine(None)
+
+    #Replace the data of all panels with those of an Event (e.g. from EventBatch.event()). Returns the figure.
+    def draw(self, event, title = ""):
+        groups = particle_groups.group_hits(event.pixel_pdgs)
+        colors = particle_groups.hit_colors(groups, len(event.pixel_pdgs))
+        for scatter, (x, y) in zip(self.hit_scatters, ((event.z_data, event.x_data), (event.z_data, event.y_data), (event.t_data, event.z_data))):
+            scatter.set_offsets(np.column_stack((np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))))
+            scatter.set_facecolor(colors)
+            scatter.set_edgecolor(colors)
+        self.ax_xz.legend(handles=_legend_handles(groups))
+        self.ax_zt.set_xlim(*_limits(event.t_data))
+
+        E_per_plane = np.asarray(event.E_per_plane, dtype=np.float64)
+        self.edep_scatter.set_offsets(np.column_stack((np.asarray(event.z_data, dtype=np.float64), np.asarray(event.E_data, dtype=np.float64))))
+        self.plane_scatter.set_offsets(np.column_stack((np.arange(len(E_per_plane)), E_per_plane)))
+        self.ax_E.set_xlim(*_limits(np.arange(len(E_per_plane))))
+        self.ax_E.set_ylim(*_limits(np.concatenate((E_per_plane, np.asarray(event.E_data, dtype=np.float64)))))
+
+        #As in plot_event(), a single calorimeter hit is not drawn: it is usually the calorimeter as a whole (ID 1000) rather than a crystal.
+        if len(event.crystal_ids) > 1:
+            mask = np.asarray(event.crystal_mask, dtype=bool)
+            self.calo_scatter.set_offsets(np.asarray(event.r_theta_phis)[mask][:, 1:3])
+            values = np.asarray(event.calo_edep, dtype=np.float64)[mask]
+        else:
+            self.calo_scatter.set_offsets(np.empty((0, 2)))
+            values = np.empty(0)
+        self.calo_scatter.set_array(values)
+        self.calo_scatter.set_clim(*((values.min(), values.max()) if len(values) else (0, 1)))
+
+        self.title.set_text(title)
+        return self.fig
+
+
+'''
+Render batches of events (any iterable of EventBatches) in this process with one EventRenderer.
+output: A .pdf file, which gets one page per event, or a directory, which gets one file event_<entry>.<format> per event.
+format (optional): Image format of the files written to a directory, e.g. "png" (the default) or "svg".
+Returns the list of files written.
+'''
+def render_batches(batches, output, format = "png", renderer = None, num_planes = None, geometry = DEFAULT_ATAR_GEOMETRY):
+    renderer = renderer or EventRenderer(num_planes, geometry)
+    if output.lower().endswith(".pdf"):
+        from matplotlib.backends.backend_pdf import PdfPages
+        with PdfPages(output) as pdf:
+            for batch in batches:
+                for i in range(len(batch)):
+                    pdf.savefig(renderer.draw(batch[i], "Entry " + str(batch.entries[i])))
+        return [output]
+
+    os.makedirs(output, exist_ok=True)
+    paths = []
+    for batch in batches:
+        for i in range(len(batch)):
+            path = os.path.join(output, "event_" + str(batch.entries[i]) + "." + format)
+            renderer.draw(batch[i], "Entry " + str(batch.entries[i])).savefig(path)
+            paths.append(path)
+    return paths
+
+
+#Render the events of one EventBatch; see render_batches().
+def render_batch(batch, output, format = "png", renderer = None, num_planes = None, geometry = DEFAULT_ATAR_GEOMETRY):
+    return render_batches([batch], output, format, renderer, num_planes, geometry)
+
+
+#Decode and render chunks of entries of a file in this process, one chunk at a time, to output (a directory or a PDF). This is the work done by one
+#worker of render_events(), and all of the work with a single process.
+def _render_chunks(args):
+    file_name, chunks, output, format, num_planes, geometry, backend = args
+    with tree_readers.open_reader(file_name, backend) as reader:
+        batches = (reader.decode_entries(chunk, geometry, compact=False) for chunk in chunks)
+        return render_batches(batches, output, format, num_planes=num_planes, geometry=geometry)
+
+
+#Join the PDFs of the chunks into one with pypdf (an optional dependency). Returns the files holding the pages: [output], or the parts themselves if
+#pypdf is not installed.
+def _join_pdfs(parts, output):
+    try:
+        from pypdf import PdfWriter
+    except ImportError:
+        print("pypdf is not installed, so the pages were left in " + str(len(parts)) + " files " + parts[0] + ", ...")
+        return parts
+
+    writer = PdfWriter()
+    for part in parts:
+        writer.append(part)
+    with open(output + ".tmp", "wb") as f:
+        writer.write(f)
+    os.replace(output + ".tmp", output)
+    for part in parts:
+        os.remove(part)
+    return [output]
+
+
+'''
+Render the event displays of the given entries of a .root file in parallel.
+file_name: Path of the .root file (with the calorimeter tree, if its panel should show anything).
+entries: The entries to render, e.g. from select_events(), or those of the outliers of a study.
+output: A .pdf file with one page per event, in the order of entries, or a directory to write one image file event_<entry>.<format> per event to.
+n_workers (optional): Number of worker processes. Defaults to the number of CPUs; 1 renders everything in this process.
+chunk_size (optional): Number of entries a worker decodes and renders at a time.
+format (optional): Image format of the files written to a directory.
+num_planes, geometry (optional): See EventRenderer.
+backend (optional): The tree_readers.py backend the workers read the file with.
+Returns the list of files written.
+'''
+def render_events(file_name, entries, output, n_workers = None, chunk_size = DEFAULT_RENDER_CHUNK_SIZE, format = "png", num_planes = None,
+                  geometry = DEFAULT_ATAR_GEOMETRY, backend = "pyroot"):
+    chunks = parallel_extraction.split_entries(entries, chunk_size)
+    is_pdf = output.lower().endswith(".pdf")
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if n_workers == 1 or len(chunks) <= 1:
+        return _render_chunks((file_name, chunks, output, format, num_planes, geometry, backend))
+
+    #Every chunk of a PDF is written to its own part, as the workers cannot share one file.
+    outputs = [output[:-len(".pdf")] + ".part" + str(i).zfill(4) + ".pdf" for i in range(len(chunks))] if is_pdf else [output] * len(chunks)
+    if not is_pdf:
+        os.makedirs(output, exist_ok=True)
+    tasks = [(file_name, [chunk], chunk_output, format, num_planes, geometry, backend) for chunk, chunk_output in zip(chunks, outputs)]
+
+    #Count the entries first, so that the columnar cache is made here, if it has to be made, rather than in every worker at once.
+    parallel_extraction.count_entries(file_name, backend)
+    with ProcessPoolExecutor(max_workers=min(n_workers, len(tasks))) as executor:
+        paths = list(executor.map(_render_chunks, tasks))
+
+    if is_pdf:
+        return _join_pdfs(outputs, output)
+    return [path for chunk_paths in paths for path in chunk_paths]
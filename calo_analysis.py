@@ -5,70 +5,255 @@ calo_plus_ATAR_PEN.gdml in the method get_crystal_data(). The calorimeter geomet
 also be used in the future.
 '''
 
-from operator import indexOf
+import os
 import numpy as np
-from matplotlib import pyplot as plt
 import re
+import xml.etree.ElementTree as ET
 from scipy.spatial.transform import Rotation as Rot
 
 
 geom_file = '../crystal_test/crystals.gdml'
+
+#Crystal volumes are named like "Crystal_300123inCalo_pos"; the 5 to 7 digit number is the crystal ID used in the calorimeter tree.
+_crystal_id_pattern = re.compile(r"_(\d{5,7})in")
+
+#Factors to convert the units that can appear in a GDML file to mm (positions) and degrees (rotations). Positions without a unit are in mm, and
+#rotations without a unit are taken to be in degrees, which is what euler_to_thetaPhi() assumes by default.
+_length_units = {"mm": 1.0, "cm": 10.0, "m": 1000.0, "um": 1e-3}
+_angle_units = {"deg": 1.0, "degree": 1.0, "rad": 180 / np.pi, "radian": 180 / np.pi, "mrad": 0.18 / np.pi}
+
+
+#Returns the crystal ID in the name of a GDML element, or None if the element does not belong to a crystal (including the crystal wrappings).
+def _crystal_id(name):
+    if name is None or 'wrap' in name:
+        return None
+    match = _crystal_id_pattern.search(name)
+    return int(match.group(1)) if match else None
+
+
+#Reads the (x, y, z) attributes of a <position> or <rotation> element, converted to mm or degrees.
+def _read_xyz(element, units):
+    scale = units[element.get("unit", "mm" if units is _length_units else "deg")]
+    return [float(element.get(axis, 0.0)) * scale for axis in ("x", "y", "z")]
+
+
+'''
+Reads the positions and rotations of all crystal volumes in a GDML file in a single streaming pass. The file is parsed incrementally, so even
+full-detector files of tens of MB are never held in memory as a whole. Both named <position>/<rotation> elements (e.g. in the <define> section) and
+inline ones inside a crystal's <physvol> are understood, and the attributes may appear in any order.
+Returns three arrays:
+  ids - (N,) crystal IDs, sorted.
+  xyz - (N, 3) positions in mm. Rows are NaN for crystals that have a rotation but no position.
+  euler - (N, 3) Euler angles in degrees. Rows are NaN for crystals that have a position but no rotation.
+'''
+def read_crystal_geometry(geom_file):
+    found = {"position": {}, "rotation": {}}
+    physvol_depth = 0
+    physvol_ids = []
+
+    for event, element in ET.iterparse(geom_file, events=("start", "end")):
+        tag = element.tag.rsplit("}", 1)[-1]
+
+        if event == "start":
+            if tag == "physvol":
+                physvol_depth += 1
+                physvol_ids.append(_crystal_id(element.get("name")))
+            continue
+
+        if tag in found:
+            #Elements named after a crystal carry their own crystal ID, while other inline ones belong to the crystal volume they are placed in.
+            name = element.get("name")
+            crystal_id = _crystal_id(name)
+            if crystal_id is None and physvol_depth > 0 and 'wrap' not in (name or ""):
+                crystal_id = physvol_ids[-1]
+            if crystal_id is not None:
+                found[tag][crystal_id] = _read_xyz(element, _length_units if tag == "position" else _angle_units)
+        elif tag == "physvol":
+            physvol_depth -= 1
+            physvol_ids.pop()
+
+        #Free everything that has been read so memory use does not grow with the size of the file. Children of a physvol are kept until the
+        #physvol itself has been read.
+        if physvol_depth == 0:
+            element.clear()
+
+    ids = np.array(sorted(set(found["position"]) | set(found["rotation"])), dtype=np.int64)
+    xyz = np.full((len(ids), 3), np.nan)
+    euler = np.full((len(ids), 3), np.nan)
+    for i, crystal_id in enumerate(ids.tolist()):
+        if crystal_id in found["position"]:
+            xyz[i] = found["position"][crystal_id]
+        if crystal_id in found["rotation"]:
+            euler[i] = found["rotation"][crystal_id]
+
+    return ids, xyz, euler
+
+
+#Returns a dictionary of (crystal ID: (-x, -y, -z)) for either the positions (key = 'position name="') or the rotations (key = 'rotation name="')
+#of the crystals in the GDML file. Kept for older code; new code should use read_crystal_geometry(), which gives both at once as arrays.
 def get_crystal_data_from_gdml(geom_file, key):
-    rotations = {}
-    with open(geom_file, 'r') as gf:
-        for line in gf:
-            if(key in line and 'wrap' not in line):
-                #Only try to get a 5-digit index if the line has one in the first place.
-                if re.search("_\d{5,7}in", line) != None:
-                    id_delimited = re.findall("_\d{5,7}in", line)[0]
-                    crystal_id = int( id_delimited.split("_")[-1].split("in")[0] )
-                    x = float( line.split()[2].split('"')[1] )
-                    y = float( line.split()[3].split('"')[1] )
-                    z = float( line.split()[4].split('"')[1] )
-                    # print(crystal_id, x, y, z)
-                    # if(crystal_id < 304000):
-                    rotations[crystal_id] = (-x,-y,-z)
-                    # print(crystal_id)
-    return rotations
-
-
-#Converts a 3-Vector to spherical coordinates.
+    ids, xyz, euler = read_crystal_geometry(geom_file)
+    values = euler if 'rotation' in key else xyz
+    has_value = ~np.isnan(values).any(axis=1)
+    return {ID: tuple(-values[i]) for i, ID in enumerate(ids.tolist()) if has_value[i]}
+
+
+#Converts a 3-Vector, or an (N, 3) array of them, to spherical coordinates. Note that the first coordinate is the squared norm, which is what
+#the rest of the code has always used as "r". A single vector gives [r, theta, phi]; an (N, 3) array gives an (N, 3) array of those rows.
 def convert_to_spherical(coords):
-    # print(coords)
-    return [
-        np.linalg.norm(coords)**2,
-        np.arctan2(np.sqrt(coords[0]*coords[0] + coords[1]*coords[1]), coords[2]),
-        np.arctan2(coords[1], coords[0])
-    ]
+    coords = np.asarray(coords, dtype=np.float64)
+    x, y, z = coords[..., 0], coords[..., 1], coords[..., 2]
+    return np.stack([
+        x*x + y*y + z*z,
+        np.arctan2(np.sqrt(x*x + y*y), z),
+        np.arctan2(y, x)
+    ], axis=-1)
 
 
 #Convert the Euler angles in the GDML file into a (theta,phi) pair for plotting.
 def euler_to_thetaPhi(euler, degrees=True):
-    roti = Rot.from_euler("xyz", euler, degrees=degrees)
-    # print(roti)
-    matrix = roti.as_matrix()
-    out = np.matmul(matrix, [0,0,1])
-    print(out)
-    # theta = np.arcsin()
-    # print(matrix)
-    angles = convert_to_spherical(out)[1:]
-    # print(angles)
-    return angles
+    return euler_to_theta_phi_batch(np.asarray(euler, dtype=np.float64).reshape(1, 3), degrees=degrees)[0]
+
+
+#Convert an (N, 3) array of Euler angles into an (N, 2) array of (theta, phi) pairs in one call. Each crystal's axis is its rotation applied to the
+#z unit vector, which is just the last column of its rotation matrix, so no matrix products are needed.
+def euler_to_theta_phi_batch(euler, degrees=True):
+    euler = np.asarray(euler, dtype=np.float64).reshape(-1, 3)
+    if len(euler) == 0:
+        return np.empty((0, 2))
+    axes = Rot.from_euler("xyz", euler, degrees=degrees).as_matrix()[:, :, 2]
+    return convert_to_spherical(axes)[:, 1:]
 
 
+#Convert a dictionary of (crystal ID: Euler angles) into a dictionary of (crystal ID: (theta, phi)).
 def gdml_rotations_to_theta_phi(rotations):
-    theta_phis = {}
-    for x in rotations:
-        print(x)
-        theta_phis[x] = euler_to_thetaPhi( rotations[x])
-        # print(theta_phis[x])
-    return theta_phis
+    ids = list(rotations)
+    theta_phis = euler_to_theta_phi_batch([rotations[x] for x in ids])
+    return {x: theta_phis[i] for i, x in enumerate(ids)}
+
+
+#Default calorimeter geometry. See the module description above for other files that could be used instead.
+DEFAULT_GEOM_FILE = './calo_plus_ATAR_PEN.gdml'
+
+#Crystal geometry already loaded in this process, keyed by the absolute path of the GDML file it came from.
+_crystal_data_cache = {}
+
+
+#Path of the binary cache kept next to a GDML file, e.g. ./.calo_plus_ATAR_PEN.gdml.cache.npz.
+def get_cache_path(geom_file):
+    directory, name = os.path.split(os.path.abspath(geom_file))
+    return os.path.join(directory, "." + name + ".cache.npz")
+
+
+#The (size, modification time) pair used to tell whether a cache file still describes the GDML file it was made from.
+def _gdml_fingerprint(geom_file):
+    stat = os.stat(geom_file)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+#Load (ids, r_theta_phis) from the binary cache of geom_file. Returns None if there is no cache or if it is out of date.
+def load_crystal_cache(geom_file):
+    cache_path = get_cache_path(geom_file)
+    if not os.path.exists(cache_path):
+        return None
+
+    try:
+        with np.load(cache_path, allow_pickle=False) as cache:
+            if str(cache["geom_file"]) != os.path.abspath(geom_file) or \
+               not np.array_equal(cache["fingerprint"], _gdml_fingerprint(geom_file)):
+                return None
+            return cache["ids"], cache["r_theta_phis"]
+    except (OSError, KeyError, ValueError):
+        #A damaged or foreign cache file is treated the same as a missing one.
+        return None
+
+
+#Save (ids, r_theta_phis) to the binary cache of geom_file. The file is written under a temporary name first so that a run that is
+#interrupted part way through never leaves a half-written cache behind. Failing to write the cache (e.g. a read-only directory) is not an error.
+def save_crystal_cache(geom_file, ids, r_theta_phis):
+    cache_path = get_cache_path(geom_file)
+    tmp_path = cache_path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, geom_file=os.path.abspath(geom_file), fingerprint=_gdml_fingerprint(geom_file),
+                     ids=ids, r_theta_phis=r_theta_phis)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+'''
+Lookup table from crystal ID to (r, theta, phi). The IDs are kept sorted next to a contiguous (N, 3) array of coordinates, so a whole vector of
+crystal IDs (one event's tree_calo.crystal, or the crystal branch of an entire file flattened into one array) is translated with a single
+searchsorted and fancy index instead of one dictionary lookup per hit.
+ids: (N,) crystal IDs.
+r_theta_phis: (N, 3) coordinates of each crystal, in the same order as ids.
+'''
+class CrystalGeometry:
+
+    def __init__(self, ids, r_theta_phis):
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids, kind="stable")
+        self.ids = np.ascontiguousarray(ids[order])
+        self.r_theta_phis = np.ascontiguousarray(np.asarray(r_theta_phis, dtype=np.float64).reshape(-1, 3)[order])
+        self._as_dict = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    #Returns (indices, known), where known is a boolean mask of which crystal_ids are in the geometry and indices gives their rows in
+    #r_theta_phis. Indices of unknown IDs (e.g. the 1000 reported when the calorimeter is a single volume) are 0 and must be masked out.
+    def index_of(self, crystal_ids):
+        crystal_ids = np.asarray(crystal_ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.zeros(crystal_ids.shape, dtype=np.intp), np.zeros(crystal_ids.shape, dtype=bool)
+
+        indices = np.searchsorted(self.ids, crystal_ids)
+        indices[indices == len(self.ids)] = 0
+        known = self.ids[indices] == crystal_ids
+        indices[~known] = 0
+        return indices, known
+
+    #Returns (r_theta_phis, known) for an array of crystal IDs. The rows of unknown IDs are NaN and known is False for them.
+    def lookup(self, crystal_ids):
+        indices, known = self.index_of(crystal_ids)
+        coords = np.full(known.shape + (3,), np.nan)
+        coords[known] = self.r_theta_phis[indices[known]]
+        return coords, known
+
+    #The geometry as a dictionary of (crystal ID: [r, theta, phi]), as returned by get_crystal_data().
+    def as_dict(self):
+        if self._as_dict is None:
+            self._as_dict = {ID: coords for ID, coords in zip(self.ids.tolist(), self.r_theta_phis.tolist())}
+        return self._as_dict
 
 
 #Get information about where all our crystals are. Using this info, we later know at what locations to get the edep values from the corresponding spots
-#on the calorimeter.
-def get_crystal_data():
-    positions = get_crystal_data_from_gdml('./calo_plus_ATAR_PEN.gdml', key='position name="')
-    positions_sph = {x:convert_to_spherical(positions[x]) for x in positions}
-    
-    return positions_sph
\ No newline at end of file
+#on the calorimeter. The geometry is only parsed once per process, and is also saved to a binary cache next to the GDML file so that later runs
+#can skip parsing entirely. Set use_disk_cache = False to always re-read the GDML file.
+def get_crystal_geometry(geom_file=DEFAULT_GEOM_FILE, use_disk_cache=True):
+    key = os.path.abspath(geom_file)
+    if key in _crystal_data_cache:
+        return _crystal_data_cache[key]
+
+    cached = load_crystal_cache(geom_file) if use_disk_cache else None
+    if cached is not None:
+        ids, r_theta_phis = cached
+    else:
+        ids, xyz, _ = read_crystal_geometry(geom_file)
+        has_position = ~np.isnan(xyz).any(axis=1)
+        ids = ids[has_position]
+        r_theta_phis = convert_to_spherical(-xyz[has_position])
+        if use_disk_cache:
+            save_crystal_cache(geom_file, ids, r_theta_phis)
+
+    geometry = CrystalGeometry(ids, r_theta_phis)
+    _crystal_data_cache[key] = geometry
+
+    return geometry
+
+
+#Same as get_crystal_geometry(), but as a dictionary of (crystal ID: [r, theta, phi]).
+def get_crystal_data(geom_file=DEFAULT_GEOM_FILE, use_disk_cache=True):
+    return get_crystal_geometry(geom_file, use_disk_cache).as_dict()
@@ -1,11 +1,10 @@
-import ROOT as r
+import os
 import numpy as np
 from matplotlib import pyplot as plt
-from numpy.core.function_base import linspace
-from Event import Event
-import pandas as pd
-import seaborn as sns
-from scipy import stats
+import cut_flow
+import feature_extraction
+import histogram
+from histogram import Histogram
 
 
 #Calculates and displays the suppression factor for the two given data sets. User must specify whether the cut is above or below the given threshold.
@@ -15,6 +14,7 @@ from scipy import stats
 #  cut_threshold - (Float) The number that determines which values will be kept or cut
 #  cut_range - (2-Float Tuple) First element of tuple is lower bound of cut and second is upper bound. If one value is -1, the cut is unbounded in
 #              that direction and the other value is the cut (e.g., if we simply want less than or greater than for our cut.)
+#Returns the suppression factor. See calc_supp_factor_intervals() for confidence intervals.
 def calc_supp_factor(data_a, data_b, cut_range):
     if cut_range[0] == -1:
         cut_a = data_a[data_a.lt(cut_range[1])]
@@ -32,10 +32,31 @@ def calc_supp_factor(data_a, data_b, cut_range):
     print("Original PiMuE / PiENu ratio: ", original_data_ratio)
     print("Cut PiMuE / PiENu ratio: ", cut_data_ratio)
     print("Suppression factor:", original_data_ratio / cut_data_ratio, "\n")
+    return original_data_ratio / cut_data_ratio
 
 
-#Plots PiENu and PiMuE events on a histogram and compares their suppression factors. Can also compare DARs / DIFs if desired.
+#Calculates and displays the suppression factor for the two given data sets as calc_supp_factor() does, together with bootstrap confidence
+#intervals of the ratios and the suppression factor.
 #Params:
+#  data_a, data_b, cut_range - As for calc_supp_factor().
+#  n_bootstrap - (Int, optional) Number of bootstrap replicas (see CutFlow.bootstrap() in cut_flow.py).
+#  confidence - (Float, optional) Coverage of the bootstrap confidence intervals.
+#  seed - (Int, optional) Seed of the bootstrap replicas.
+#Returns the dictionary of (estimate, low, high) tuples of CutFlow.bootstrap().
+def calc_supp_factor_intervals(data_a, data_b, cut_range, n_bootstrap = 1000, confidence = 0.95, seed = None):
+    calc_supp_factor(data_a, data_b, cut_range)
+    flow = cut_flow.CutFlow({"PiENu": {data_a.name: data_a}, "PiMuE": {data_a.name: data_b}}, [cut_flow.Cut(data_a.name, data_a.name, cut_range)])
+    intervals = flow.bootstrap(n_replicas=n_bootstrap, confidence=confidence, seed=seed)
+    for name in ("original_ratio", "cut_ratio", "suppression_factor"):
+        estimate, low, high = intervals[name]
+        print("  " + str(round(100 * confidence)) + "% interval of " + name + ": [" + str(low) + ", " + str(high) + "]")
+    print()
+    return intervals
+
+
+#Plots PiENu and PiMuE events on a histogram and compares their suppression factors. Can also compare DARs / DIFs if desired. Returns the figure.
+#Params:
+#  pienu_data, pimue_data - (Pandas DataFrame) The PiENu and PiMuE data read from the cluster's output files.
 #  cut_var - (Str) Variable whose values we extract from the dataframes. We expect PiENu events and PiMuE events to have distinguishable distributions of this variable.
 #  cut_units - (Str) Shorthand name and units of variable for x-axis label of histogram.
 #  cut_range - (2-Float Tuple) First element of tuple is lower bound of cut and second is upper bound. If one value is -1, the cut is unbounded in
@@ -44,17 +65,17 @@ def calc_supp_factor(data_a, data_b, cut_range):
 #  title - (Str) The title of the histogram.
 #  is_comparing_DAR_DIF - (Boolean) True means we divide data 4 ways:  PiENu_DAR / PiENu_DIF / PiMuE_DAR / PiMuE_DIF. False means we stick with the usual splitting along 
 #                         PiENu / PiMuE.
-def plot_cut(cut_var, cut_units, cut_range, title, is_comparing_DAR_DIF):
-    plt.figure()
+def plot_cut(pienu_data, pimue_data, cut_var, cut_units, cut_range, title, is_comparing_DAR_DIF):
+    fig = plt.figure()
     cut_var_PiENu = pienu_data.get(cut_var)
     cut_var_PiMuE = pimue_data.get(cut_var)
 
     #Do 2 plots if simply comparing PiENu to PiMuE, do 4 plots if also splitting data on DAR / DIF.
     if not is_comparing_DAR_DIF:
-        #use numpy's histogram and hstack functions to ensure both data sets have the same bounds and number of bins.
-        bins = np.histogram(np.hstack((cut_var_PiENu, cut_var_PiMuE)), bins = 40)[1]
-        plt.hist(cut_var_PiENu, bins = bins, color = "orange", alpha = 0.5, label = "pienu_data")
-        plt.hist(cut_var_PiMuE, bins = bins, color = "blue", alpha = 0.5, label = "pimue_data")
+        #Bin both data sets with the same edges, spanning the values of both.
+        bins = histogram.shared_edges((cut_var_PiENu, cut_var_PiMuE), 40)
+        Histogram(bins).fill(cut_var_PiENu).plot(color = "orange", alpha = 0.5, label = "pienu_data")
+        Histogram(bins).fill(cut_var_PiMuE).plot(color = "blue", alpha = 0.5, label = "pimue_data")
     else:
         #Separate DAR and DIF events.
         # cut_var_PiENu_DAR = pienu_data[pienu_data["is_DAR"] == 1].get(cut_var)
@@ -75,9 +96,11 @@ def plot_cut(cut_var, cut_units, cut_range, title, is_comparing_DAR_DIF):
         '''
 
         #Calculate bins from combined data.
-        bins = np.histogram(np.hstack((cut_vars[0], cut_vars[1], cut_vars[2], cut_vars[3])), bins = 40)[1]
-        curve_x = linspace(int(bins[0]), int(bins[-1]), 40)
-        print(curve_x)
+        bins = histogram.shared_edges(cut_vars, 40)
+        curve_x = np.linspace(int(bins[0]), int(bins[-1]), 40)
+
+        #seaborn is slow to import and only needed for these plots.
+        import seaborn as sns
 
         #Iterate over all 4 cut variables and plot them.
         for i in range(0, len(cut_vars)):
@@ -97,39 +120,58 @@ def plot_cut(cut_var, cut_units, cut_range, title, is_comparing_DAR_DIF):
 
     calc_supp_factor(cut_var_PiENu, cut_var_PiMuE, cut_range)
 
+    return fig
+
+
+#Plot all the cuts we have so far for the PiENu and PiMuE data read from the given files (.csv, .parquet or .npz, e.g. made with
+#feature_extraction.extract_cut_table()), and print their suppression factors.
+#save_dir (optional): Save the plots to this directory, named after the variable that is cut on (e.g. stop_x.png), instead of showing them.
+def main(pienu_file = "output_pienu.csv", pimue_file = "output_pimue.csv", save_dir = None):
+    figs = {}
+
+    #Read data files scp'd from cluster.
+    pienu_data = feature_extraction.load_cut_table(pienu_file)
+    pimue_data = feature_extraction.load_cut_table(pimue_file)
+    # print(pienu_data.head())
+    # print(pimue_data.head())
+
 
+    #TODO: Implement cuts 1 and 4.
+    #>>>>>>>>>>>>>>>  Cut 1 - Stop in Target (Pion for DAR, Muon for DIF)  <<<<<<<<<<<<<<<
+    # plot_cut(pienu_data, pimue_data, "three_plane_E_sum", "E (MeV)", 1, "Energy Deposited 3 Planes Before Stopping Plane in ATAR", False, False)
 
 
-#Read data files scp'd from cluster.
-pienu_data = pd.read_csv("output_pienu.csv")
-pimue_data = pd.read_csv("output_pimue.csv")
-# print(pienu_data.head())
-# print(pimue_data.head())
+    #Math - Need to convert +/-8mm, 3mm, 4mm to strips / planes. Planes are 0.12mm thick, 100 strips are 2cm wide (1 strip = 0.2mm)
+    #>>>>>>>>>>>>>>>  Cut 2a - Restricted Stopping Distribution in x  <<<<<<<<<<<<<<<
+    figs["stop_x"] = plot_cut(pienu_data, pimue_data, "stop_x", "Strip Number", (50 - 8/0.2, 50 + 8/0.2), "Stopping Position in x", False)
+    #>>>>>>>>>>>>>>>  Cut 2b - Restricted Stopping Distribution in y  <<<<<<<<<<<<<<<
+    figs["stop_y"] = plot_cut(pienu_data, pimue_data, "stop_y", "Strip Number", (50 - 8/0.2, 50 + 8/0.2), "Stopping Position in y", False)
+    #>>>>>>>>>>>>>>>  Cut 2c - Restricted Stopping Distribution in x  <<<<<<<<<<<<<<<
+    figs["stop_z"] = plot_cut(pienu_data, pimue_data, "stop_z", "Plane Number", (3/0.12, 4/0.12), "Stopping Position in z", False)
 
 
-#TODO: Implement cuts 1 and 4.
-#>>>>>>>>>>>>>>>  Cut 1 - Stop in Target (Pion for DAR, Muon for DIF)  <<<<<<<<<<<<<<<
-# plot_cut("three_plane_E_sum", "E (MeV)", 1, "Energy Deposited 3 Planes Before Stopping Plane in ATAR", False, False)
+    #>>>>>>>>>>>>>>>  Cut 3 - Pion and Muon Energies  <<<<<<<<<<<<<<<
+    figs["pi_mu_energy"] = plot_cut(pienu_data, pimue_data, "pi_mu_energy", "E_Dep in ATAR (MeV)", (18.67, 19.2), "Total Energy Deposited in ATAR by Pions and Muons", True)
 
 
-#Math - Need to convert +/-8mm, 3mm, 4mm to strips / planes. Planes are 0.12mm thick, 100 strips are 2cm wide (1 strip = 0.2mm)
-#>>>>>>>>>>>>>>>  Cut 2a - Restricted Stopping Distribution in x  <<<<<<<<<<<<<<<
-plot_cut("stop_x", "Strip Number", (50 - 8/0.2, 50 + 8/0.2), "Stopping Position in x", False)
-#>>>>>>>>>>>>>>>  Cut 2b - Restricted Stopping Distribution in y  <<<<<<<<<<<<<<<
-plot_cut("stop_y", "Strip Number", (50 - 8/0.2, 50 + 8/0.2), "Stopping Position in y", False)
-#>>>>>>>>>>>>>>>  Cut 2c - Restricted Stopping Distribution in x  <<<<<<<<<<<<<<<
-plot_cut("stop_z", "Plane Number", (3/0.12, 4/0.12), "Stopping Position in z", False)
+    #>>>>>>>>>>>>>>>  Cut 4 - Tracking Cut  <<<<<<<<<<<<<<<
+    # plot_cut(pienu_data, pimue_data, "three_plane_E_sum", "E (MeV)", 1, "Energy Deposited 3 Planes Before Stopping Plane in ATAR", False, False)
 
 
-#>>>>>>>>>>>>>>>  Cut 3 - Pion and Muon Energies  <<<<<<<<<<<<<<<
-plot_cut("pi_mu_energy", "E_Dep in ATAR (MeV)", (18.67, 19.2), "Total Energy Deposited in ATAR by Pions and Muons", True)
+    #>>>>>>>>>>>>>>>  Cut 5 - EPreStop Cut  <<<<<<<<<<<<<<<
+    figs["three_plane_E_sum"] = plot_cut(pienu_data, pimue_data, "three_plane_E_sum", "E (MeV)", (-1, 1.88), "Energy Deposited 3 Planes Before Stopping Plane in ATAR", False)
 
 
-#>>>>>>>>>>>>>>>  Cut 4 - Tracking Cut  <<<<<<<<<<<<<<<
-# plot_cut("three_plane_E_sum", "E (MeV)", 1, "Energy Deposited 3 Planes Before Stopping Plane in ATAR", False, False)
+    #Efficiencies and suppression factors of all the cuts together (see cut_flow.py).
+    print(cut_flow.cut_flow_table(pienu_data, pimue_data).to_string())
 
+    if save_dir is None:
+        plt.show()
+        return
+    for cut_var, fig in figs.items():
+        fig.savefig(os.path.join(save_dir, cut_var + ".png"))
+        plt.close(fig)
 
-#>>>>>>>>>>>>>>>  Cut 5 - EPreStop Cut  <<<<<<<<<<<<<<<
-plot_cut("three_plane_E_sum", "E (MeV)", (-1, 1.88), "Energy Deposited 3 Planes Before Stopping Plane in ATAR", False)
 
-plt.show()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+'''
+A columnar copy of the atar and calorimeter trees of a .root file that is memory-mapped instead of read with GetEntry. The file is converted once,
+chunk_size entries at a time, into a directory next to it (e.g. updated_remove_zeros.root.columns/) holding one raw binary file per branch and a
+meta.json describing them:
+  atar:         hit_offsets, pixel_hits, pixel_time, pixel_edep, pixel_pdg and pion_dar (if the tree has it),
+  calorimeter:  calo_offsets, crystal and edep.
+The vector branches of all entries are stored back to back, and the hits of entry i are pixel_hits[hit_offsets[i]:hit_offsets[i + 1]] (CSR-style
+offsets, as in EventBatch). Loading the cache only maps these files into memory with np.memmap, so it is instant, ROOT is not needed, and reading a
+range of entries gives views of the mapped files rather than copies. Decoding works as for the trees (see event_decoder.py):
+
+    columns = get_columnar_cache("updated_remove_zeros.root")
+    batch = columns.decode_entries(range(0, 100_000))
+'''
+
+import json
+import os
+import shutil
+import numpy as np
+import event_decoder
+import tree_readers
+from atar_geometry import DEFAULT_ATAR_GEOMETRY
+
+#Changes whenever the layout of the cache changes, so that old caches are converted again.
+CACHE_VERSION = 1
+
+DEFAULT_CHUNK_SIZE = 100_000
+
+#Data types the branches are stored with. Pixel IDs, particle IDs and crystal IDs all fit in 32 bits; times and energies keep full precision so that
+#decoding from the cache gives exactly the same results as decoding from the trees.
+COLUMN_DTYPES = {
+    "hit_offsets": np.int64,
+    "pixel_hits": np.int32,
+    "pixel_time": np.float64,
+    "pixel_edep": np.float64,
+    "pixel_pdg": np.int32,
+    "pion_dar": np.int8,
+    "calo_offsets": np.int64,
+    "crystal": np.int32,
+    "edep": np.float64,
+}
+
+#Per-hit and per-calorimeter-hit columns, and the offsets column that splits them into entries.
+HIT_COLUMNS = ("pixel_hits", "pixel_time", "pixel_edep", "pixel_pdg")
+CALO_COLUMNS = ("crystal", "edep")
+
+
+#Path of the columnar cache directory of a .root file.
+def get_columns_path(file_name):
+    return file_name + ".columns"
+
+
+#Gather the blocks offsets[i]:offsets[i + 1] of the given arrays for the given entries. Consecutive entries give views of the arrays without
+#copying; any other selection is gathered into new arrays.
+def _take_ragged(offsets, entries, arrays):
+    if len(entries) > 0 and np.array_equal(entries, np.arange(entries[0], entries[0] + len(entries))):
+        start, stop = offsets[entries[0]], offsets[entries[-1] + 1]
+        return offsets[entries[0]:entries[-1] + 2] - start, [a[start:stop] for a in arrays]
+
+    lengths = offsets[entries + 1] - offsets[entries]
+    new_offsets = event_decoder.lengths_to_offsets(lengths)
+    flat_index = np.repeat(offsets[entries] - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+    return new_offsets, [a[flat_index] for a in arrays]
+
+
+'''
+The memory-mapped columns of a converted .root file (see the module description). columns["pixel_edep"] etc. are the mapped arrays.
+'''
+class ColumnarCache:
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != CACHE_VERSION:
+            raise ValueError(path + " was written by a different version of columnar_cache.py; convert the .root file again.")
+
+        self.columns = {}
+        for name, info in self.meta["columns"].items():
+            dtype = np.dtype(info["dtype"])
+            if info["length"] == 0:
+                #np.memmap cannot map an empty file.
+                self.columns[name] = np.empty(0, dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(os.path.join(path, name + ".bin"), dtype=dtype, mode="r", shape=(info["length"],))
+
+    def __len__(self):
+        return self.meta["n_entries"]
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    #True if the cache has the calorimeter tree.
+    @property
+    def has_calo(self):
+        return "calo_offsets" in self.columns
+
+    #True if the cache was made from the current version of the given .root file.
+    def is_current(self, file_name):
+        stat = os.stat(file_name)
+        return self.meta.get("fingerprint") == [stat.st_size, stat.st_mtime_ns]
+
+    #The same dictionary of flat arrays as event_decoder.read_entries() gives for the given entries (all of them by default), but sliced out of the
+    #mapped columns. With read_calo = False, or if the cache has no calorimeter tree, the calorimeter arrays are left out.
+    def read_entries(self, entries = None, read_calo = True):
+        entries = np.arange(len(self)) if entries is None else np.asarray(entries, dtype=np.int64).reshape(-1)
+        if len(entries) > 0 and (entries.min() < 0 or entries.max() >= len(self)):
+            raise IndexError("Entries must be from 0 to " + str(len(self) - 1))
+
+        hit_offsets, hit_arrays = _take_ragged(self.columns["hit_offsets"], entries, [self.columns[name] for name in HIT_COLUMNS])
+        data = {"entries": entries, "hit_offsets": hit_offsets, **dict(zip(HIT_COLUMNS, hit_arrays)),
+                "pion_dar": self.columns["pion_dar"][entries] if "pion_dar" in self.columns else None}
+
+        if read_calo and self.has_calo:
+            calo_offsets, calo_arrays = _take_ragged(self.columns["calo_offsets"], entries, [self.columns[name] for name in CALO_COLUMNS])
+            data.update(calo_offsets=calo_offsets, **dict(zip(CALO_COLUMNS, calo_arrays)))
+        return data
+
+    #Decode the given entries (all of them by default) into an EventBatch, as event_decoder.decode_entries() does for the trees.
+    def decode_entries(self, entries = None, geometry = DEFAULT_ATAR_GEOMETRY, gap_threshold = event_decoder.DEFAULT_GAP_THRESHOLD, compact = True,
+                       read_calo = True):
+        return event_decoder.decode_data(self.read_entries(entries, read_calo), geometry, gap_threshold, compact)
+
+
+'''
+Convert the trees of a .root file into a columnar cache directory, reading chunk_size entries at a time so that the file never has to fit in memory.
+The cache is written to a temporary directory first and only moved into place once it is complete.
+file_name: Path of the .root file.
+path (optional): Where to write the cache. Defaults to get_columns_path(file_name).
+read_calo (optional): Also convert the calorimeter tree.
+backend (optional): The tree_readers.py backend the file is read with, "pyroot" (the default) or "uproot", which does not need ROOT at all.
+Returns the loaded ColumnarCache.
+'''
+def convert_to_columns(file_name, path = None, chunk_size = DEFAULT_CHUNK_SIZE, read_calo = True, backend = "pyroot"):
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive, got " + str(chunk_size))
+    path = path or get_columns_path(file_name)
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    with tree_readers.open_reader(file_name, backend) as reader:
+        n_entries = reader.n_entries
+        has_calo = read_calo and reader.has_branch(tree_readers.CALO_TREE, "crystal")
+        names = ["hit_offsets", *HIT_COLUMNS]
+        if reader.has_branch(tree_readers.ATAR_TREE, "pion_dar"):
+            names.append("pion_dar")
+        if has_calo:
+            names += ["calo_offsets", *CALO_COLUMNS]
+
+        files = {name: open(os.path.join(tmp_path, name + ".bin"), "wb") for name in names}
+        lengths = dict.fromkeys(names, 0)
+        try:
+            #Offsets are written without their leading 0 per chunk (apart from the first), shifted by the hits written before.
+            for name in names:
+                if name.endswith("_offsets"):
+                    np.zeros(1, dtype=COLUMN_DTYPES[name]).tofile(files[name])
+                    lengths[name] = 1
+            n_written = {"hit_offsets": 0, "calo_offsets": 0}
+
+            for start in range(0, n_entries, chunk_size):
+                data = reader.read_entries(np.arange(start, min(start + chunk_size, n_entries)), has_calo)
+                chunk = {name: data[name] for name in names if not name.endswith("_offsets")}
+                for name in n_written:
+                    if name in files:
+                        chunk[name] = data[name][1:] + n_written[name]
+                        n_written[name] += data[name][-1]
+
+                for name, values in chunk.items():
+                    values = np.asarray(values, dtype=COLUMN_DTYPES[name])
+                    values.tofile(files[name])
+                    lengths[name] += len(values)
+        finally:
+            for f in files.values():
+                f.close()
+
+    stat = os.stat(file_name)
+    meta = {
+        "version": CACHE_VERSION,
+        "source": os.path.abspath(file_name),
+        "fingerprint": [stat.st_size, stat.st_mtime_ns],
+        "n_entries": n_entries,
+        "read_calo": read_calo,
+        "columns": {name: {"dtype": np.dtype(COLUMN_DTYPES[name]).str, "length": lengths[name]} for name in names},
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return ColumnarCache(path)
+
+
+#The columnar cache of a .root file, converting the file first if it has no up to date cache (or, with read_calo = True, none with the calorimeter).
+def get_columnar_cache(file_name, path = None, chunk_size = DEFAULT_CHUNK_SIZE, read_calo = True, backend = "pyroot"):
+    path = path or get_columns_path(file_name)
+    if os.path.exists(os.path.join(path, "meta.json")):
+        try:
+            cache = ColumnarCache(path)
+        except ValueError:
+            cache = None
+        if cache is not None and cache.is_current(file_name) and (cache.meta["read_calo"] or not read_calo):
+            return cache
+    return convert_to_columns(file_name, path, chunk_size, read_calo, backend)
@@ -0,0 +1,267 @@
+'''
+Cut flow of the PiENu / PiMuE cut study: all cuts applied to both samples at once, with the per-cut, cumulative and N-1 efficiencies of every cut
+and the suppression factors that go with them, as calc_supp_factor() in cluster_data_analysis.py gives for one cut at a time.
+
+Each sample is evaluated once: every cut gives one row of a pass / fail matrix, which is packed into bits (8 events per byte). Every number in the
+table is then a bitwise AND of rows of that matrix followed by a population count through a 256-entry lookup table, so other orders and subsets of
+the cuts are evaluated in milliseconds even for tens of millions of events:
+
+    flow = CutFlow({"PiENu": pienu_data, "PiMuE": pimue_data})
+    print(flow.table())
+    print(flow.suppression_factor(["stop_x", "stop_y", "pi_mu_energy"]))
+
+The suppression factor of a set of cuts is (original PiMuE / PiENu ratio) / (PiMuE / PiENu ratio after the cuts), which is the efficiency of the
+cuts for PiENu divided by their efficiency for PiMuE.
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+#Number of bootstrap replicas drawn from one random stream. Every block of replicas has its own stream, so the replicas do not depend on how the
+#blocks are grouped into chunks.
+BOOTSTRAP_BLOCK_SIZE = 100
+
+#Number of set bits of every byte value.
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+'''
+A cut on one variable of the cut study tables (see feature_extraction.py), in the convention of calc_supp_factor(): cut_range is (low, high) and
+keeps low < value < high, where -1 leaves that side open (e.g. (-1, 1.88) keeps value < 1.88). Events where the variable is NaN never pass.
+'''
+class Cut:
+
+    def __init__(self, name, variable, cut_range, title = None):
+        self.name = name
+        self.variable = variable
+        self.cut_range = cut_range
+        self.title = title or name
+
+    def __repr__(self):
+        return "Cut(" + repr(self.name) + ", " + repr(self.variable) + ", " + repr(self.cut_range) + ")"
+
+    #Boolean array of which rows of the table pass the cut.
+    def mask(self, data):
+        values = np.asarray(data[self.variable], dtype=np.float64)
+        low, high = self.cut_range
+        keep = np.ones(len(values), dtype=bool)
+        if low != -1:
+            keep &= values > low
+        if high != -1:
+            keep &= values < high
+        return keep
+
+
+#The cuts of cluster_data_analysis.main(). Planes are 0.12 mm thick and strips 0.2 mm wide, so +/- 8 mm around the center is strip 10 to 90 and
+#3 to 4 mm deep is plane 25 to 33.3. Cuts 1 (stop in target) and 4 (tracking) are still to be added.
+STANDARD_CUTS = [
+    Cut("stop_x", "stop_x", (50 - 8/0.2, 50 + 8/0.2), "2a: Stopping Position in x"),
+    Cut("stop_y", "stop_y", (50 - 8/0.2, 50 + 8/0.2), "2b: Stopping Position in y"),
+    Cut("stop_z", "stop_z", (3/0.12, 4/0.12), "2c: Stopping Position in z"),
+    Cut("pi_mu_energy", "pi_mu_energy", (18.67, 19.2), "3: Pion and Muon Energies"),
+    Cut("three_plane_E_sum", "three_plane_E_sum", (-1, 1.88), "5: EPreStop"),
+]
+
+
+#Number of set bits in each row of a packed bit matrix (or in a single packed row).
+def count_bits(packed):
+    return _POPCOUNT[packed].sum(axis=-1, dtype=np.int64)
+
+
+#Number of rows of a table (a pandas DataFrame, or a dictionary of arrays of the same length).
+def n_rows(data):
+    if hasattr(data, "columns"):
+        return len(data)
+    return len(np.asarray(next(iter(data.values())))) if len(data) else 0
+
+
+#Pack the pass / fail rows of all cuts for one table into a (n_cuts, ceil(n_rows / 8)) matrix of bits. Padding bits at the end are 0.
+def pack_masks(data, cuts):
+    masks = np.empty((len(cuts), n_rows(data)), dtype=bool)
+    for row, cut in zip(masks, cuts):
+        row[:] = cut.mask(data)
+    return np.packbits(masks, axis=1)
+
+
+#a / b elementwise (e.g. of efficiencies or counts), NaN where b is 0 instead of a warning and an infinity.
+def safe_ratio(a, b):
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    return np.divide(a, b, out=np.full(np.broadcast(a, b).shape, np.nan), where=b != 0)
+
+
+'''
+The packed pass / fail matrices of a set of cuts for several samples.
+samples: Dictionary of sample name: table (a pandas DataFrame, or a dictionary of arrays) with the variables the cuts use. The first two samples are
+         the signal (PiENu) and background (PiMuE) of the suppression factors unless set otherwise in table() and suppression_factor().
+cuts (optional): List of Cuts. Defaults to STANDARD_CUTS.
+'''
+class CutFlow:
+
+    def __init__(self, samples, cuts = None):
+        self.cuts = list(STANDARD_CUTS if cuts is None else cuts)
+        self.names = [cut.name for cut in self.cuts]
+        if len(set(self.names)) != len(self.names):
+            raise ValueError("Cut names must be unique, got " + ", ".join(self.names))
+        self.sample_names = list(samples)
+        self.n_events = {name: n_rows(data) for name, data in samples.items()}
+        self.bits = {name: pack_masks(data, self.cuts) for name, data in samples.items()}
+
+    #Row numbers of the given cuts (names or Cuts), all cuts if None.
+    def _rows(self, cuts):
+        if cuts is None:
+            return list(range(len(self.cuts)))
+        return [self.names.index(cut.name if isinstance(cut, Cut) else cut) for cut in cuts]
+
+    #Packed mask of the events of a sample passing all of the given cuts.
+    def passing(self, sample, cuts = None):
+        bits = self.bits[sample]
+        rows = self._rows(cuts)
+        if not rows:
+            return np.packbits(np.ones(self.n_events[sample], dtype=bool))
+        return np.bitwise_and.reduce(bits[rows], axis=0)
+
+    #Number of events of a sample passing all of the given cuts.
+    def count(self, sample, cuts = None):
+        return int(count_bits(self.passing(sample, cuts)))
+
+    #Fraction of the events of a sample passing all of the given cuts.
+    def efficiency(self, sample, cuts = None):
+        return float(safe_ratio(self.count(sample, cuts), self.n_events[sample]))
+
+    #Suppression factor of the given cuts (all of them by default): efficiency for the signal sample / efficiency for the background sample.
+    def suppression_factor(self, cuts = None, signal = None, background = None):
+        signal = signal or self.sample_names[0]
+        background = background or self.sample_names[1]
+        return float(safe_ratio(self.efficiency(signal, cuts), self.efficiency(background, cuts)))
+
+    #Pass counts of every cut alone, of the cuts applied one after the other in the given order, and of all cuts but one, for one sample.
+    def _flow_counts(self, sample, rows):
+        bits = self.bits[sample][rows]
+        n_bytes = bits.shape[1]
+        each = count_bits(bits)
+        cumulative = np.bitwise_and.accumulate(bits, axis=0)
+
+        #All cuts but cut i is the AND of the cuts before it (cumulative) and those after it (the same from the end).
+        all_bits = np.packbits(np.ones(self.n_events[sample], dtype=bool))
+        before = np.vstack((all_bits.reshape(1, n_bytes), cumulative[:-1]))
+        after = np.vstack((np.bitwise_and.accumulate(bits[::-1], axis=0)[::-1][1:], all_bits.reshape(1, n_bytes)))
+        return each, count_bits(cumulative), count_bits(before & after)
+
+    '''
+    The cut flow as a pandas DataFrame with one row per cut, in the given order (the order of the cuts by default). For every sample it has the
+    columns <sample>_eff (the cut alone), <sample>_cum_eff (this cut and all before it) and <sample>_n-1_eff (all cuts but this one), and for the
+    signal and background the suppression factors supp, cum_supp and n-1_supp of the same sets of cuts.
+    '''
+    def table(self, order = None, signal = None, background = None):
+        import pandas as pd
+        rows = self._rows(order)
+        signal = signal or self.sample_names[0]
+        if background is None and len(self.sample_names) > 1:
+            background = self.sample_names[1]
+
+        columns = {}
+        efficiencies = {}
+        for sample in self.sample_names:
+            counts = self._flow_counts(sample, rows)
+            efficiencies[sample] = [safe_ratio(c, self.n_events[sample]) for c in counts]
+            for suffix, eff in zip(("_eff", "_cum_eff", "_n-1_eff"), efficiencies[sample]):
+                columns[sample + suffix] = eff
+
+        if background is not None:
+            for name, i in (("supp", 0), ("cum_supp", 1), ("n-1_supp", 2)):
+                columns[name] = safe_ratio(efficiencies[signal][i], efficiencies[background][i])
+
+        table = pd.DataFrame(columns, index=[self.names[row] for row in rows])
+        table.index.name = "cut"
+        return table
+
+    #Number of events of a sample with each pattern of passed cuts: entry p counts the events that passed exactly the cuts whose bits are set in p
+    #(bit i for the i-th of the given cuts). Events are unpacked chunk_size bytes (8 events per byte) at a time.
+    def pattern_counts(self, sample, cuts = None, chunk_size = 1 << 20):
+        rows = self._rows(cuts)
+        bits = self.bits[sample][rows]
+        weights = (1 << np.arange(len(rows), dtype=np.int64)).reshape(-1, 1)
+        counts = np.zeros(1 << len(rows), dtype=np.int64)
+        for start in range(0, bits.shape[1], chunk_size):
+            patterns = (np.unpackbits(bits[:, start:start + chunk_size], axis=1).astype(np.int64) * weights).sum(axis=0)
+            counts += np.bincount(patterns, minlength=len(counts))
+        #The padding bits after the last event look like events that failed every cut.
+        counts[0] -= bits.shape[1] * 8 - self.n_events[sample]
+        return counts
+
+    '''
+    Bootstrap confidence intervals of the original PiMuE / PiENu ratio, the ratio after the given cuts (all of them by default) and the suppression
+    factor. Resampling events only changes how many events there are of each pattern of passed cuts (see pattern_counts()), so instead of
+    resampling the events, every replica draws these few counts directly, which gives exactly the same distribution:
+      method = "poisson":      every event gets a Poisson(1) weight, so the count of each pattern is Poisson(its count),
+      method = "multinomial":  every sample is resampled with replacement to its own size, so the counts are multinomial.
+    n_replicas: Number of bootstrap replicas.
+    confidence: Coverage of the (percentile) intervals.
+    seed: Seed of the random numbers. The replicas do not depend on n_workers or chunk_size.
+    chunk_size: Number of replicas drawn at a time, which bounds the memory used. Rounded down to whole blocks of BOOTSTRAP_BLOCK_SIZE replicas.
+    n_workers: Number of processes drawing chunks of replicas.
+    Returns a dictionary with original_ratio, cut_ratio and suppression_factor, each an (estimate, low, high) tuple, and the replicas of the
+    suppression factor under "replicas".
+    '''
+    def bootstrap(self, cuts = None, n_replicas = 1000, confidence = 0.95, method = "poisson", seed = None, chunk_size = 1000, n_workers = 1,
+                  signal = None, background = None):
+        if method not in ("poisson", "multinomial"):
+            raise ValueError("method must be 'poisson' or 'multinomial', got " + repr(method))
+        signal = signal or self.sample_names[0]
+        background = background or self.sample_names[1]
+        counts = [self.pattern_counts(sample, cuts) for sample in (signal, background)]
+
+        #Seeds of the blocks of replicas, so that every block gets the same random numbers in whichever chunk and process it is drawn.
+        blocks = [min(BOOTSTRAP_BLOCK_SIZE, n_replicas - start) for start in range(0, n_replicas, BOOTSTRAP_BLOCK_SIZE)]
+        seeds = np.random.SeedSequence(seed).spawn(len(blocks))
+        blocks_per_chunk = max(1, chunk_size // BOOTSTRAP_BLOCK_SIZE)
+        tasks = [(counts, blocks[i:i + blocks_per_chunk], method, seeds[i:i + blocks_per_chunk]) for i in range(0, len(blocks), blocks_per_chunk)]
+        if n_workers == 1 or len(tasks) <= 1:
+            parts = [_bootstrap_chunk(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=min(n_workers or os.cpu_count() or 1, len(tasks))) as executor:
+                parts = list(executor.map(_bootstrap_chunk, tasks))
+        totals = np.concatenate(parts, axis=1) if parts else np.empty((4, 0), dtype=np.int64)
+
+        #Rows of totals: all signal events, signal events passing the cuts, and the same for the background.
+        original_ratios = safe_ratio(totals[2], totals[0])
+        cut_ratios = safe_ratio(totals[3], totals[1])
+        suppression_factors = safe_ratio(original_ratios, cut_ratios)
+
+        estimates = [safe_ratio(counts[1].sum(), counts[0].sum()), safe_ratio(counts[1][-1], counts[0][-1])]
+        estimates.append(safe_ratio(estimates[0], estimates[1]))
+        percentiles = [50 * (1 - confidence), 50 * (1 + confidence)]
+        result = {}
+        for name, estimate, replicas in zip(("original_ratio", "cut_ratio", "suppression_factor"), estimates,
+                                            (original_ratios, cut_ratios, suppression_factors)):
+            low, high = np.nanpercentile(replicas, percentiles) if np.isfinite(replicas).any() else (np.nan, np.nan)
+            result[name] = (float(estimate), float(low), float(high))
+        result["replicas"] = suppression_factors
+        return result
+
+
+#Work done for one chunk of bootstrap replicas: draw the pattern counts of both samples for every block of the chunk (its number of replicas and
+#seed), and return, for every replica, the number of signal events, signal events passing all cuts, background events and background events passing
+#all cuts, as a (4, n_replicas) array.
+def _bootstrap_chunk(args):
+    counts, block_sizes, method, seeds = args
+    parts = []
+    for n_replicas, seed in zip(block_sizes, seeds):
+        rng = np.random.default_rng(seed)
+        totals = []
+        for pattern_counts in counts:
+            if method == "poisson":
+                replicas = rng.poisson(pattern_counts, size=(n_replicas, len(pattern_counts)))
+            else:
+                n_events = pattern_counts.sum()
+                replicas = rng.multinomial(n_events, pattern_counts / max(n_events, 1), size=n_replicas)
+            #The last pattern is the one with every cut passed.
+            totals += [replicas.sum(axis=1), replicas[:, -1]]
+        parts.append(np.array(totals))
+    return np.concatenate(parts, axis=1)
+
+
+#The cut flow table of the standard cuts (or the given ones) for the PiENu and PiMuE tables of cluster_data_analysis.py.
+def cut_flow_table(pienu_data, pimue_data, cuts = None):
+    return CutFlow({"PiENu": pienu_data, "PiMuE": pimue_data}, cuts).table()
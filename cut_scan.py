@@ -0,0 +1,148 @@
+'''
+Scans of cut thresholds for the cut study: the PiENu (signal) efficiency and suppression factor of every cut on a dense grid of thresholds, instead of
+calling plot_cut() once per candidate. The values of a variable are sorted once per sample, after which the number of events passing any number of
+thresholds is a binary search (np.searchsorted) per threshold, so a whole grid costs O(n log n + grid size):
+
+    scan = scan_window(pienu_data, pimue_data, "pi_mu_energy", np.linspace(18, 19, 101), np.linspace(19, 20, 101))
+    best = pareto_frontier(scan)
+
+Two variables are scanned together with scan_2d(), which counts the events in the cells of the threshold grid once and answers every pair of
+thresholds from a summed-area table (2D cumulative sums) of those counts.
+
+Cuts keep low < value < high as in calc_supp_factor(), events where the variable is NaN never pass, and efficiencies are fractions of all events of a
+sample. Other cuts can be applied first with signal_mask / background_mask (e.g. CutFlow.passing() unpacked), to scan one cut with the others in place.
+'''
+
+import numpy as np
+from cut_flow import Cut, safe_ratio
+
+
+#The values of one variable of one sample, sorted once so that the number of values above, below or between any thresholds is a binary search.
+#mask (optional): Only count the events where mask is True, e.g. those passing the other cuts. n_events stays the number of all events.
+class SortedValues:
+
+    def __init__(self, values, mask = None):
+        values = np.asarray(values, dtype=np.float64)
+        self.n_events = len(values)
+        if mask is not None:
+            values = values[np.asarray(mask, dtype=bool)]
+        self.values = np.sort(values[~np.isnan(values)])
+
+    #Number of values < each threshold.
+    def count_below(self, thresholds):
+        return np.searchsorted(self.values, thresholds, side="left")
+
+    #Number of values > each threshold.
+    def count_above(self, thresholds):
+        return len(self.values) - np.searchsorted(self.values, thresholds, side="right")
+
+    #(len(lows), len(highs)) number of values with low < value < high for every pair of a low and a high threshold (0 where low >= high).
+    def count_between(self, lows, highs):
+        at_most_low = np.searchsorted(self.values, lows, side="right")
+        below_high = self.count_below(highs)
+        return np.maximum(below_high[np.newaxis, :] - at_most_low[:, np.newaxis], 0)
+
+
+#Efficiencies and suppression factors as a DataFrame, from pass counts of the signal and the background.
+def _scan_table(columns, signal_counts, background_counts, n_signal, n_background):
+    import pandas as pd
+    columns = dict(columns)
+    columns["signal_eff"] = safe_ratio(signal_counts, n_signal)
+    columns["background_eff"] = safe_ratio(background_counts, n_background)
+    columns["supp"] = safe_ratio(columns["signal_eff"], columns["background_eff"])
+    return pd.DataFrame(columns)
+
+
+#Evenly spaced thresholds from the smallest to the largest finite value of a variable in both samples.
+def default_thresholds(signal, background, variable, n_thresholds = 101):
+    values = np.concatenate((np.asarray(signal[variable], dtype=np.float64), np.asarray(background[variable], dtype=np.float64)))
+    values = values[np.isfinite(values)]
+    return np.linspace(values.min(), values.max(), n_thresholds) if len(values) else np.empty(0)
+
+
+'''
+Scan two-sided windows low < variable < high of one variable.
+signal, background: Tables (pandas DataFrames or dictionaries of arrays) of the PiENu and PiMuE samples.
+lows, highs: Thresholds to scan. Every low is paired with every higher high; use -np.inf or np.inf for one-sided cuts.
+signal_mask, background_mask (optional): Only count events where these are True (see the module description).
+Returns a DataFrame with one row per window: low, high, signal_eff, background_eff and supp.
+'''
+def scan_window(signal, background, variable, lows, highs, signal_mask = None, background_mask = None):
+    lows, highs = np.asarray(lows, dtype=np.float64), np.asarray(highs, dtype=np.float64)
+    sorted_signal = SortedValues(signal[variable], signal_mask)
+    sorted_background = SortedValues(background[variable], background_mask)
+
+    low_grid, high_grid = np.meshgrid(lows, highs, indexing="ij")
+    is_window = low_grid < high_grid
+    return _scan_table({"low": low_grid[is_window], "high": high_grid[is_window]},
+                       sorted_signal.count_between(lows, highs)[is_window], sorted_background.count_between(lows, highs)[is_window],
+                       sorted_signal.n_events, sorted_background.n_events)
+
+
+#Scan one-sided cuts of one variable: variable < threshold with side = "upper", variable > threshold with side = "lower". See scan_window() for the
+#other arguments. Returns a DataFrame with one row per threshold: threshold, signal_eff, background_eff and supp.
+def scan_threshold(signal, background, variable, thresholds, side = "upper", signal_mask = None, background_mask = None):
+    if side not in ("upper", "lower"):
+        raise ValueError("side must be 'upper' or 'lower', got " + repr(side))
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    sorted_signal = SortedValues(signal[variable], signal_mask)
+    sorted_background = SortedValues(background[variable], background_mask)
+    count = "count_below" if side == "upper" else "count_above"
+    return _scan_table({"threshold": thresholds}, getattr(sorted_signal, count)(thresholds), getattr(sorted_background, count)(thresholds),
+                       sorted_signal.n_events, sorted_background.n_events)
+
+
+#Summed-area table of the events of one sample over a grid of one-sided thresholds on two variables: entry (i, j) is the number of events passing
+#the i-th threshold on x and the j-th threshold on y. Every event is put in the cell of the grid between the thresholds it passes and those it fails,
+#and the cells are summed over the thresholds they pass.
+def _summed_area(x, y, x_thresholds, y_thresholds, x_side, y_side, mask):
+    def cells(values, thresholds, side):
+        #With side = "upper" an event passes threshold i (value < t_i) if i >= the number of thresholds <= value; with side = "lower" (value > t_i)
+        #if i < the number of thresholds < value.
+        return np.searchsorted(thresholds, values, side="right" if side == "upper" else "left")
+
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    keep = ~(np.isnan(x) | np.isnan(y))
+    if mask is not None:
+        keep &= np.asarray(mask, dtype=bool)
+    n_x, n_y = len(x_thresholds) + 1, len(y_thresholds) + 1
+    counts = np.bincount(cells(x[keep], x_thresholds, x_side) * n_y + cells(y[keep], y_thresholds, y_side),
+                         minlength=n_x * n_y).reshape(n_x, n_y)
+
+    counts = np.cumsum(counts, axis=0) if x_side == "upper" else np.cumsum(counts[::-1], axis=0)[::-1][1:]
+    counts = np.cumsum(counts, axis=1) if y_side == "upper" else np.cumsum(counts[:, ::-1], axis=1)[:, ::-1][:, 1:]
+    return counts[:len(x_thresholds), :len(y_thresholds)]
+
+
+'''
+Scan pairs of one-sided cuts on two variables, e.g. stop_z < a together with three_plane_E_sum < b, over the grid of all x_thresholds and
+y_thresholds. x_side and y_side are "upper" (variable < threshold) or "lower" (variable > threshold). See scan_window() for the other arguments.
+Returns a DataFrame with one row per pair of thresholds: x_threshold, y_threshold, signal_eff, background_eff and supp.
+'''
+def scan_2d(signal, background, x_variable, y_variable, x_thresholds, y_thresholds, x_side = "upper", y_side = "upper", signal_mask = None,
+            background_mask = None):
+    for side in (x_side, y_side):
+        if side not in ("upper", "lower"):
+            raise ValueError("x_side and y_side must be 'upper' or 'lower', got " + repr(side))
+    x_thresholds, y_thresholds = np.sort(np.asarray(x_thresholds, dtype=np.float64)), np.sort(np.asarray(y_thresholds, dtype=np.float64))
+
+    signal_counts = _summed_area(signal[x_variable], signal[y_variable], x_thresholds, y_thresholds, x_side, y_side, signal_mask)
+    background_counts = _summed_area(background[x_variable], background[y_variable], x_thresholds, y_thresholds, x_side, y_side, background_mask)
+    x_grid, y_grid = np.meshgrid(x_thresholds, y_thresholds, indexing="ij")
+    return _scan_table({"x_threshold": x_grid.ravel(), "y_threshold": y_grid.ravel()}, signal_counts.ravel(), background_counts.ravel(),
+                       len(np.asarray(signal[x_variable])), len(np.asarray(background[x_variable])))
+
+
+#The rows of a scan on the efficiency / suppression frontier: those for which no other row has both a higher (or equal) signal efficiency and a
+#higher suppression factor. Sorted by decreasing signal efficiency, so the suppression factor increases down the table.
+def pareto_frontier(scan, efficiency = "signal_eff", suppression = "supp"):
+    scan = scan[np.isfinite(scan[suppression])]
+    ordered = scan.sort_values([efficiency, suppression], ascending=[False, False], kind="stable")
+    supp = ordered[suppression].to_numpy()
+    best_before = np.maximum.accumulate(np.concatenate(([-np.inf], supp[:-1])))
+    return ordered[supp > best_before]
+
+
+#A cut_flow.Cut for a window found by a scan, with infinite thresholds turned into the -1 (unbounded) of calc_supp_factor().
+def window_to_cut(variable, low, high, name = None):
+    return Cut(name or variable, variable, (-1 if np.isinf(low) else float(low), -1 if np.isinf(high) else float(high)))
@@ -0,0 +1,194 @@
+'''
+This module turns the raw branches of the ATAR and calorimeter trees into decoded events. Instead of walking the hits of an event one at a time, the
+pixel_hits / pixel_time / pixel_edep / pixel_pdg vectors of one event or a whole range of events are read into flat arrays and decoded in one go
+with NumPy: the pixel IDs through the decode table of an ATARGeometry, the energy per plane with np.bincount, and the large time gaps with
+np.diff of the hit times of every event in time order. The result is an EventBatch (see Event.py), from which single Events can be taken for plotting.
+
+decode_event() gives the same Event that the per-hit loop in process_event() used to build (but for the gap times, see decode_arrays()), and is what
+process_event() now uses.
+'''
+
+import numpy as np
+from Event import EventBatch
+from atar_geometry import DEFAULT_ATAR_GEOMETRY
+
+#Time gaps (in ns) between consecutive hits above which we note a gap, which signals a decay at rest. See time_clusters.scan_gap_threshold() for
+#tuning it.
+DEFAULT_GAP_THRESHOLD = 1.0
+
+
+#Offsets (CSR-style) of consecutive blocks of the given lengths: [0, l0, l0 + l1, ...].
+def lengths_to_offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+'''
+Sort the hits of every event by time once and take the time from each hit to the next one of the same event, for finding gaps at any threshold.
+event_index: Event number of each hit (EventBatch.hit_event_index), in increasing order as the hits are stored.
+Returns (order, steps): the indices of the hits in order of event and then time (hits at the same time stay in storage order), and for each hit in
+that order the time to the next hit of its event, NaN for the last hit of each event. NaN is never above a threshold.
+'''
+def time_steps(event_index, times):
+    times = np.asarray(times, dtype=np.float64)
+    steps = np.full(len(times), np.nan)
+    same_event = event_index[1:] == event_index[:-1]
+    np.subtract(times[1:], times[:-1], out=steps[:-1], where=same_event)
+    #Hits that are already stored in time order need no sorting.
+    if not (steps < 0).any():
+        return np.arange(len(times)), steps
+
+    order = np.lexsort((times, event_index))
+    sorted_times = times[order]
+    steps[:-1] = np.nan
+    np.subtract(sorted_times[1:], sorted_times[:-1], out=steps[:-1], where=same_event)
+    return order, steps
+
+
+#Concatenate a list of 1D arrays, giving an empty array of the given type if the list is empty.
+def _concatenate(arrays, dtype):
+    return np.concatenate(arrays).astype(dtype, copy=False) if arrays else np.empty(0, dtype=dtype)
+
+
+#True if the tree has a branch of the given name.
+def _has_branch(tree, name):
+    return bool(tree.GetBranch(name))
+
+
+'''
+Reads the branches needed to decode the given entries of the ATAR tree (and of the calorimeter tree, if one is given) into flat arrays. The vectors
+read by GetEntry are reused by ROOT for the next entry, so each one is copied into a NumPy array before moving on.
+Returns a dictionary with the entries, hit_offsets, pixel_hits, pixel_time, pixel_edep, pixel_pdg and pion_dar (None if the tree has no such branch),
+and, with a calorimeter tree, calo_offsets, crystal and edep.
+'''
+def read_entries(tree_atar, tree_calo, entries):
+    entries = np.asarray(entries, dtype=np.int64).reshape(-1)
+    read_pion_dar = _has_branch(tree_atar, "pion_dar")
+
+    hits, times, edeps, pdgs, pion_dar = [], [], [], [], []
+    crystals, calo_edeps = [], []
+    for entry in entries.tolist():
+        tree_atar.GetEntry(entry)
+        hits.append(np.array(tree_atar.pixel_hits, dtype=np.int64))
+        times.append(np.array(tree_atar.pixel_time, dtype=np.float64))
+        edeps.append(np.array(tree_atar.pixel_edep, dtype=np.float64))
+        pdgs.append(np.array(tree_atar.pixel_pdg, dtype=np.int64))
+        if read_pion_dar:
+            pion_dar.append(tree_atar.pion_dar)
+
+        if tree_calo is not None:
+            tree_calo.GetEntry(entry)
+            crystals.append(np.array(tree_calo.crystal, dtype=np.int64))
+            calo_edeps.append(np.array(tree_calo.edep, dtype=np.float64))
+
+    data = {
+        "entries": entries,
+        "hit_offsets": lengths_to_offsets([len(h) for h in hits]),
+        "pixel_hits": _concatenate(hits, np.int64),
+        "pixel_time": _concatenate(times, np.float64),
+        "pixel_edep": _concatenate(edeps, np.float64),
+        "pixel_pdg": _concatenate(pdgs, np.int64),
+        "pion_dar": np.array(pion_dar, dtype=np.int8) if read_pion_dar else None,
+    }
+    if tree_calo is not None:
+        data["calo_offsets"] = lengths_to_offsets([len(c) for c in crystals])
+        data["crystal"] = _concatenate(crystals, np.int64)
+        data["edep"] = _concatenate(calo_edeps, np.float64)
+
+    return data
+
+
+'''
+Decode flat arrays of hits (as given by read_entries()) into an EventBatch, with vectorized NumPy operations only:
+  - plane, strip and orientation of every hit come from one index into the decode table of the geometry,
+  - the energy per plane of every event is one np.bincount over (event, plane) pairs, and max_E its maximum over planes,
+  - gap times are the differences between consecutive hit times of an event in time order (see time_steps()), kept when they are above
+    gap_threshold. The per-hit loop process_event() used to have compared hits in the order they are stored and the first hit with t = 0, so it
+    also found "gaps" before the first hit and between hits stored out of time order.
+Energies are summed in the order the hits are stored, so they are exactly those of that loop.
+'''
+def decode_arrays(hit_offsets, pixel_hits, pixel_time, pixel_edep, pixel_pdg, geometry = DEFAULT_ATAR_GEOMETRY,
+                  gap_threshold = DEFAULT_GAP_THRESHOLD, entries = None, pion_dar = None, calo_offsets = None, crystal = None, edep = None):
+    hit_offsets = np.asarray(hit_offsets, dtype=np.int64)
+    times = np.asarray(pixel_time, dtype=np.float64)
+    edeps = np.asarray(pixel_edep, dtype=np.float64)
+    n_events = len(hit_offsets) - 1
+    n_hits = np.diff(hit_offsets)
+    if entries is None:
+        entries = np.arange(n_events)
+
+    planes, strips, orientations = geometry.decode(pixel_hits)
+    event_index = np.repeat(np.arange(n_events), n_hits)
+
+    #Sum of energies deposited in each plane of each event, and its maximum for each event.
+    plane_index = event_index * geometry.n_planes + planes.astype(np.int64)
+    E_per_plane = np.bincount(plane_index, weights=edeps, minlength=n_events * geometry.n_planes).reshape(n_events, geometry.n_planes)
+    max_E = E_per_plane.max(axis=1)
+
+    #Time from each hit to the next one of the same event in time order, and the gaps above the threshold (in time order within each event).
+    order, steps = time_steps(event_index, times)
+    is_gap = steps > gap_threshold
+    gap_offsets = lengths_to_offsets(np.bincount(event_index[order][is_gap], minlength=n_events))
+
+    return EventBatch(entries, hit_offsets, planes, strips, orientations, times, edeps, np.asarray(pixel_pdg), E_per_plane, max_E,
+                      gap_offsets, steps[is_gap], pion_dar, calo_offsets, crystal, edep)
+
+
+#Decode a dictionary of flat arrays as given by read_entries() (or by a reader of tree_readers.py) into an EventBatch. With compact = True (the
+#default) the batch is stored with the small data types of EventBatch.compact(); use compact = False to keep full double precision.
+def decode_data(data, geometry = DEFAULT_ATAR_GEOMETRY, gap_threshold = DEFAULT_GAP_THRESHOLD, compact = True):
+    batch = decode_arrays(data["hit_offsets"], data["pixel_hits"], data["pixel_time"], data["pixel_edep"], data["pixel_pdg"], geometry,
+                          gap_threshold, data["entries"], data["pion_dar"], data.get("calo_offsets"), data.get("crystal"), data.get("edep"))
+    return batch.compact() if compact else batch
+
+
+#Read and decode the given entries of the trees into an EventBatch. tree_calo can be None to skip the calorimeter. See decode_data() for compact.
+def decode_entries(tree_atar, tree_calo, entries, geometry = DEFAULT_ATAR_GEOMETRY, gap_threshold = DEFAULT_GAP_THRESHOLD, compact = True):
+    return decode_data(read_entries(tree_atar, tree_calo, entries), geometry, gap_threshold, compact)
+
+
+#Read and decode a single entry of the trees into an Event, in full double precision. crystal_geometry is used to look up the positions of the
+#calorimeter crystals, and defaults to calo_analysis.get_crystal_geometry().
+def decode_event(tree_atar, tree_calo, event_index, geometry = DEFAULT_ATAR_GEOMETRY, crystal_geometry = None,
+                 gap_threshold = DEFAULT_GAP_THRESHOLD):
+    batch = decode_entries(tree_atar, tree_calo, [event_index], geometry, gap_threshold, compact=False)
+    return batch.event(0, crystal_geometry)
+
+
+'''
+Compact per-event features of a batch, as a dictionary of arrays. These are what whole-file studies (e.g. compare_max_edep) need, and are small
+enough to send between processes:
+  entries, max_E, pion_dar (-1 where unknown), n_hits, atar_edep (total energy deposited in the ATAR), n_gaps, and the gap times of all events as
+  gap_times with CSR-style gap_offsets.
+'''
+def event_features(batch):
+    return {
+        "entries": batch.entries,
+        "max_E": batch.max_E,
+        "pion_dar": batch.pion_dar if batch.pion_dar is not None else np.full(len(batch), -1, dtype=np.int8),
+        "n_hits": batch.n_hits,
+        "atar_edep": np.bincount(batch.hit_event_index, weights=batch.edeps, minlength=len(batch)),
+        "n_gaps": np.diff(batch.gap_offsets),
+        "gap_offsets": batch.gap_offsets,
+        "gap_times": batch.gap_times,
+    }
+
+
+#Join feature dictionaries of consecutive ranges of events (in the given order) into one. Arrays whose names end in "_offsets" are CSR offsets into
+#other arrays and are shifted accordingly.
+def concatenate_features(parts):
+    parts = list(parts)
+    if not parts:
+        return {}
+
+    features = {}
+    for name in parts[0]:
+        if name.endswith("_offsets"):
+            shifted = [parts[0][name]]
+            for part in parts[1:]:
+                shifted.append(part[name][1:] + shifted[-1][-1])
+            features[name] = np.concatenate(shifted)
+        else:
+            features[name] = np.concatenate([part[name] for part in parts])
+    return features
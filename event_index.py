@@ -0,0 +1,330 @@
+'''
+Indexes of the events in a .root file, so that events with qualities of interest can be found without decoding every event again.
+
+The event summary is a table with one row per entry of the file, made in one pass over the file (in parallel, see parallel_extraction.py) and saved
+to a sidecar file next to it (e.g. updated_remove_zeros.root.summary.npz). Its columns are:
+  entry, max_E, atar_edep (total energy deposited in the ATAR), pion_dar, n_gaps, max_gap (largest gap time, 0 if none), n_hits, n_planes_hit,
+  planes_hit (bit p is set if plane p was hit), calo_edep (total energy deposited in the calorimeter) and n_crystals (number of calorimeter hits).
+Searches run against this table, and only the matching events have to be read from the .root file for display, e.g. with
+Event_Visualizer.search_events():
+
+    summary = get_event_summary("updated_remove_zeros.root")
+    entries = summary.search(pion_dar=0, max_E=(1, None), touches_planes=(40, 49))
+
+The pixel index is an optional inverted index from the pixel_hits branch: for every pixel (plane and strip), and optionally every particle type
+(pixel_pdg), the sorted list of entries that have a hit there. Geometric and particle type queries are then answered from these posting lists
+without touching the raw hits, and saved to a sidecar file as well (e.g. updated_remove_zeros.root.pixels.npz):
+
+    pixel_index = get_pixel_index("updated_remove_zeros.root")
+    entries = pixel_index.search(planes=(25, 33), strips=(10, 90))
+    positron_entries = pixel_index.search(planes=(41, 49), pdg=-11)
+'''
+
+import os
+import numpy as np
+import event_decoder
+import parallel_extraction
+from atar_geometry import DEFAULT_ATAR_GEOMETRY, ATARGeometry
+
+
+#Version of the columns of event summary sidecars. Sidecars of other versions (those without one are version 1) are made again. Version 2: gaps
+#are taken between hits in time order (see event_decoder.decode_arrays()).
+SUMMARY_VERSION = 2
+
+
+#Path of the event summary sidecar of a .root file.
+def get_summary_path(file_name):
+    return file_name + ".summary.npz"
+
+
+#Path of the pixel index sidecar of a .root file.
+def get_pixel_index_path(file_name):
+    return file_name + ".pixels.npz"
+
+
+#The (size, modification time) pair used to tell whether a sidecar still describes the .root file it was made from.
+def _file_fingerprint(file_name):
+    stat = os.stat(file_name)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+#The ATARGeometry a sidecar was made with, as sidecar fields, so that a sidecar is only reused for events decoded the same way.
+def _geometry_fields(geometry):
+    return {"_geometry": np.array([geometry.n_planes, geometry.n_strips_per_plane, geometry.id_offset], dtype=np.int64),
+            "_orientation_pattern": "".join(geometry.orientation_pattern)}
+
+
+#The ATARGeometry saved with _geometry_fields(), or None for sidecars made before the geometry was recorded.
+def _load_geometry(sidecar):
+    if "_geometry" not in sidecar.files:
+        return None
+    n_planes, n_strips_per_plane, id_offset = sidecar["_geometry"].tolist()
+    return ATARGeometry(n_planes, n_strips_per_plane, id_offset, tuple(str(sidecar["_orientation_pattern"])))
+
+
+def _same_geometry(a, b):
+    return a is not None and b is not None and repr(a) == repr(b)
+
+
+#Per-event summary columns of an EventBatch (see the module description). Used as the features function of parallel_extraction.extract_features().
+def event_summary(batch):
+    if batch.n_planes > 64:
+        raise ValueError("planes_hit can only describe up to 64 planes, the geometry has " + str(batch.n_planes))
+    n_events = len(batch)
+    event_index = batch.hit_event_index
+    n_gaps = np.diff(batch.gap_offsets)
+    n_crystals = np.diff(batch.calo_offsets)
+
+    #Which planes each event hit, as a (n_events, n_planes) table and as a bit mask.
+    plane_hits = np.bincount(event_index * batch.n_planes + batch.planes.astype(np.int64), minlength=n_events * batch.n_planes)
+    is_plane_hit = plane_hits.reshape(n_events, batch.n_planes) > 0
+    planes_hit = (is_plane_hit.astype(np.uint64) << np.arange(batch.n_planes, dtype=np.uint64)).sum(axis=1, dtype=np.uint64)
+
+    #Largest gap of each event that has any.
+    max_gap = np.zeros(n_events)
+    has_gaps = n_gaps > 0
+    if has_gaps.any():
+        max_gap[has_gaps] = np.maximum.reduceat(batch.gap_times, batch.gap_offsets[:-1][has_gaps])
+
+    calo_event_index = np.repeat(np.arange(n_events), n_crystals)
+
+    return {
+        "entry": batch.entries,
+        "max_E": np.asarray(batch.max_E, dtype=np.float64),
+        "atar_edep": np.bincount(event_index, weights=batch.edeps, minlength=n_events),
+        "pion_dar": batch.pion_dar if batch.pion_dar is not None else np.full(n_events, -1, dtype=np.int8),
+        "n_gaps": n_gaps,
+        "max_gap": max_gap,
+        "n_hits": batch.n_hits,
+        "n_planes_hit": is_plane_hit.sum(axis=1),
+        "planes_hit": planes_hit,
+        "calo_edep": np.bincount(calo_event_index, weights=batch.calo_edep, minlength=n_events),
+        "n_crystals": n_crystals,
+    }
+
+
+'''
+The event summary table of a .root file. The columns are NumPy arrays in self.columns, also available as summary["max_E"] etc. geometry is the
+ATARGeometry the events were decoded with (None for sidecars made before it was recorded).
+'''
+class EventSummary:
+
+    def __init__(self, columns, file_name = None, gap_threshold = event_decoder.DEFAULT_GAP_THRESHOLD, geometry = DEFAULT_ATAR_GEOMETRY):
+        self.columns = columns
+        self.file_name = file_name
+        self.gap_threshold = gap_threshold
+        self.geometry = geometry
+
+    def __len__(self):
+        return len(self.columns["entry"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    '''
+    Boolean mask of the rows that satisfy all the given criteria. Each keyword is a column name with either a value (the column must equal it) or a
+    (low, high) tuple (low <= column <= high, where None leaves that side open), e.g. mask(pion_dar=1, max_E=(1, None), n_gaps=(1, None)).
+    The extra criterion touches_planes=(first, last) keeps events that hit any plane from first to last (planes_hit only describes planes 0 to 63).
+    '''
+    def mask(self, **criteria):
+        keep = np.ones(len(self), dtype=bool)
+        for name, value in criteria.items():
+            if name == "touches_planes":
+                first, last = value
+                if not 0 <= first <= last < 64:
+                    raise ValueError("touches_planes must be a (first, last) range of planes 0 to 63, got " + repr(value))
+                plane_range = np.uint64(((1 << (last - first + 1)) - 1) << first)
+                keep &= (self.columns["planes_hit"] & plane_range) != 0
+                continue
+            if name not in self.columns:
+                raise KeyError("Unknown column " + repr(name) + "; the summary has " + ", ".join(self.columns))
+
+            column = self.columns[name]
+            if isinstance(value, tuple):
+                low, high = value
+                if low is not None:
+                    keep &= column >= low
+                if high is not None:
+                    keep &= column <= high
+            else:
+                keep &= column == value
+        return keep
+
+    #Entries of the events that satisfy all the given criteria (see mask()), at most limit of them if limit is given.
+    def search(self, limit = None, **criteria):
+        return self.columns["entry"][self.mask(**criteria)][:limit]
+
+    #Save the summary to a sidecar file, together with the fingerprint of the .root file it describes.
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            extra = {"_gap_threshold": self.gap_threshold, "_version": SUMMARY_VERSION}
+            if self.geometry is not None:
+                extra.update(_geometry_fields(self.geometry))
+            if self.file_name is not None:
+                extra.update(_file_name=os.path.abspath(self.file_name), _fingerprint=_file_fingerprint(self.file_name))
+            np.savez(f, **self.columns, **extra)
+        os.replace(tmp_path, path)
+
+    #Load a summary from a sidecar file. If file_name is given, returns None when the sidecar was made from a different or since changed file, or by
+    #a different version of event_summary().
+    @classmethod
+    def load(cls, path, file_name = None):
+        with np.load(path, allow_pickle=False) as sidecar:
+            version = int(sidecar["_version"]) if "_version" in sidecar.files else 1
+            if file_name is not None and ("_fingerprint" not in sidecar.files or version != SUMMARY_VERSION or
+                                          not np.array_equal(sidecar["_fingerprint"], _file_fingerprint(file_name))):
+                return None
+            columns = {name: sidecar[name] for name in sidecar.files if not name.startswith("_")}
+            gap_threshold = float(sidecar["_gap_threshold"])
+            geometry = _load_geometry(sidecar)
+        return cls(columns, file_name, gap_threshold, geometry)
+
+
+#Make the event summary of a .root file in one pass over it, in n_workers processes, and save it to its sidecar file.
+def build_event_summary(file_name, n_workers = None, chunk_size = parallel_extraction.DEFAULT_CHUNK_SIZE, geometry = DEFAULT_ATAR_GEOMETRY,
+                        gap_threshold = event_decoder.DEFAULT_GAP_THRESHOLD, sidecar_path = None):
+    columns = parallel_extraction.extract_features(file_name, None, n_workers, chunk_size, geometry, gap_threshold, read_calo=True,
+                                                   features=event_summary)
+    summary = EventSummary(columns, file_name, gap_threshold, geometry)
+    summary.save(sidecar_path or get_summary_path(file_name))
+    return summary
+
+
+#The event summary of a .root file, from its sidecar file if there is an up to date one made with the same geometry and gap_threshold, and otherwise
+#made with build_event_summary().
+def get_event_summary(file_name, n_workers = None, chunk_size = parallel_extraction.DEFAULT_CHUNK_SIZE, geometry = DEFAULT_ATAR_GEOMETRY,
+                      gap_threshold = event_decoder.DEFAULT_GAP_THRESHOLD, sidecar_path = None):
+    sidecar_path = sidecar_path or get_summary_path(file_name)
+    if os.path.exists(sidecar_path):
+        summary = EventSummary.load(sidecar_path, file_name)
+        if summary is not None and summary.gap_threshold == gap_threshold and _same_geometry(summary.geometry, geometry):
+            return summary
+    return build_event_summary(file_name, n_workers, chunk_size, geometry, gap_threshold, sidecar_path)
+
+
+#The distinct (plane, strip, pdg, entry) rows of the hits of an EventBatch. Used as the features function of parallel_extraction.extract_features()
+#to build a PixelIndex.
+def pixel_postings(batch):
+    rows = np.unique(np.stack([batch.planes.astype(np.int64), batch.strips.astype(np.int64), batch.pdgs.astype(np.int64),
+                               batch.entries[batch.hit_event_index]], axis=1), axis=0)
+    return {"plane": rows[:, 0], "strip": rows[:, 1], "pdg": rows[:, 2], "entry": rows[:, 3]}
+
+
+'''
+Inverted index from (pixel, particle type) to the entries with a hit there. The posting lists of all keys are stored back to back in entries, and
+those of key k are entries[offsets[k]:offsets[k + 1]], sorted. A key is pixel * len(pdgs) + the position of the particle type in pdgs, where
+pixel = plane * n_strips_per_plane + strip for the ATARGeometry the events were decoded with. If the index was built with split_by_pdg = False, pdgs
+is empty and keys are just pixels.
+'''
+class PixelIndex:
+
+    def __init__(self, keys, offsets, entries, pdgs, geometry = DEFAULT_ATAR_GEOMETRY, file_name = None):
+        self.keys = np.asarray(keys, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.entries = np.asarray(entries)
+        self.pdgs = np.asarray(pdgs, dtype=np.int64)
+        self.geometry = geometry
+        self.n_planes = geometry.n_planes
+        self.n_strips_per_plane = geometry.n_strips_per_plane
+        self.file_name = file_name
+
+    #Build the index from the (plane, strip, pdg, entry) rows of pixel_postings(), for events decoded with the given geometry.
+    @classmethod
+    def from_postings(cls, plane, strip, pdg, entry, geometry = DEFAULT_ATAR_GEOMETRY, split_by_pdg = True, file_name = None):
+        pixel = np.asarray(plane, dtype=np.int64) * geometry.n_strips_per_plane + np.asarray(strip, dtype=np.int64)
+        pdg, entry = np.asarray(pdg, dtype=np.int64), np.asarray(entry, dtype=np.int64)
+        if split_by_pdg:
+            pdgs, pdg_codes = np.unique(pdg, return_inverse=True)
+            keys = pixel * len(pdgs) + pdg_codes.reshape(-1)
+        else:
+            pdgs, keys = np.empty(0, dtype=np.int64), pixel
+
+        #Sort by key and then entry, dropping the duplicates left when the particle types are merged.
+        order = np.lexsort((entry, keys))
+        keys, entry = keys[order], entry[order]
+        if len(keys) > 0:
+            distinct = np.concatenate(([True], (keys[1:] != keys[:-1]) | (entry[1:] != entry[:-1])))
+            keys, entry = keys[distinct], entry[distinct]
+
+        unique_keys, starts = np.unique(keys, return_index=True)
+        offsets = np.append(starts, len(keys)).astype(np.int64)
+        entry_dtype = np.min_scalar_type(int(entry.max())) if len(entry) else np.uint8
+        return cls(unique_keys, offsets, entry.astype(entry_dtype), pdgs, geometry, file_name)
+
+    '''
+    Entries with at least one hit in the given region, from the given particle types.
+    planes (optional): (first, last) range of planes, or a single plane. Defaults to all planes.
+    strips (optional): (first, last) range of strips within each plane, or a single strip. Defaults to all strips.
+    pdg (optional): A particle ID or a list of them. Defaults to all particles. Needs an index built with split_by_pdg = True.
+    '''
+    def search(self, planes = None, strips = None, pdg = None):
+        def index_range(value, n):
+            if value is None:
+                return np.arange(n)
+            first, last = value if isinstance(value, tuple) else (value, value)
+            return np.arange(max(first, 0), min(last, n - 1) + 1)
+
+        pixels = (index_range(planes, self.n_planes)[:, None] * self.n_strips_per_plane + index_range(strips, self.n_strips_per_plane)).ravel()
+        if len(self.pdgs) == 0:
+            if pdg is not None:
+                raise ValueError("This pixel index was built without splitting by particle type.")
+            keys = pixels
+        else:
+            pdg_codes = np.arange(len(self.pdgs)) if pdg is None else np.flatnonzero(np.isin(self.pdgs, pdg))
+            keys = (pixels[:, None] * len(self.pdgs) + pdg_codes).ravel()
+
+        #Find the keys that are present in the index, then gather their posting lists with one fancy index and merge them.
+        positions = np.searchsorted(self.keys, keys)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == keys[found]
+        positions = positions[found]
+
+        lengths = self.offsets[positions + 1] - self.offsets[positions]
+        starts = np.repeat(self.offsets[positions] - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        return np.unique(self.entries[starts + np.arange(lengths.sum())]).astype(np.int64)
+
+    #Save the index to a sidecar file, together with the fingerprint of the .root file it describes.
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            extra = _geometry_fields(self.geometry)
+            if self.file_name is not None:
+                extra.update(_file_name=os.path.abspath(self.file_name), _fingerprint=_file_fingerprint(self.file_name))
+            np.savez(f, keys=self.keys, offsets=self.offsets, entries=self.entries, pdgs=self.pdgs, **extra)
+        os.replace(tmp_path, path)
+
+    #Load an index from a sidecar file. If file_name is given, returns None when the sidecar was made from a different or since changed file, or
+    #before the geometry was recorded.
+    @classmethod
+    def load(cls, path, file_name = None):
+        with np.load(path, allow_pickle=False) as sidecar:
+            geometry = _load_geometry(sidecar)
+            if file_name is not None and ("_fingerprint" not in sidecar.files or geometry is None or
+                                          not np.array_equal(sidecar["_fingerprint"], _file_fingerprint(file_name))):
+                return None
+            if geometry is None:
+                geometry = ATARGeometry(*sidecar["shape"].tolist())
+            return cls(sidecar["keys"], sidecar["offsets"], sidecar["entries"], sidecar["pdgs"], geometry, file_name)
+
+
+#Make the pixel index of a .root file in one pass over it, in n_workers processes, and save it to its sidecar file.
+def build_pixel_index(file_name, n_workers = None, chunk_size = parallel_extraction.DEFAULT_CHUNK_SIZE, geometry = DEFAULT_ATAR_GEOMETRY,
+                      split_by_pdg = True, sidecar_path = None):
+    postings = parallel_extraction.extract_features(file_name, None, n_workers, chunk_size, geometry, features=pixel_postings)
+    pixel_index = PixelIndex.from_postings(postings["plane"], postings["strip"], postings["pdg"], postings["entry"], geometry, split_by_pdg,
+                                           file_name)
+    pixel_index.save(sidecar_path or get_pixel_index_path(file_name))
+    return pixel_index
+
+
+#The pixel index of a .root file, from its sidecar file if there is an up to date one made with the same geometry and split_by_pdg, and otherwise
+#made with build_pixel_index().
+def get_pixel_index(file_name, n_workers = None, chunk_size = parallel_extraction.DEFAULT_CHUNK_SIZE, geometry = DEFAULT_ATAR_GEOMETRY,
+                    split_by_pdg = True, sidecar_path = None):
+    sidecar_path = sidecar_path or get_pixel_index_path(file_name)
+    if os.path.exists(sidecar_path):
+        pixel_index = PixelIndex.load(sidecar_path, file_name)
+        if pixel_index is not None and (len(pixel_index.pdgs) > 0) == split_by_pdg and _same_geometry(pixel_index.geometry, geometry):
+            return pixel_index
+    return build_pixel_index(file_name, n_workers, chunk_size, geometry, split_by_pdg, sidecar_path)
@@ -0,0 +1,80 @@
+'''
+Streaming versions of the steps in event_visualization(): selecting entries, decoding them, computing features and filling histograms. Every step is
+a generator that takes the output of the one before, so only one chunk of entries or one batch of events is in memory at a time, no matter how
+many entries the file has. The stages can be combined as needed, e.g. to histogram max_E of all decays at rest in a file:
+
+    entries = iter_selected_entries(tree_atar, event_selection.DAR_CUT)
+    batches = iter_batches(tree_atar, None, entries)
+    max_E = reduce_histograms(map_features(batches), {"max_E": histogram.Histogram.uniform(0, 5, 50)})["max_E"]
+'''
+
+import itertools
+import numpy as np
+import event_decoder
+import event_selection
+import histogram
+from atar_geometry import DEFAULT_ATAR_GEOMETRY
+
+DEFAULT_BATCH_SIZE = 10_000
+
+
+#Yields the entries of the tree that satisfy the cut, in order. The cut is evaluated chunk_size entries at a time (see event_selection.py), so at most
+#one chunk of flags is held in memory.
+def iter_selected_entries(tree, cut, chunk_size = event_selection.DEFAULT_CHUNK_SIZE):
+    for start, mask in event_selection.iter_cut_masks(tree, cut, chunk_size):
+        yield from (start + np.flatnonzero(mask)).tolist()
+
+
+#Yields EventBatches of at most batch_size events, decoding the entries (any iterable, which is only consumed batch_size entries at a time).
+def iter_batches(tree_atar, tree_calo, entries, batch_size = DEFAULT_BATCH_SIZE, geometry = DEFAULT_ATAR_GEOMETRY,
+                 gap_threshold = event_decoder.DEFAULT_GAP_THRESHOLD, compact = True):
+    entries = iter(entries)
+    while True:
+        chunk = list(itertools.islice(entries, batch_size))
+        if not chunk:
+            return
+        yield event_decoder.decode_entries(tree_atar, tree_calo, chunk, geometry, gap_threshold, compact)
+
+
+#Yields one Event at a time for the given entries, e.g. for displaying them. Events are still decoded batch_size at a time.
+def iter_events(tree_atar, tree_calo, entries, batch_size = DEFAULT_BATCH_SIZE, geometry = DEFAULT_ATAR_GEOMETRY,
+                gap_threshold = event_decoder.DEFAULT_GAP_THRESHOLD):
+    for batch in iter_batches(tree_atar, tree_calo, entries, batch_size, geometry, gap_threshold, compact=False):
+        yield from batch
+
+
+#Filter stage: yields only the events of each batch for which predicate(batch) is True. predicate gets a whole batch and returns a boolean array
+#with one value per event, e.g. lambda batch: batch.max_E > 1.
+def filter_batches(batches, predicate):
+    for batch in batches:
+        keep = np.asarray(predicate(batch), dtype=bool)
+        if keep.all():
+            yield batch
+        elif keep.any():
+            yield batch.take(keep)
+
+
+#Map stage: yields features(batch) for every batch; by default the per-event features of event_decoder.event_features().
+def map_features(batches, features = event_decoder.event_features):
+    for batch in batches:
+        yield features(batch)
+
+
+#Reduce stage: fills histogram.Histograms (or streaming_stats.StreamingStats) from every feature dictionary and returns them. histograms is a
+#dictionary from feature names to Histograms, or with split_dar = True a dictionary {"DIF": {...}, "DAR": {...}} of them (see
+#histogram.fill_features()). Several histograms are filled in one pass over the features.
+def reduce_histograms(feature_dicts, histograms, split_dar = False):
+    for features in feature_dicts:
+        histogram.fill_features(histograms, features, split_dar)
+    return histograms
+
+
+#Reduce stage: fills a histogram with the given bin edges from the feature "name" of every feature dictionary and returns the counts. Values
+#outside of the edges are not counted.
+def reduce_histogram(feature_dicts, name, edges):
+    return reduce_histograms(feature_dicts, {name: histogram.Histogram(edges)})[name].counts
+
+
+#Reduce stage: joins all feature dictionaries into one. Only use this when the features of all events fit in memory.
+def collect_features(feature_dicts):
+    return event_decoder.concatenate_features(feature_dicts)
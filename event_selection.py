@@ -0,0 +1,238 @@
+'''
+Selection of events from the ATAR tree by a cut, as used by select_events(). Cuts are written in the same syntax as for TTree::Draw (TTreeFormula),
+e.g. "pion_dar && Sum$(pixel_edep) > 0" or "Length$(pixel_hits) > 10 && Max$(pixel_time) < 50", so any predicate on the branches of the tree can be
+used. Cuts are combined with combine_cuts().
+
+Instead of TTree::Draw("Entry$", cut), which copies its results into a buffer that is capped at the tree's estimate (so large selections are silently
+truncated), the cut is evaluated by a small C++ loop that is compiled once per process by ROOT's interpreter. It writes one pass / fail flag per
+entry straight into a NumPy array, chunk_size entries at a time, so there is no cap on the size of the selection and no per-entry Python overhead.
+select_entries() returns the selected entries as an index array, a boolean mask over all entries, or just their count.
+sample_entries() draws a random sample of the selected entries in the same single pass, keeping only the sample in memory. It can be stratified by
+cuts, which the C++ loop evaluates together with the main cut, or by a binned column of the event summary (see event_index.py), so no events are
+decoded.
+'''
+
+import numpy as np
+
+#Cuts used to select decays in flight, decays at rest, or all non-empty events (is_event_DAR = 0, 1 or 2 in select_events()).
+DIF_CUT = "!pion_dar && Sum$(pixel_edep) > 0"
+DAR_CUT = "pion_dar && Sum$(pixel_edep) > 0"
+ALL_CUT = "Sum$(pixel_edep) > 0"
+
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+#The C++ loop that evaluates cuts. An entry passes a cut if any instance of its formula is non-zero, which is the same rule TTree::Draw uses for its
+#selection. The flags of cut c are written to pass[c * (stop - start) + entry - start]. Cuts after the first are only evaluated for the entries that
+#pass the first one, and fail for the others. It returns the number of entries that pass the first cut, or -1 - c if cut c does not compile.
+_CUT_EVALUATOR_CODE = """
+#include <memory>
+#include <string>
+#include <vector>
+#include "TTree.h"
+#include "TTreeFormula.h"
+
+namespace atar_selection {
+
+Long64_t EvaluateCuts(TTree* tree, const std::vector<std::string>& cuts, Long64_t start, Long64_t stop, unsigned char* pass)
+{
+    std::vector<std::unique_ptr<TTreeFormula>> formulas;
+    for (size_t c = 0; c < cuts.size(); ++c) {
+        formulas.emplace_back(new TTreeFormula(("atar_selection_" + std::to_string(c)).c_str(), cuts[c].c_str(), tree));
+        if (formulas.back()->GetNdim() == 0) return -1 - (Long64_t)c;
+    }
+
+    const Long64_t n_entries = stop - start;
+    Int_t tree_number = -1;
+    Long64_t n_pass = 0;
+    for (Long64_t entry = start; entry < stop; ++entry) {
+        if (tree->LoadTree(entry) < 0) break;
+        //A TChain moves on to a new file: point the formulas at the leaves of the new tree.
+        if (tree->GetTreeNumber() != tree_number) {
+            tree_number = tree->GetTreeNumber();
+            for (auto& formula : formulas) formula->UpdateFormulaLeaves();
+        }
+
+        for (size_t c = 0; c < formulas.size(); ++c) {
+            bool passed = false;
+            if (c == 0 || pass[entry - start]) {
+                Int_t n_data = formulas[c]->GetNdata();
+                for (Int_t i = 0; i < n_data && !passed; ++i) passed = formulas[c]->EvalInstance(i) != 0;
+            }
+            pass[c * n_entries + entry - start] = passed;
+        }
+        n_pass += pass[entry - start];
+    }
+    return n_pass;
+}
+
+}
+"""
+
+_cut_evaluator = None
+
+
+#The compiled C++ cut evaluator, compiling it on first use. ROOT is only imported here.
+def _get_cut_evaluator():
+    global _cut_evaluator
+    if _cut_evaluator is None:
+        import ROOT as r
+        if not r.gInterpreter.Declare(_CUT_EVALUATOR_CODE):
+            raise RuntimeError("Could not compile the cut evaluator.")
+        _cut_evaluator = r.atar_selection.EvaluateCuts
+    return _cut_evaluator
+
+
+#The cut for the given value of is_event_DAR: 0 = decays in flight, 1 = decays at rest, 2 = all data used.
+def dar_cut(is_event_DAR):
+    if is_event_DAR == 0:
+        return DIF_CUT
+    elif is_event_DAR == 1:
+        return DAR_CUT
+    return ALL_CUT
+
+
+#A cut that only passes entries passing all the given cuts. Empty cuts are left out.
+def combine_cuts(*cuts):
+    cuts = [cut for cut in cuts if cut]
+    return " && ".join("(" + cut + ")" for cut in cuts) if cuts else "1"
+
+
+#(len(cuts), stop - start) boolean masks of which entries in [start, stop) of the tree pass each of the cuts, all evaluated in one pass over the
+#entries. Only entries passing the first cut can pass the others (see _CUT_EVALUATOR_CODE). stop defaults to the number of entries in the tree.
+def cut_masks(tree, cuts, start = 0, stop = None):
+    n_entries = tree.GetEntries()
+    stop = n_entries if stop is None else min(stop, n_entries)
+    masks = np.zeros((len(cuts), max(stop - start, 0)), dtype=np.uint8)
+    if masks.size > 0:
+        evaluator = _get_cut_evaluator()
+        import ROOT as r
+        cut_vector = r.std.vector["std::string"]()
+        for cut in cuts:
+            cut_vector.push_back(cut)
+        n_pass = evaluator(tree, cut_vector, start, stop, masks.reshape(-1))
+        if n_pass < 0:
+            raise ValueError("Could not compile the cut " + repr(cuts[-1 - n_pass]))
+    return masks.view(bool)
+
+
+#Boolean mask of which entries in [start, stop) of the tree pass the cut. stop defaults to the number of entries in the tree.
+def cut_mask(tree, cut, start = 0, stop = None):
+    return cut_masks(tree, [cut], start, stop)[0]
+
+
+#Yields (start, mask) for consecutive chunks of chunk_size entries of the tree, where mask tells which entries start, start + 1, ... pass the cut.
+#Only one chunk of flags is in memory at a time.
+def iter_cut_masks(tree, cut, chunk_size = DEFAULT_CHUNK_SIZE):
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive, got " + str(chunk_size))
+    for start in range(0, tree.GetEntries(), chunk_size):
+        yield start, cut_mask(tree, cut, start, start + chunk_size)
+
+
+'''
+Evaluate a cut over the whole tree.
+tree: The TTree (or TChain) to select entries from.
+cut: The cut, in TTree::Draw syntax. See dar_cut() for the decay at rest / in flight cuts.
+output (optional): "indices" (the default) returns an int64 array of all entries that pass, "mask" a boolean array with one value per entry, and
+                   "count" just the number of entries that pass.
+chunk_size (optional): Number of entries evaluated at a time.
+'''
+def select_entries(tree, cut, output = "indices", chunk_size = DEFAULT_CHUNK_SIZE):
+    if output not in ("indices", "mask", "count"):
+        raise ValueError("output must be 'indices', 'mask' or 'count', got " + repr(output))
+
+    if output == "mask":
+        return cut_mask(tree, cut)
+
+    n_pass = 0
+    indices = []
+    for start, mask in iter_cut_masks(tree, cut, chunk_size):
+        if output == "count":
+            n_pass += int(np.count_nonzero(mask))
+        else:
+            indices.append(start + np.flatnonzero(mask))
+
+    if output == "count":
+        return n_pass
+    return np.concatenate(indices) if indices else np.empty(0, dtype=np.int64)
+
+
+#Keeps the k entries with the smallest random keys seen so far. Giving every entry an independent uniform key and keeping the k smallest is a
+#uniform random sample of k entries (reservoir sampling), which only needs O(k) memory however many entries are seen.
+class _Reservoir:
+
+    def __init__(self, k):
+        self.k = k
+        self.entries = np.empty(0, dtype=np.int64)
+        self.keys = np.empty(0)
+
+    def add(self, entries, keys):
+        self.entries = np.concatenate((self.entries, entries))
+        self.keys = np.concatenate((self.keys, keys))
+        if len(self.keys) > self.k:
+            keep = np.argpartition(self.keys, self.k - 1)[:self.k] if self.k > 0 else []
+            self.entries, self.keys = self.entries[keep], self.keys[keep]
+
+    def sample(self):
+        return np.sort(self.entries)
+
+
+#The values of a column of the event summary of a .root file (e.g. "max_E", see event_index.py), one per entry, for use as the values of a binned
+#variable in sample_entries(). The summary is read from its sidecar file, or made once (in n_workers processes) if there is no up to date one.
+def feature_values(file_name, name = "max_E", n_workers = None):
+    import event_index
+    return event_index.get_event_summary(file_name, n_workers)[name]
+
+
+'''
+Draw a random sample of the entries that pass a cut, in one pass over the tree and with memory for only the sample and the flags of one chunk.
+tree: The TTree (or TChain) to sample entries from.
+cut: The cut, in TTree::Draw syntax. See dar_cut() for the decay at rest / in flight cuts.
+k: The number of entries to draw (per stratum, if strata are given; can also be a list with one number per stratum). If fewer entries pass, all of
+   them are returned.
+seed (optional): Seed of the random number generator, to get the same sample again.
+strata (optional): Draw a separate sample from each stratum instead of one from all passing entries. Either a list of cuts, e.g. [DIF_CUT, DAR_CUT]
+                   (an entry is in every stratum whose cut it passes), which are evaluated in the same pass as cut, or (values, edges) to stratify
+                   by a binned variable, where values has one value per entry of the tree (see feature_values()) and edges are the bin edges. As in
+                   np.histogram(), the last bin includes its upper edge; entries outside the edges or with NaN values are in no stratum.
+chunk_size (optional): Number of entries evaluated at a time.
+Returns a sorted array of the sampled entries, or with strata, a list with one such array per stratum.
+'''
+def sample_entries(tree, cut, k, seed = None, strata = None, chunk_size = DEFAULT_CHUNK_SIZE):
+    rng = np.random.default_rng(seed)
+    by_cut = isinstance(strata, list)
+    n_strata = 1 if strata is None else len(strata) if by_cut else len(strata[1]) - 1
+    ks = list(k) if np.ndim(k) > 0 else [k] * n_strata
+    if len(ks) != n_strata:
+        raise ValueError("Got " + str(len(ks)) + " sample sizes for " + str(n_strata) + " strata.")
+    reservoirs = [_Reservoir(k_i) for k_i in ks]
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive, got " + str(chunk_size))
+    if strata is not None and not by_cut:
+        values, edges = np.asarray(strata[0]), np.asarray(strata[1], dtype=np.float64)
+
+    cuts = [cut] + (strata if by_cut else [])
+    for start in range(0, tree.GetEntries(), chunk_size):
+        masks = cut_masks(tree, cuts, start, start + chunk_size)
+        entries = start + np.flatnonzero(masks[0])
+        if len(entries) == 0:
+            continue
+        #One key per passing entry, drawn in entry order, so the sample does not depend on chunk_size.
+        keys = rng.random(len(entries))
+
+        if strata is None:
+            reservoirs[0].add(entries, keys)
+        elif by_cut:
+            for reservoir, stratum_mask in zip(reservoirs, masks[1:]):
+                in_stratum = stratum_mask[entries - start]
+                reservoir.add(entries[in_stratum], keys[in_stratum])
+        else:
+            entry_values = values[entries]
+            bins = np.searchsorted(edges, entry_values, side="right") - 1
+            bins[entry_values == edges[-1]] = len(edges) - 2
+            for i, reservoir in enumerate(reservoirs):
+                in_bin = bins == i
+                reservoir.add(entries[in_bin], keys[in_bin])
+
+    samples = [reservoir.sample() for reservoir in reservoirs]
+    return samples[0] if strata is None else samples
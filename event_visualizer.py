@@ -2,8 +2,8 @@
 This class provides functionality for viewing characteristics of selected events in the active target (ATAR). The user can pass the .root file and the
 indices of an event or a range of events that they want to analyze to the visualize_event() method, which will display a few plots of data that
 succinctly summarize the event. Various options can be specified to give more detailed info about the events or display the raw data. If instead one
-desires to search for events with certain qualities of interest, the _____ method can be used with various search parameters, subsequently displaying
-a selected quantity of events that satisfy the given parameters. 5 different plots are shown for each event: particle x vs. z, particle y vs. z,
+desires to search for events with certain qualities of interest, the search_events() method can be used with various search parameters, subsequently
+displaying a selected quantity of events that satisfy the given parameters. 5 different plots are shown for each event: particle x vs. z, particle y vs. z,
 particle z vs. t, energy deposition per plane vs. z, and energy deposited in the calorimeter SiPMs by (theta, phi) coordinates.
 
 -->A quick summary of the structure of the simulated ATAR:
@@ -11,20 +11,29 @@ particle z vs. t, energy deposition per plane vs. z, and energy deposited in the
 The ATAR is comprised of a series of detection planes whose integer indices start at 10,000 by convention in the simulation code. We denote the plane
 number, or depth that the particle penetrates into the ATAR, by "z." These planes are comprised of strips that alternate horizontal and vertical
 orientation. Thus, the 1st plate measures "x," the 2nd measures "y," the third measures "x," and so on, alternating every plate. We operate under the
-assumption that 100 strips comprise each plate in the simulation data supplied.
+assumption that 100 strips comprise each plate in the simulation data supplied. These numbers are described by an ATARGeometry (see atar_geometry.py),
+which can be passed to Event_Visualizer to look at other ATAR variants.
 '''
 
-from logging.config import IDENTIFIER
-from typing import overload
-import ROOT as r
+import itertools
 import numpy as np
 from matplotlib import pyplot as plt
 from matplotlib.ticker import StrMethodFormatter
-from Event import Event
-import calo_analysis
+import event_decoder
+import event_index
+import event_pipeline
+import event_selection
+import histogram
+import particle_groups
+from atar_geometry import DEFAULT_ATAR_GEOMETRY
 
 
 class Event_Visualizer:
+
+    #atar_geometry (optional): The ATARGeometry used to decode pixel IDs. Defaults to the geometry of the current simulation.
+    def __init__(self, atar_geometry = DEFAULT_ATAR_GEOMETRY):
+        self.atar_geometry = atar_geometry
+
     #TODO: Reimplement is_event_DAR along with select_events()
     '''
     The primary method that this class is used for. Uses helper functions below to give a visualization of events satisfying the specified condition(s).
@@ -53,7 +62,7 @@ class Event_Visualizer:
         
         # TODO Need to incorporate 1) selection of events and 2) discrimination by max_E
     
-        self.plot_event(e, 50)
+        self.plot_event(e, self.atar_geometry.n_planes)
 
         for gt in e.gap_times:
             gap_times.append(gt)
@@ -63,11 +72,37 @@ class Event_Visualizer:
         return (max_Es, gap_times)
 
     
+    '''
+    Search for events with certain qualities of interest and visualize them. The search runs against the event summary of the file (see event_index.py),
+    which is made once and saved next to the .root file, so only the events that are displayed are read from the file.
+    input_file: The .root file that contains the data of interest. Should have been extracted as a TFile object before passing as a parameter.
+    num_events (optional): The maximum number of matching events to display. Defaults to 10.
+    display_text_output (optional): Value of True / False, controls whether we do / do not have our event data displayed in text format.
+    criteria: Search parameters as column names of the event summary, with either a value or a (low, high) range, e.g. pion_dar = 0,
+              max_E = (1, None), n_gaps = (1, None) or touches_planes = (40, 49).
+    Returns the entries of all events that satisfy the criteria.
+    '''
+    def search_events(self, input_file, num_events = 10, display_text_output = False, **criteria):
+        summary = event_index.get_event_summary(input_file.GetName(), geometry=self.atar_geometry)
+        entries = summary.search(**criteria)
+        print("Found " + str(len(entries)) + " events, displaying " + str(min(len(entries), num_events)) + ".")
+
+        tree_atar, tree_calo = self.get_trees(input_file)
+        for e in event_pipeline.iter_events(tree_atar, tree_calo, entries[:num_events], geometry=self.atar_geometry):
+            if display_text_output:
+                self.display_event(e)
+            self.plot_event(e, self.atar_geometry.n_planes)
+
+        return entries
+
+
     #Uses the TFile retreived from the .root file to get the active target and calorimeter trees, which are used by other methods to get the
-    #data we need.
+    #data we need. The trees are kept, so calling this again with the same TFile (e.g. from visualize_event()) does not look them up again.
     def get_trees(self, r_TFile):
-        self.tree_atar = r_TFile.Get("atar")
-        self.tree_calo = r_TFile.Get("calorimeter")
+        if getattr(self, "trees_file", None) is not r_TFile:
+            self.tree_atar = r_TFile.Get("atar")
+            self.tree_calo = r_TFile.Get("calorimeter")
+            self.trees_file = r_TFile
 
         return self.tree_atar, self.tree_calo
 
@@ -80,76 +115,9 @@ class Event_Visualizer:
     when particles have decayed.
     '''
     def process_event(self, tree_atar, tree_calo, event_index):
-        #Get the specified entries from our trees so we can extract data from them.
-        tree_atar.GetEntry(event_index)
-        tree_calo.GetEntry(event_index)
-
-        #Store pixel hits for the entry printed above in which a pion didn't decay at rest.
-        pixel_times = tree_atar.pixel_time
-        pixel_hits = tree_atar.pixel_hits
-        pixel_edep = tree_atar.pixel_edep
-        
-        #Initialize lists for storing color (for labeling data points according to decay product), t, x, y, z, energy, and energy per plane using the Event class.
-        npixels_per_plane = 100
-        event = Event()
-
-        #Init time value so 1st loop below works.
-        cur_time = 0
-        
-        #Extract x vs. t, y vs. t, and z vs. t data. Also add indexed color coding to represent different particles.
-        for i in range(pixel_hits.size()):
-            #We can get the plane number using some modular arithmetic on the pixel_hits values. Since these numbers start at 100,000, we must subtract
-            #100,000. We also have to subtract 1 to deal with 100 wrapping around to 0 when it shouldn't (i.e., an "off by one" error).
-            plane = int(np.floor((pixel_hits[i] - 1 - 100_000) / npixels_per_plane))
-
-            cur_val = (pixel_hits[i] - 1) % npixels_per_plane
-            last_time = cur_time    #Allows us to note any large time gaps for later analysis.
-            cur_time = pixel_times[i]
-
-            event.t_data.append(cur_time)
-
-            #Even planes give us x-values while odd-numbered planes give us y-values. We can use some simple modular arithmetic to distinguish between
-            #the two. We must also add NaNs to fill in the gaps in x_data and y_data to make sure the indices of actual data points correspond to the
-            #timestamps recorded in t_data.
-            if(plane % 2 == 0):
-                event.x_data.append(cur_val)
-                event.y_data.append(np.nan)
-            else:
-                event.y_data.append(cur_val)
-                event.x_data.append(np.nan)
-
-            event.z_data.append(plane)
-            event.E_data.append(pixel_edep[i])
-
-            #Keep track of any gaps in time between decays.
-            if cur_time - last_time > 1.0:      #TODO: Adjust this time gap (in ns) as needed.
-                event.gap_times.append(cur_time - last_time)
-
-            #Keep track of sum of energies deposited in each plane.
-            event.E_per_plane[plane] += pixel_edep[i]
-
-        #Keep track of particle IDs.
-        event.pixel_pdgs = tree_atar.pixel_pdg
-
-        #Keep track of maximum energy deposited per plane in this event.
-        event.max_E = max(event.E_per_plane)
-
-        #Extract all (theta, phi) pairs from the calorimeter tree.
-        global_crys_dict = calo_analysis.get_crystal_data()
-        #Get the IDs of the crystals that were hit at those (theta, phi) pairs from the calorimeter tree.
-        event.crystal_ids = list(tree_calo.crystal)
-        event.calo_edep = list(tree_calo.edep)
-
-        # Use the IDs (tree_calo.crystal) to get the corresponding values from the dictionary of (ID: (r, theta, phi)) values (global_crys_dict).
-        event.r_theta_phis = []
-        for ID in event.crystal_ids:
-            event.r_theta_phis.append(global_crys_dict.get(ID))
-
-        # print("crystal IDs: ", event.crystal_ids)
-        # print("edep: ", event.calo_edep)
-        # print("r_theta_phis: ", event.r_theta_phis)
-
-        return event
+        #Read the entry from our trees and decode all of its hits at once; see event_decoder.py for how the x, y, z, t, energy per plane and gap time
+        #data are extracted. The crystal IDs of the calorimeter hits are translated into (r, theta, phi) values with calo_analysis.get_crystal_geometry().
+        return event_decoder.decode_event(tree_atar, tree_calo, event_index, self.atar_geometry)
 
 
     #Show some useful data describing our event in textual form.
@@ -172,7 +140,8 @@ class Event_Visualizer:
 
     #Plot the following data from our event: x vs. t, y vs. t, z vs. t, E vs. z, and energy deposited in calorimeter by (theta, phi). The graphs 
     #will show the color-coding system used to represent different particles. Display 0 to num_planes on plots including the z variable.
-    def plot_event(self, event, num_planes):
+    #show (optional): Show the figure when done. Use show = False to save the returned figure instead, e.g. when running without a display.
+    def plot_event(self, event, num_planes, show = True):
 
         fig = plt.figure(figsize = (15, 10))
 
@@ -183,7 +152,7 @@ class Event_Visualizer:
         plt.ylabel("x (pixels)")
         plt.legend()
         plt.xlim(0, num_planes)
-        plt.ylim(0, 100)
+        plt.ylim(0, self.atar_geometry.n_strips_per_plane)
 
         plt.subplot(2,4,2)
         self.plot_with_color_legend(event.z_data, event.y_data, event.pixel_pdgs)
@@ -191,7 +160,7 @@ class Event_Visualizer:
         plt.xlabel("z (plane number)")
         plt.ylabel("y (pixels)")
         plt.xlim(0, num_planes)
-        plt.ylim(0, 100)
+        plt.ylim(0, self.atar_geometry.n_strips_per_plane)
 
         plt.subplot(2,4,3)
         self.plot_with_color_legend(event.t_data, event.z_data, event.pixel_pdgs)
@@ -204,7 +173,7 @@ class Event_Visualizer:
 
         plt.subplot(2,4,4)
         plt.scatter(event.z_data, event.E_data, 10, label = "e_dep")
-        plt.scatter(range(50), event.E_per_plane, 10, "black", label = "e_dep per plane")
+        plt.scatter(range(len(event.E_per_plane)), event.E_per_plane, 10, "black", label = "e_dep per plane")
         plt.title("ATAR Energy Deposition Per Plane vs. z")
         plt.xlabel("z (plane number)")
         plt.ylabel("Energy (MeV / plane)")
@@ -218,9 +187,9 @@ class Event_Visualizer:
         # is present - in this case, the calo ID could be marked as a single volume and we just get 1000, which we don't want to count. The points are
         # color coded by energy deposition and surrounded by a black border to make faint colors easier to distinguish from the white background.
         if len(event.crystal_ids) > 1:
-            color_range = event.calo_edep
-            thetas = [coords[1] for coords in event.r_theta_phis]
-            phis = [coords[2] for coords in event.r_theta_phis]
+            color_range = event.calo_edep[event.crystal_mask]
+            thetas = event.r_theta_phis[event.crystal_mask, 1]
+            phis = event.r_theta_phis[event.crystal_mask, 2]
 
             plt.scatter(thetas, phis, c=color_range, cmap="YlOrRd", edgecolors="black")
             plt.xlabel("Theta (rad)")
@@ -239,82 +208,50 @@ class Event_Visualizer:
         #                     hspace = 0.4)
         
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
 
+        return fig
 
-    #For each color in a list of color labels for different particles, plot the corresponding data.
-    def plot_with_color_legend(self, x_coords, y_coords, pixel_pdgs):
-        #Store colors and corresponding particle type labels in one place for ease of editing.
-        colors = ["r", "b", "g", "y", "m"]
-        labels = ["Pion", "Positron", "Electron", "Antimuon", "Muon"]
-        particle_IDs = [211, -11, 11, -13, 13]
-        
-        #Store list of tuples of our data to be processed below.
-        coords = list(zip(x_coords, y_coords, pixel_pdgs))
-
-        #Keep track of known particles and other particles to plot.
-        cur_data_to_plot = []
-        other_to_plot = []
-        other_IDs = []
-        other_colors = ["k", "gray", "cyan", "indigo", "teal", "lime"]
-
-        #For each color, extract all pdgs of that color and display them on a scatter plot.
-        for i in range(0, len(particle_IDs)):
-            for coord in coords:
-                if coord[2] == particle_IDs[i]:
-                    cur_data_to_plot.append(coord)
-                elif coord[2] not in particle_IDs:
-                    #Keep track of unidentified particles and their IDs so we can plot them separately after exiting this loop.
-                    other_to_plot.append(coord)
-                    if coord[2] not in other_IDs:
-                        other_IDs.append(coord[2])
-            
-            #Plot data for corresponding color each loop, but only if the data for the corresponding color is not empty.
-            if len(cur_data_to_plot) != 0:
-                plt.scatter([coord[0] for coord in cur_data_to_plot], [coord[1] for coord in cur_data_to_plot], 10, colors[i], label = labels[i])
-
-            #Reset data to plot every loop.
-            cur_data_to_plot = []
-
-        #Plot the unidentified particles in distinct colors with their pdgs for labels.
-        for i in range(0, len(other_IDs)):
-            ID = other_IDs[i]
-            
-            #Extract x and y coordinates to plot only if they are all of the particle ID that we are currently plotting.
-            # [coord[0] for coord in other_to_plot if coord[2] == ID]
-            x = []
-            y = []
-            for coord in other_to_plot:
-                if coord[2] == ID:
-                    x.append(coord[0])
-                    y.append(coord[1])
 
-            plt.scatter(x, y, 10, other_colors[i], label = str(ID))
+    #For each type of particle in the event, plot the corresponding data in its own color. The hits are grouped by particle ID in one pass (see
+    #particle_groups.py); pions, positrons, electrons, antimuons and muons have fixed colors, and any other particles are labelled with their pdg.
+    def plot_with_color_legend(self, x_coords, y_coords, pixel_pdgs):
+        x_coords = np.asarray(x_coords)
+        y_coords = np.asarray(y_coords)
+        for group in particle_groups.group_hits(pixel_pdgs):
+            plt.scatter(x_coords[group.hits], y_coords[group.hits], 10, color = group.color, label = group.label)
 
 
     # TODO This method needs to be adapted after first round of changes have been made.
     #Use cuts to select the events we want from the tree. Returns an integer list of the indices of the events that we want from the tree.
     #is_event_DAR: Value of 0 = decays in flight, 1 = decays at rest, 2 = all data used.
     #num_events:  Controls how many events we want to select.
-    def select_events(self, tree, is_event_DAR, num_events):
-        #Apply logical cut to select whether we want DARs and to exclude empty data. n stores the number of entries that satisfy this cut.
-        if is_event_DAR == 0:
-            cut = "!pion_dar && Sum$(pixel_edep) > 0"
-        elif is_event_DAR == 1:
-            cut = "pion_dar && Sum$(pixel_edep) > 0"
+    #sampling (optional):  "first" (the default) takes the first num_events matching events, "uniform" a random sample of them, and "stratified" a random
+    #                      sample with half decays in flight and half decays at rest (needs is_event_DAR = 2).
+    #seed (optional):  Seed for the random sampling, to get the same events again.
+    def select_events(self, tree, is_event_DAR, num_events, sampling = "first", seed = None):
+        #Apply logical cut to select whether we want DARs and to exclude empty data.
+        cut = event_selection.dar_cut(is_event_DAR)
+
+        #Scan the tree for indices that satisfy the cut. By default we stop as soon as we have the first num_events of them; otherwise we draw a random
+        #sample from the whole tree in one pass, either from all matching events or split evenly between decays in flight and at rest.
+        if sampling == "first":
+            selected_events = list(itertools.islice(event_pipeline.iter_selected_entries(tree, cut), num_events))
+        elif sampling == "uniform":
+            selected_events = event_selection.sample_entries(tree, cut, num_events, seed).tolist()
+        elif sampling == "stratified":
+            #With only decays in flight or at rest, one of the two strata would be empty and only about half of num_events would be drawn.
+            if is_event_DAR != 2:
+                raise ValueError("sampling = 'stratified' needs is_event_DAR = 2, got " + repr(is_event_DAR))
+            ks = [num_events - num_events // 2, num_events // 2]
+            samples = event_selection.sample_entries(tree, cut, ks, seed, strata=[event_selection.DIF_CUT, event_selection.DAR_CUT])
+            selected_events = np.sort(np.concatenate(samples)).tolist()
         else:
-            cut = "Sum$(pixel_edep) > 0"
-        n = tree.Draw("Entry$", cut, "goff")
-        
-        #Get all indices that satisfy the cut.
-        events = []
-        for i in range(n):
-            events.append(tree.GetV1()[i])
-
-        selected_events = events[0:num_events]
+            raise ValueError("sampling must be 'first', 'uniform' or 'stratified', got " + repr(sampling))
         print("Indices of selected events: " + str(selected_events))
 
-        return [int(i) for i in selected_events]
+        return selected_events
 
 
     '''
@@ -322,16 +259,14 @@ class Event_Visualizer:
     histogram form. One should notice that the DARs have a higher median energy deposited, though the means may be closer due to large outliers present in some DIF data.
     max_Es_DIF:  Data for maximum energies from decays in flight.
     max_Es_DAR:  Data for maximum energies from decays at rest.
-    num_bins:  Controls the number of bins used when plotting data on histograms.
+    Either can also be a histogram.Histogram of the values (e.g. from atar_exploration.event_histograms()), in which case the mean, median and standard deviation
+    are taken from its stats (see streaming_stats.py), or estimated from its bins if it has none.
+    num_bins:  Controls the number of bins used when plotting data on histograms. Histograms keep their own bins.
     '''
     def compare_max_edep(self, max_Es_DIF, max_Es_DAR, num_bins):
-        max_Es_DIF_mean = np.mean(max_Es_DIF)
-        max_Es_DIF_median = np.median(max_Es_DIF)
-        max_Es_DIF_std = np.std(max_Es_DIF)
+        max_Es_DIF_mean, max_Es_DIF_median, max_Es_DIF_std = histogram.summarize(max_Es_DIF)
 
-        max_Es_DAR_mean = np.mean(max_Es_DAR)
-        max_Es_DAR_median = np.median(max_Es_DAR)
-        max_Es_DAR_std = np.std(max_Es_DAR)
+        max_Es_DAR_mean, max_Es_DAR_median, max_Es_DAR_std = histogram.summarize(max_Es_DAR)
 
         print("\nmax_Es_DIF_mean: " + str(max_Es_DIF_mean))
         print("max_Es_DIF_median: " + str(max_Es_DIF_median))
@@ -344,9 +279,10 @@ class Event_Visualizer:
 
         plt.figure(figsize = (20, 6))
 
-        #Plot histograms. Saving bins parameter from first plot ensures that both histograms have the same number of bins.
-        _, bins, _ = plt.hist(max_Es_DIF, bins = num_bins, color = "blue", alpha = 0.5, label = "DIF")
-        plt.hist(max_Es_DAR, bins = bins, color = "orange", alpha = 0.5, label = "DAR")
+        #Plot histograms. Lists of values are binned with the same edges, covering both of them.
+        hist_DIF, hist_DAR = histogram.as_histograms((max_Es_DIF, max_Es_DAR), num_bins)
+        hist_DIF.plot(color = "blue", alpha = 0.5, label = "DIF")
+        hist_DAR.plot(color = "orange", alpha = 0.5, label = "DAR")
         plt.title("Max Energy by Group for Decays in Flight and Decays at Rest")
         plt.xlabel("Max Energy by Group (MeV)")
         plt.ylabel("Count")
@@ -359,16 +295,13 @@ class Event_Visualizer:
     gap_times: A list of times in ns.
     gap_times_DIF:  Data for times between decays for DIFs in ns.
     gap_times_DAR:  Data for times between decays for DARs in ns.
-    num_bins:  Controls the number of bins used when plotting data on histograms.
+    Either can also be a histogram.Histogram of the times, as for compare_max_edep().
+    num_bins:  Controls the number of bins used when plotting data on histograms. Histograms keep their own bins.
     '''
     def compare_gap_times(self, gap_times_DIF, gap_times_DAR, num_bins):
-        gap_times_DIF_mean = np.mean(gap_times_DIF)
-        gap_times_DIF_median = np.median(gap_times_DIF)
-        gap_times_DIF_std = np.std(gap_times_DIF)
+        gap_times_DIF_mean, gap_times_DIF_median, gap_times_DIF_std = histogram.summarize(gap_times_DIF)
 
-        gap_times_DAR_mean = np.mean(gap_times_DAR)
-        gap_times_DAR_median = np.median(gap_times_DAR)
-        gap_times_DAR_std = np.std(gap_times_DAR)
+        gap_times_DAR_mean, gap_times_DAR_median, gap_times_DAR_std = histogram.summarize(gap_times_DAR)
 
         print("\ngap_times_DIF_mean: " + str(gap_times_DIF_mean))
         print("gap_times_DIF_median: " + str(gap_times_DIF_median))
@@ -381,9 +314,10 @@ class Event_Visualizer:
 
         plt.figure(figsize = (20, 6))
 
-        #Plot histograms. Saving bins parameter from first plot ensures that both histograms have the same number of bins.
-        _, bins, _ = plt.hist(gap_times_DIF, bins = num_bins, color = "green", alpha = 0.5, label = "DIF")
-        plt.hist(gap_times_DAR, bins = bins, color = "brown", alpha = 0.5, label = "DAR")
+        #Plot histograms. Lists of values are binned with the same edges, covering both of them.
+        hist_DIF, hist_DAR = histogram.as_histograms((gap_times_DIF, gap_times_DAR), num_bins)
+        hist_DIF.plot(color = "green", alpha = 0.5, label = "DIF")
+        hist_DAR.plot(color = "brown", alpha = 0.5, label = "DAR")
         plt.title("Gap Times for Decays in Flight and Decays at Rest")
         plt.xlabel("Time (ns)")
         plt.ylabel("Count")
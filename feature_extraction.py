@@ -0,0 +1,203 @@
+'''
+Makes the tables of the cut study in cluster_data_analysis.py (output_pienu.csv / output_pimue.csv) from the simulation files, with the decoder of
+event_decoder.py and one vectorized pass per batch of events. Each row is one event, with the columns:
+  entry
+  is_DAR:             the pion_dar branch (-1 if the file does not have it).
+  stop_x, stop_y:     strip of the last hit (in time) of the stopping particle in an x plane / a y plane. The stopping particle is the pion for
+                      decays at rest and the muon for decays in flight, falling back to the pion if the muon left no hits. NaN if there is no such hit.
+  stop_z:             plane of the last hit of the stopping particle.
+  pi_mu_energy:       total energy deposited in the ATAR by pions and muons.
+  three_plane_E_sum:  energy deposited (by all particles) in the 3 planes before the stopping plane, stop_z - 3 to stop_z - 1.
+and, with per_particle = True, the energy deposited in each plane by each type of particle in PARTICLE_PDGS, e.g. E_pion_0, ..., E_pion_49. Whole
+files are done in parallel (see parallel_extraction.py) and written chunk by chunk to a .csv, .parquet (needs pyarrow) or .npz file:
+
+    extract_cut_table("pienu.root", "output_pienu.parquet", n_workers=32)
+    pienu_data = load_cut_table("output_pienu.parquet")
+'''
+
+import functools
+import os
+import numpy as np
+import event_decoder
+import parallel_extraction
+from atar_geometry import X_ORIENTATION, Y_ORIENTATION
+
+PION_PDGS = (211,)
+MUON_PDGS = (-13, 13)
+
+#Particle types whose energy per plane is written with per_particle = True, as in the legend of the event plots.
+PARTICLE_PDGS = {
+    "pion": (211,),
+    "positron": (-11,),
+    "electron": (11,),
+    "antimuon": (-13,),
+    "muon": (13,),
+}
+
+#Number of planes before the stopping plane summed in three_plane_E_sum.
+N_PRE_STOP_PLANES = 3
+
+
+#Index of the last hit (in time) of each event among the hits where mask is True, or -1 for events without any such hit. Hits at the same time are
+#ordered as they are stored.
+def _last_hit(batch, mask):
+    last = np.full(len(batch), -1, dtype=np.int64)
+    hits = np.flatnonzero(mask)
+    if len(hits) == 0:
+        return last
+    events = batch.hit_event_index[hits]
+    order = np.lexsort((hits, batch.times[hits], events))
+    hits, events = hits[order], events[order]
+    is_last = np.append(events[1:] != events[:-1], True)
+    last[events[is_last]] = hits[is_last]
+    return last
+
+
+#Values of a per-hit array at the given hit indices, NaN where the index is -1.
+def _at_hits(values, hits):
+    result = np.full(len(hits), np.nan)
+    found = hits >= 0
+    result[found] = values[hits[found]]
+    return result
+
+
+'''
+The columns described in the module description for an EventBatch, as a dictionary of arrays. The energies per plane and particle type are
+(n_events, n_planes) float32 arrays named E_pion etc. Used as the features function of parallel_extraction.extract_features().
+'''
+def cut_features(batch, per_particle = True):
+    n_events = len(batch)
+    is_DAR = batch.pion_dar if batch.pion_dar is not None else np.full(n_events, -1, dtype=np.int8)
+    hit_event_index = batch.hit_event_index
+    is_pion = np.isin(batch.pdgs, PION_PDGS)
+    is_muon = np.isin(batch.pdgs, MUON_PDGS)
+
+    #The stopping particle of each event, and which hits belong to it.
+    has_muon = np.bincount(hit_event_index[is_muon], minlength=n_events) > 0
+    stops_muon = (is_DAR == 0) & has_muon
+    is_stopping = np.where(stops_muon[hit_event_index], is_muon, is_pion)
+
+    strips = batch.strips.astype(np.float64)
+    stop_x = _at_hits(strips, _last_hit(batch, is_stopping & (batch.orientations == X_ORIENTATION)))
+    stop_y = _at_hits(strips, _last_hit(batch, is_stopping & (batch.orientations == Y_ORIENTATION)))
+    stop_z = _at_hits(batch.planes.astype(np.float64), _last_hit(batch, is_stopping))
+
+    #Energy in planes stop_z - 3 to stop_z - 1 (those that exist) from cumulative sums over the planes.
+    cumulative_E = np.zeros((n_events, batch.n_planes + 1))
+    np.cumsum(batch.E_per_plane, axis=1, out=cumulative_E[:, 1:])
+    three_plane_E_sum = np.full(n_events, np.nan)
+    stopped = ~np.isnan(stop_z)
+    stop_plane = stop_z[stopped].astype(np.int64)
+    rows = cumulative_E[stopped]
+    three_plane_E_sum[stopped] = rows[np.arange(len(rows)), stop_plane] - \
+                                 rows[np.arange(len(rows)), np.maximum(stop_plane - N_PRE_STOP_PLANES, 0)]
+
+    features = {
+        "entry": batch.entries,
+        "is_DAR": is_DAR,
+        "stop_x": stop_x,
+        "stop_y": stop_y,
+        "stop_z": stop_z,
+        "pi_mu_energy": np.bincount(hit_event_index, weights=np.where(is_pion | is_muon, batch.edeps, 0), minlength=n_events),
+        "three_plane_E_sum": three_plane_E_sum,
+    }
+
+    if per_particle:
+        plane_index = hit_event_index * batch.n_planes + batch.planes.astype(np.int64)
+        for name, pdgs in PARTICLE_PDGS.items():
+            E = np.bincount(plane_index, weights=np.where(np.isin(batch.pdgs, pdgs), batch.edeps, 0), minlength=n_events * batch.n_planes)
+            features["E_" + name] = E.reshape(n_events, batch.n_planes).astype(np.float32)
+    return features
+
+
+#The columns of a feature dictionary for a table: (n_events, n) arrays are split into the columns name_0, ..., name_(n - 1).
+def _table_columns(features):
+    columns = {}
+    for name, values in features.items():
+        if values.ndim == 2:
+            columns.update((name + "_" + str(i), values[:, i]) for i in range(values.shape[1]))
+        else:
+            columns[name] = values
+    return columns
+
+
+#The table format for a file name: "csv", "parquet" or "npz".
+def _table_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension not in ("csv", "parquet", "npz"):
+        raise ValueError("Cut tables are written as .csv, .parquet or .npz, not " + repr(path))
+    return extension
+
+
+'''
+Write feature dictionaries of consecutive chunks of events (e.g. from parallel_extraction.iter_features()) to one table file. .csv and .parquet
+files are written one chunk at a time, as the chunks come in; a .npz file is written once all chunks are in. Without any chunks, an empty table
+(without columns) is written.
+Returns the number of rows written.
+'''
+def write_cut_table(feature_dicts, path):
+    table_format = _table_format(path)
+    tmp_path = path + ".tmp"
+    n_rows = 0
+
+    if table_format == "npz":
+        features = event_decoder.concatenate_features(feature_dicts)
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **features)
+        os.replace(tmp_path, path)
+        return len(features.get("entry", []))
+
+    import pandas as pd
+    writer = None
+    try:
+        for features in feature_dicts:
+            chunk = pd.DataFrame(_table_columns(features))
+            if table_format == "csv":
+                chunk.to_csv(tmp_path, mode="w" if n_rows == 0 else "a", header=n_rows == 0, index=False)
+            else:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, table.schema)
+                writer.write_table(table)
+            n_rows += len(chunk)
+        if not os.path.exists(tmp_path):
+            if table_format == "csv":
+                open(tmp_path, "w").close()
+            else:
+                pd.DataFrame().to_parquet(tmp_path)
+    finally:
+        if writer is not None:
+            writer.close()
+    os.replace(tmp_path, path)
+    return n_rows
+
+
+'''
+Make the cut study table of a .root file and write it to a .csv, .parquet or .npz file.
+file_name: Path of the .root file.
+output: Path of the table to write; the format is taken from its extension.
+entries (optional): The entries to use. Defaults to all of them.
+per_particle (optional): Also write the energy per plane of each type of particle in PARTICLE_PDGS.
+n_workers, chunk_size, backend (optional): See parallel_extraction.extract_features().
+Returns the number of rows written.
+'''
+def extract_cut_table(file_name, output, entries = None, per_particle = True, n_workers = None, chunk_size = parallel_extraction.DEFAULT_CHUNK_SIZE,
+                      backend = "pyroot"):
+    features = functools.partial(cut_features, per_particle=per_particle)
+    return write_cut_table(parallel_extraction.iter_features(file_name, entries, n_workers, chunk_size, features=features, backend=backend), output)
+
+
+#Read a table written by extract_cut_table() (or a table of the same columns made on the cluster) into a pandas DataFrame, e.g. for plot_cut() in
+#cluster_data_analysis.py. 2D arrays of .npz files are split into columns as they are in .csv and .parquet files.
+def load_cut_table(path):
+    import pandas as pd
+    table_format = _table_format(path)
+    if table_format == "csv":
+        #An empty file is the table of no events written by write_cut_table().
+        return pd.read_csv(path) if os.path.getsize(path) > 0 else pd.DataFrame()
+    if table_format == "parquet":
+        return pd.read_parquet(path)
+    with np.load(path, allow_pickle=False) as f:
+        return pd.DataFrame(_table_columns({name: f[name] for name in f.files}))
@@ -0,0 +1,300 @@
+'''
+Histograms with fixed bin edges that are filled a batch of values at a time, instead of calling plt.hist() on lists of all values. A Histogram only
+holds its edges and counts, so the histograms of chunks of a file, of parallel workers or of several files are added up with + (or merge()), saved
+to a .npz file and plotted without ever having the per-event values of all events in memory:
+
+    edges = {"max_E": np.linspace(0, 5, 51), "gap_times": np.linspace(0, 100, 51)}
+    pienu = histogram_file("updated_remove_zeros.root", edges, n_workers=32, split_dar=True)
+    pienu["DAR"]["max_E"].plot(color="orange", label="DAR")
+    save_histograms("pienu_histograms.npz", pienu["DAR"])
+
+Values are binned as np.histogram() bins them: every bin includes its lower edge, and the last bin also its upper edge. Values below the first edge
+or above the last one are counted in underflow / overflow, and NaN values are not counted at all. A histogram made with stats = StreamingStats() (see
+streaming_stats.py) also keeps the exact mean and standard deviation and approximate quantiles of all finite values filled in, inside the edges or
+not.
+'''
+
+import copy
+import functools
+import os
+import numpy as np
+import event_decoder
+import parallel_extraction
+from atar_geometry import DEFAULT_ATAR_GEOMETRY
+from streaming_stats import StreamingStats
+
+#Values of pion_dar the events are split by with split_dar = True.
+DAR_GROUPS = {"DIF": 0, "DAR": 1}
+
+
+class Histogram:
+
+    def __init__(self, edges, counts = None, underflow = 0, overflow = 0, stats = None):
+        self.edges = np.asarray(edges, dtype=np.float64).reshape(-1)
+        if len(self.edges) < 2 or np.any(np.diff(self.edges) <= 0):
+            raise ValueError("Histogram edges must be at least 2 increasing values")
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64) if counts is None else np.array(counts)
+        if self.counts.shape != (len(self.edges) - 1,):
+            raise ValueError("A histogram with " + str(len(self.edges)) + " edges needs " + str(len(self.edges) - 1) + " counts")
+        self.underflow = underflow
+        self.overflow = overflow
+        self.stats = stats
+
+    #n_bins bins of equal width from low to high.
+    @classmethod
+    def uniform(cls, low, high, n_bins, stats = None):
+        return cls(np.linspace(low, high, n_bins + 1), stats=stats)
+
+    #An empty histogram with the same edges (and empty stats if this one has them, see StreamingStats.empty_like() for key).
+    def empty_like(self, key = None):
+        return Histogram(self.edges, stats=self.stats.empty_like(key) if self.stats is not None else None)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __repr__(self):
+        return "Histogram(" + str(len(self)) + " bins from " + str(self.edges[0]) + " to " + str(self.edges[-1]) + ", " + str(self.total) + " entries)"
+
+    #Sum of the counts in the bins (without underflow and overflow).
+    @property
+    def total(self):
+        return self.counts.sum()
+
+    @property
+    def centers(self):
+        return (self.edges[:-1] + self.edges[1:]) / 2
+
+    '''
+    Count values (any array, e.g. one feature of a batch of events) in the histogram. With weights (an array of the same length), each value counts
+    its weight instead of 1 and the counts become floats; the stats of a histogram that has them only count unweighted values. Returns the histogram
+    itself.
+    '''
+    def fill(self, values, weights = None):
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        if self.stats is not None:
+            if weights is not None:
+                raise ValueError("A histogram with stats can only be filled without weights")
+            self.stats.fill(values)
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float64).reshape(-1)
+            if len(weights) != len(values):
+                raise ValueError("weights must have one value per value")
+            if self.counts.dtype.kind != "f":
+                self.counts = self.counts.astype(np.float64)
+        is_nan = np.isnan(values)
+        if is_nan.any():
+            values = values[~is_nan]
+            weights = weights[~is_nan] if weights is not None else None
+
+        n_bins = len(self.counts)
+        bin_index = np.searchsorted(self.edges, values, side="right") - 1
+        bin_index[values == self.edges[-1]] = n_bins - 1
+        below, above = bin_index < 0, bin_index >= n_bins
+        inside = ~(below | above)
+
+        if weights is None:
+            self.counts += np.bincount(bin_index[inside], minlength=n_bins)
+            self.underflow += int(below.sum())
+            self.overflow += int(above.sum())
+        else:
+            self.counts += np.bincount(bin_index[inside], weights=weights[inside], minlength=n_bins)
+            self.underflow += float(weights[below].sum())
+            self.overflow += float(weights[above].sum())
+        return self
+
+    #Add the counts (and stats) of another histogram with the same edges to this one. Returns the histogram itself.
+    def merge(self, other):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Only histograms with the same edges can be merged")
+        if (self.stats is None) != (other.stats is None):
+            raise ValueError("Only histograms that both have stats, or both do not, can be merged")
+        if self.stats is not None:
+            self.stats.merge(other.stats)
+        if other.counts.dtype.kind == "f" and self.counts.dtype.kind != "f":
+            self.counts = self.counts.astype(np.float64)
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def __add__(self, other):
+        return copy.deepcopy(self).merge(other)
+
+    #Estimates of the mean, standard deviation and quantile q (0 to 1) of the values in the bins, taking the values of a bin to be spread evenly over
+    #it. They are accurate to about a bin width. For statistics of all values, including those outside of the edges, use stats.
+    def mean(self):
+        return np.sum(self.centers * self.counts) / self.total
+
+    def std(self):
+        widths = np.diff(self.edges)
+        return np.sqrt(np.sum(self.counts * ((self.centers - self.mean()) ** 2 + widths ** 2 / 12)) / self.total)
+
+    def quantile(self, q):
+        cumulative = np.concatenate(([0], np.cumsum(self.counts, dtype=np.float64)))
+        return np.interp(np.asarray(q) * cumulative[-1], cumulative, self.edges)
+
+    '''
+    Draw the histogram with ax.stairs(), on the current axes by default. density = True divides the counts by the total and the bin widths.
+    Other keyword arguments go to stairs(); the bins are filled unless fill = False is given. Returns the artist.
+    '''
+    def plot(self, ax = None, density = False, **kwargs):
+        if ax is None:
+            from matplotlib import pyplot as plt
+            ax = plt.gca()
+        values = self.counts / (self.total * np.diff(self.edges)) if density else self.counts
+        kwargs.setdefault("fill", True)
+        return ax.stairs(values, self.edges, **kwargs)
+
+    #Save the histogram (with its stats) to a .npz file (see save_histograms() for several histograms in one file).
+    def save(self, path):
+        save_histograms(path, {"histogram": self})
+
+    @classmethod
+    def load(cls, path):
+        return load_histograms(path)["histogram"]
+
+
+#Save a dictionary of Histograms to one .npz file, e.g. all histograms of a file for comparing with other files later.
+def save_histograms(path, histograms):
+    arrays = {}
+    for name, h in histograms.items():
+        arrays.update({name + ".edges": h.edges, name + ".counts": h.counts, name + ".flow": np.array([h.underflow, h.overflow])})
+        if h.stats is not None:
+            arrays.update((name + ".stats." + key, value) for key, value in h.stats.to_arrays().items())
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+#Load the dictionary of Histograms saved with save_histograms().
+def load_histograms(path):
+    with np.load(path, allow_pickle=False) as f:
+        names = [key[:-len(".edges")] for key in f.files if key.endswith(".edges")]
+        histograms = {}
+        for name in names:
+            underflow, overflow = f[name + ".flow"].tolist()
+            stats_keys = [key for key in f.files if key.startswith(name + ".stats.")]
+            stats = StreamingStats.from_arrays(**{key[len(name + ".stats."):]: f[key] for key in stats_keys}) if stats_keys else None
+            histograms[name] = Histogram(f[name + ".edges"], f[name + ".counts"], underflow, overflow, stats)
+    return histograms
+
+
+#Bin edges covering the finite values of all the samples (lists or arrays), with n_bins bins of equal width, as np.histogram() would choose for the
+#samples joined together. Used so that the histograms of the samples can be compared bin by bin.
+def shared_edges(samples, n_bins):
+    finite = [values[np.isfinite(values)] for values in (np.asarray(s, dtype=np.float64).reshape(-1) for s in samples)]
+    finite = [values for values in finite if len(values)]
+    if not finite:
+        return np.linspace(0, 1, n_bins + 1)
+    low, high = min(values.min() for values in finite), max(values.max() for values in finite)
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    return np.linspace(low, high, n_bins + 1)
+
+
+#Histograms of samples for comparing them: samples that are already Histograms are kept, the others (lists or arrays of values) are filled into
+#histograms with n_bins shared bins.
+def as_histograms(samples, n_bins):
+    values = [s for s in samples if not isinstance(s, Histogram)]
+    edges = shared_edges(values, n_bins) if values else None
+    return [s if isinstance(s, Histogram) else Histogram(edges).fill(s) for s in samples]
+
+
+#(mean, median, standard deviation) of a sample of values. The sample can also be a StreamingStats, or a Histogram, whose stats are used if it has
+#them and otherwise estimates from its bins.
+def summarize(sample):
+    if isinstance(sample, Histogram):
+        if sample.stats is None:
+            return (sample.mean(), sample.quantile(0.5), sample.std())
+        sample = sample.stats
+    if isinstance(sample, StreamingStats):
+        return (sample.mean(), sample.median(), sample.std())
+    return (np.mean(sample), np.median(sample), np.std(sample))
+
+
+#For each value of the feature "name", the pion_dar of the event it belongs to. Features with one value per event take pion_dar as it is; those
+#with several values per event (e.g. gap_times) are matched to the events through the CSR offsets (e.g. gap_offsets) they are split by.
+def _event_labels(features, name):
+    labels = np.asarray(features["pion_dar"])
+    n_values = len(features[name])
+    if n_values == len(labels):
+        return labels
+    for key, offsets in features.items():
+        if key.endswith("_offsets") and len(offsets) == len(labels) + 1 and offsets[-1] == n_values:
+            return np.repeat(labels, np.diff(offsets))
+    raise ValueError("Cannot tell which event each value of " + repr(name) + " belongs to")
+
+
+'''
+Fill histograms from one feature dictionary (e.g. of event_decoder.event_features()).
+histograms: Dictionary of Histograms (or StreamingStats, or anything else with fill()), filled with the feature of the same name. With
+            split_dar = True, a dictionary {"DIF": {...}, "DAR": {...}} of such dictionaries instead, each filled with the events of that kind only.
+Returns histograms.
+'''
+def fill_features(histograms, features, split_dar = False):
+    if not split_dar:
+        for name, h in histograms.items():
+            h.fill(features[name])
+        return histograms
+
+    for group, is_DAR in DAR_GROUPS.items():
+        for name, h in histograms[group].items():
+            h.fill(np.asarray(features[name])[_event_labels(features, name) == is_DAR])
+    return histograms
+
+
+#Add up dictionaries of Histograms or StreamingStats (as given by fill_features(), possibly split by DAR / DIF) of different chunks, workers or files.
+#template (optional): A dictionary of the same structure, e.g. the empty histograms that were filled. The sums start from empty copies of it, so
+#                     that these are returned if there are no dictionaries. Without a template, the sums take the structure of the first dictionary,
+#                     and are {} if there are none.
+def merge_histograms(histogram_dicts, template = None):
+    merged = None if template is None else _map_histograms(lambda h: h.empty_like(), template)
+    for histograms in histogram_dicts:
+        if merged is None:
+            merged = _map_histograms(lambda h: h.empty_like(), histograms)
+        _merge_into(merged, histograms)
+    return merged if merged is not None else {}
+
+
+def _map_histograms(function, histograms):
+    return {name: _map_histograms(function, h) if isinstance(h, dict) else function(h) for name, h in histograms.items()}
+
+
+def _merge_into(merged, histograms):
+    for name, h in histograms.items():
+        if isinstance(h, dict):
+            _merge_into(merged[name], h)
+        else:
+            merged[name].merge(h)
+
+
+#Work done by one worker of histogram_file(): histograms of the features of one batch of events, filled into empty copies of the given ones. The
+#copies are keyed by the first entry of the batch, so that their sketches get the same seeds in any worker (see streaming_stats.py).
+def _histogram_batch(batch, histograms, features, split_dar):
+    key = batch.entries[0] if len(batch) else 0
+    return fill_features(_map_histograms(lambda h: h.empty_like(key), histograms), features(batch), split_dar)
+
+
+'''
+Histogram features of the given entries of a .root file in parallel (see parallel_extraction.extract_features()). Every worker fills histograms of its
+chunks of entries and only these are sent back and added up, so no per-event values of the whole file are ever gathered.
+edges: Dictionary from feature names (e.g. "max_E", "gap_times") to bin edges, or to Histograms or StreamingStats to fill like them.
+split_dar (optional): Histogram decays in flight and decays at rest separately (see fill_features()).
+features (optional): Function computing the features from an EventBatch, defined at the top level of a module. Defaults to
+                     event_decoder.event_features(), which gives max_E, gap_times, n_hits, atar_edep, ...
+The other arguments are those of parallel_extraction.extract_features().
+Returns the dictionary of filled Histograms ({"DIF": {...}, "DAR": {...}} with split_dar = True).
+'''
+def histogram_file(file_name, edges, entries = None, n_workers = None, chunk_size = parallel_extraction.DEFAULT_CHUNK_SIZE, split_dar = False,
+                   features = event_decoder.event_features, geometry = DEFAULT_ATAR_GEOMETRY, gap_threshold = event_decoder.DEFAULT_GAP_THRESHOLD,
+                   read_calo = False, backend = "pyroot"):
+    histograms = {name: e.empty_like() if hasattr(e, "empty_like") else Histogram(e) for name, e in edges.items()}
+    if split_dar:
+        histograms = {group: _map_histograms(lambda h: h.empty_like(), histograms) for group in DAR_GROUPS}
+    batch_histograms = functools.partial(_histogram_batch, histograms=histograms, features=features, split_dar=split_dar)
+    return merge_histograms(parallel_extraction.iter_features(file_name, entries, n_workers, chunk_size, geometry, gap_threshold, read_calo,
+                                                              batch_histograms, backend), histograms)
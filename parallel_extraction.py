@@ -0,0 +1,86 @@
+'''
+Extracts per-event features (by default those of event_decoder.event_features(): max_E, gap times, pion_dar, ...) from a .root file using several
+processes. The entries of interest are split into chunks of chunk_size consecutive entries. Each worker process opens the file itself with a reader
+of tree_readers.py, decodes the chunks it is given and sends back only the compact feature arrays, which are then joined in entry order. The result
+is identical to decoding all the entries in one process, which is what happens when n_workers is 1.
+
+Example:
+    features = extract_features("updated_remove_zeros.root", n_workers=32)
+    max_Es, gap_times = features["max_E"], features["gap_times"]
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import event_decoder
+import tree_readers
+from atar_geometry import DEFAULT_ATAR_GEOMETRY
+
+DEFAULT_CHUNK_SIZE = 10_000
+
+
+#Work done by one worker: decode the given entries of the file and return their features.
+def _extract_chunk(args):
+    file_name, entries, geometry, gap_threshold, read_calo, features, backend = args
+    with tree_readers.open_reader(file_name, backend) as reader:
+        batch = reader.decode_entries(entries, geometry, gap_threshold, compact=False, read_calo=read_calo)
+    return features(batch)
+
+
+#Number of entries in the ATAR tree of a file.
+def count_entries(file_name, backend = "pyroot"):
+    with tree_readers.open_reader(file_name, backend) as reader:
+        return reader.n_entries
+
+
+#Split an array of entries into consecutive chunks of at most chunk_size entries.
+def split_entries(entries, chunk_size = DEFAULT_CHUNK_SIZE):
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive, got " + str(chunk_size))
+    entries = np.asarray(entries, dtype=np.int64)
+    return [entries[i:i + chunk_size] for i in range(0, len(entries), chunk_size)]
+
+
+#Like extract_features(), but yields the features of one chunk of entries at a time, in entry order, as soon as they are ready, so that they can be
+#written out or reduced without holding the features of all entries at once. The arguments are those of extract_features().
+def iter_features(file_name, entries = None, n_workers = None, chunk_size = DEFAULT_CHUNK_SIZE, geometry = DEFAULT_ATAR_GEOMETRY,
+                  gap_threshold = event_decoder.DEFAULT_GAP_THRESHOLD, read_calo = False, features = event_decoder.event_features,
+                  backend = "pyroot"):
+    #Counting the entries also makes the columnar cache here, if it has to be made, rather than in every worker at once.
+    n_entries = count_entries(file_name, backend)
+    if entries is None:
+        entries = np.arange(n_entries)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    tasks = [(file_name, chunk, geometry, gap_threshold, read_calo, features, backend) for chunk in split_entries(entries, chunk_size)]
+    if not tasks:
+        yield features(event_decoder.decode_arrays([0], [], [], [], [], geometry, gap_threshold))
+        return
+
+    if n_workers == 1 or len(tasks) == 1:
+        for task in tasks:
+            yield _extract_chunk(task)
+    else:
+        #map() gives back the results in the order of the tasks, so the features stay in entry order.
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(tasks))) as executor:
+            yield from executor.map(_extract_chunk, tasks)
+
+
+'''
+Decode the given entries of a .root file in parallel and return their features (see event_decoder.event_features()), in the order of entries.
+file_name: Path of the .root file. Every worker opens it on its own.
+entries (optional): The entries to decode, e.g. from select_events(). Defaults to all entries of the ATAR tree.
+n_workers (optional): Number of worker processes. Defaults to the number of CPUs; 1 decodes everything in this process.
+chunk_size (optional): Number of entries decoded by a worker at a time. Smaller chunks balance the load better, larger ones have less overhead.
+read_calo (optional): Also read the calorimeter tree. Not needed for the default features, so it is off by default.
+features (optional): Function computing a dictionary of feature arrays from an EventBatch. It must be defined at the top level of a module so that it
+                     can be sent to the workers. Defaults to event_decoder.event_features().
+backend (optional): The tree_readers.py backend the workers read the file with: "pyroot" (the default), "uproot" or "columnar". Only the branches
+                    the decoder needs are read.
+'''
+def extract_features(file_name, entries = None, n_workers = None, chunk_size = DEFAULT_CHUNK_SIZE, geometry = DEFAULT_ATAR_GEOMETRY,
+                     gap_threshold = event_decoder.DEFAULT_GAP_THRESHOLD, read_calo = False, features = event_decoder.event_features,
+                     backend = "pyroot"):
+    return event_decoder.concatenate_features(iter_features(file_name, entries, n_workers, chunk_size, geometry, gap_threshold, read_calo,
+                                                            features, backend))
@@ -0,0 +1,59 @@
+'''
+Groups the hits of an event by particle type (pixel_pdg) for the event displays, in one pass: the particle IDs are sorted once with np.unique and
+the hits of each type are read off the sorted order, so plotting takes one scatter call per particle type however many hits and types there are.
+The particles of KNOWN_PARTICLES come first, in that order and with their own colors and labels. Any other particles follow in the order of their
+first hit and are labelled with their pdg; the first of them get OTHER_COLORS, and any beyond those get generated colors, so there is no limit on
+the number of other particles.
+'''
+
+import colorsys
+from collections import namedtuple
+import numpy as np
+
+#Particle IDs with a fixed color and legend label, in the order they are plotted and listed in legends.
+KNOWN_PARTICLES = {
+    211: ("r", "Pion"),
+    -11: ("b", "Positron"),
+    11: ("g", "Electron"),
+    -13: ("y", "Antimuon"),
+    13: ("m", "Muon"),
+}
+
+#Colors of the first particles that are not in KNOWN_PARTICLES.
+OTHER_COLORS = ["k", "gray", "cyan", "indigo", "teal", "lime"]
+
+#The hits of one particle type: hits are their indices in the event, in the order they are stored.
+PdgGroup = namedtuple("PdgGroup", ["pdg", "label", "color", "hits"])
+
+
+#Color of the i-th particle type that is not in KNOWN_PARTICLES. Past OTHER_COLORS, hues are stepped by the golden ratio, which never repeats and keeps
+#consecutive colors far apart.
+def other_color(i):
+    if i < len(OTHER_COLORS):
+        return OTHER_COLORS[i]
+    return colorsys.hsv_to_rgb(((i - len(OTHER_COLORS)) * 0.618033988749895) % 1, 0.75, 0.8)
+
+
+#The hits of an event grouped by particle type, as a list of PdgGroups in plotting order (see the module description).
+def group_hits(pdgs):
+    pdgs = np.asarray(pdgs).reshape(-1)
+    unique, first_hit, inverse, counts = np.unique(pdgs, return_index=True, return_inverse=True, return_counts=True)
+    hits = np.split(np.argsort(inverse.reshape(-1), kind="stable"), np.cumsum(counts)[:-1])
+
+    unique = unique.tolist()
+    rank = {pdg: i for i, pdg in enumerate(KNOWN_PARTICLES)}
+    known = sorted((i for i, pdg in enumerate(unique) if pdg in rank), key=lambda i: rank[unique[i]])
+    others = [i for i in np.argsort(first_hit, kind="stable").tolist() if unique[i] not in rank]
+
+    groups = [PdgGroup(unique[i], KNOWN_PARTICLES[unique[i]][1], KNOWN_PARTICLES[unique[i]][0], hits[i]) for i in known]
+    groups += [PdgGroup(unique[i], str(unique[i]), other_color(j), hits[i]) for j, i in enumerate(others)]
+    return groups
+
+
+#(n_hits, 4) RGBA color of every hit of an event from its groups, for drawing all hits with a single scatter.
+def hit_colors(groups, n_hits):
+    from matplotlib.colors import to_rgba
+    colors = np.zeros((n_hits, 4))
+    for group in groups:
+        colors[group.hits] = to_rgba(group.color)
+    return colors
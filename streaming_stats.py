@@ -0,0 +1,266 @@
+'''
+Summary statistics of a feature (e.g. max_E or gap_times) over whole productions, filled a batch of values at a time in constant memory instead of
+calling np.mean(), np.median() and np.std() on lists of all values:
+  RunningStats:    count, mean, variance, min and max, updated exactly with Welford's method. Batches and accumulators of different workers are combined
+                   with the parallel update of Chan et al., so the order values come in does not change the result beyond rounding.
+  QuantileSketch:  approximate quantiles (median, tails) from a KLL sketch. It keeps at most about 3k values, and the rank of a quantile it gives is
+                   within about 2 / k (1% for the default k = 200) of the requested one with high probability, however many values are added.
+  StreamingStats:  both of these.
+
+All of them have fill() and merge() like histogram.Histogram, so they are filled the same way, e.g. in parallel over a file:
+
+    stats = histogram.histogram_file("updated_remove_zeros.root", {"max_E": StreamingStats()}, n_workers=32, split_dar=True)
+    print(stats["DAR"]["max_E"].median(), stats["DAR"]["max_E"].quantile([0.05, 0.95]))
+
+or next to a histogram, with histogram.Histogram(edges, stats=StreamingStats()). NaN and infinite values are not counted.
+
+Sketches made from a seeded sketch with empty_like() get seeds spawned from its seed, so their quantiles are reproducible too. The sketches of parts of
+the values (histogram_file() makes one per chunk of entries) are made with empty_like(key), which derives their seed from the seed and the key
+alone (e.g. the first entry of the chunk). Every part then gets its own random choices, and the same ones in whichever process it is filled, so
+the merged quantiles do not depend on the number of workers.
+'''
+
+import numpy as np
+
+DEFAULT_SKETCH_SIZE = 200
+
+
+#Values of a batch as a flat float64 array without NaNs and infinities, which would make the mean and variance NaN or infinite.
+def _finite_batch(values):
+    values = np.asarray(values, dtype=np.float64).reshape(-1)
+    return values[np.isfinite(values)]
+
+
+class RunningStats:
+
+    def __init__(self, n = 0, mean = 0.0, m2 = 0.0, minimum = np.inf, maximum = -np.inf):
+        self.n = n
+        self.mean = mean
+        #Sum of squared differences from the mean.
+        self.m2 = m2
+        self.min = minimum
+        self.max = maximum
+
+    #Combine the statistics of another set of values (count n, mean, sum of squared differences m2) with these.
+    def _combine(self, n, mean, m2, minimum, maximum):
+        if n == 0:
+            return self
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.n * n / total
+        self.n = total
+        self.min, self.max = np.minimum(self.min, minimum), np.maximum(self.max, maximum)
+        return self
+
+    #Add a batch of values. The statistics of the batch are computed with numpy and then combined with the running ones.
+    def fill(self, values):
+        values = _finite_batch(values)
+        if len(values) == 0:
+            return self
+        mean = values.mean()
+        return self._combine(len(values), mean, np.sum((values - mean) ** 2), values.min(), values.max())
+
+    def merge(self, other):
+        return self._combine(other.n, other.mean, other.m2, other.min, other.max)
+
+    def empty_like(self, key = None):
+        return RunningStats()
+
+    #Variance with ddof as in np.var() (0, the population variance, by default). NaN without enough values.
+    def variance(self, ddof = 0):
+        return self.m2 / (self.n - ddof) if self.n > ddof else np.nan
+
+    def std(self, ddof = 0):
+        return np.sqrt(self.variance(ddof))
+
+    def to_array(self):
+        return np.array([self.n, self.mean, self.m2, self.min, self.max], dtype=np.float64)
+
+    @classmethod
+    def from_array(cls, array):
+        n, mean, m2, minimum, maximum = np.asarray(array, dtype=np.float64).tolist()
+        return cls(int(n), mean, m2, minimum, maximum)
+
+
+'''
+KLL sketch (Karnin, Lang and Liberty, "Optimal Quantile Approximation in Streams") of a stream of values. Values are kept in levels; a value in level h
+stands for 2^h of the values added. When a level holds more values than its capacity, it is sorted and every other value (starting at random from the
+first or the second) moves up a level, which halves the level and keeps the ranks of all values correct to within the level's weight. Capacities
+shrink by 2/3 per level below the top one, so the sketch holds at most about 3k values in total.
+k:     Capacity of the top level; the error of the ranks is about 2 / k.
+seed:  Seed (or np.random.SeedSequence) of the random choices, for reproducible sketches.
+'''
+class QuantileSketch:
+
+    def __init__(self, k = DEFAULT_SKETCH_SIZE, seed = None):
+        if k < 2:
+            raise ValueError("k must be at least 2, got " + str(k))
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self._seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self._rng = np.random.default_rng(self._seed)
+
+    def _capacity(self, level):
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (len(self.levels) - 1 - level))))
+
+    #Compact levels until none holds more than its capacity. Adding a level lowers the capacities of those below it, hence the repeated passes.
+    def _compress(self):
+        compacted = True
+        while compacted:
+            compacted = False
+            for level in range(len(self.levels)):
+                if len(self.levels[level]) <= self._capacity(level):
+                    continue
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                values = np.sort(self.levels[level])
+                #With an odd number of values, the smallest one stays in this level.
+                n_kept = len(values) % 2
+                self.levels[level] = values[:n_kept]
+                self.levels[level + 1] = np.concatenate((self.levels[level + 1], values[n_kept + self._rng.integers(2)::2]))
+                compacted = True
+
+    def fill(self, values):
+        values = _finite_batch(values)
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self.n += len(values)
+        self._compress()
+        return self
+
+    #Add the values of another sketch (made with the same k) to this one.
+    def merge(self, other):
+        if other.k != self.k:
+            raise ValueError("Only sketches with the same k can be merged")
+        for level, values in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate((self.levels[level], values))
+        self.n += other.n
+        self._compress()
+        return self
+
+    #A new seed spawned from the seed of this sketch, for the sketches made from it.
+    def spawn_seed(self):
+        return self._seed.spawn(1)[0]
+
+    #The seed of the sketch of the part of the values given by the integer key. It is the same for every copy of this sketch, unlike those of
+    #spawn_seed(), which depend on how many seeds the copy has spawned before, and differs from them as the key is added to the entropy.
+    def keyed_seed(self, key):
+        entropy = list(self._seed.entropy) if isinstance(self._seed.entropy, (list, tuple)) else [self._seed.entropy]
+        return np.random.SeedSequence(entropy + [int(key)], spawn_key=self._seed.spawn_key)
+
+    #An empty sketch with the same k, seeded with keyed_seed(key) if a key is given and with spawn_seed() otherwise.
+    def empty_like(self, key = None):
+        return QuantileSketch(self.k, self.spawn_seed() if key is None else self.keyed_seed(key))
+
+    #The values of the sketch in increasing order, and the number of added values each stands for.
+    def _weighted_values(self):
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(v), 2 ** level, dtype=np.float64) for level, v in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        return values[order], weights[order]
+
+    #Approximate quantile(s) q (0 to 1): the smallest value whose rank is at least q * n. NaN if no values were added.
+    def quantile(self, q):
+        q = np.asarray(q, dtype=np.float64)
+        if self.n == 0:
+            return np.full(q.shape, np.nan) if q.ndim else np.nan
+        values, weights = self._weighted_values()
+        index = np.searchsorted(np.cumsum(weights), q * weights.sum(), side="left")
+        return values[np.clip(index, 0, len(values) - 1)]
+
+    #Approximate fraction(s) of the added values that are <= x.
+    def rank(self, x):
+        values, weights = self._weighted_values()
+        cumulative = np.concatenate(([0], np.cumsum(weights)))
+        return cumulative[np.searchsorted(values, x, side="right")] / max(self.n, 1)
+
+    #The sketch as arrays for saving: the values of all levels, and the k, n and number of values of each level.
+    def to_arrays(self):
+        return {"values": np.concatenate(self.levels), "shape": np.array([self.k, self.n, *map(len, self.levels)], dtype=np.int64)}
+
+    #The sketch saved by to_arrays(). The random choices of values filled in afterwards are made with the given seed.
+    @classmethod
+    def from_arrays(cls, values, shape, seed = None):
+        k, n, *lengths = np.asarray(shape).tolist()
+        sketch = cls(k, seed)
+        sketch.n = n
+        sketch.levels = np.split(np.asarray(values, dtype=np.float64), np.cumsum(lengths)[:-1])
+        return sketch
+
+
+#RunningStats and a QuantileSketch of the same values: mean, std, min and max are exact, median and quantile approximate.
+class StreamingStats:
+
+    def __init__(self, k = DEFAULT_SKETCH_SIZE, seed = None):
+        self.moments = RunningStats()
+        self.sketch = QuantileSketch(k, seed)
+
+    def __repr__(self):
+        return "StreamingStats(n=" + str(self.n) + ", mean=" + str(self.mean()) + ", median~" + str(self.median()) + ", std=" + str(self.std()) + ")"
+
+    def fill(self, values):
+        values = _finite_batch(values)
+        self.moments.fill(values)
+        self.sketch.fill(values)
+        return self
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    #Empty statistics with a sketch like this one's (see QuantileSketch.empty_like()).
+    def empty_like(self, key = None):
+        return StreamingStats(self.sketch.k, self.sketch.spawn_seed() if key is None else self.sketch.keyed_seed(key))
+
+    def copy(self):
+        return StreamingStats.from_arrays(**self.to_arrays(), seed=self.sketch.spawn_seed())
+
+    @property
+    def n(self):
+        return self.moments.n
+
+    def mean(self):
+        return self.moments.mean if self.n else np.nan
+
+    def std(self, ddof = 0):
+        return self.moments.std(ddof)
+
+    def min(self):
+        return self.moments.min if self.n else np.nan
+
+    def max(self):
+        return self.moments.max if self.n else np.nan
+
+    def quantile(self, q):
+        return self.sketch.quantile(q)
+
+    def median(self):
+        return self.quantile(0.5)
+
+    #The statistics as a dictionary, e.g. for printing or a table row.
+    def summary(self, quantiles = (0.05, 0.25, 0.5, 0.75, 0.95)):
+        summary = {"n": self.n, "mean": self.mean(), "std": self.std(), "min": self.min(), "max": self.max()}
+        summary.update(("q" + format(q, "g"), value) for q, value in zip(quantiles, np.atleast_1d(self.quantile(quantiles))))
+        return summary
+
+    #Arrays for saving the statistics in a .npz file (see histogram.save_histograms()), and back.
+    def to_arrays(self):
+        sketch = self.sketch.to_arrays()
+        return {"moments": self.moments.to_array(), "sketch_values": sketch["values"], "sketch_shape": sketch["shape"]}
+
+    @classmethod
+    def from_arrays(cls, moments, sketch_values, sketch_shape, seed = None):
+        stats = cls()
+        stats.moments = RunningStats.from_array(moments)
+        stats.sketch = QuantileSketch.from_arrays(sketch_values, sketch_shape, seed)
+        return stats
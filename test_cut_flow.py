@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+from cut_flow import Cut, CutFlow
+
+
+def _samples():
+    rng = np.random.default_rng(0)
+    return {"PiENu": pd.DataFrame({"x": rng.normal(size=1000)}), "PiMuE": {"x": rng.normal(0.5, size=800)}}
+
+
+def test_empty_cut_flow_passes_every_event():
+    flow = CutFlow(_samples(), cuts=[])
+    assert flow.n_events == {"PiENu": 1000, "PiMuE": 800}
+    assert flow.count("PiENu") == 1000
+    assert flow.count("PiMuE") == 800
+    assert flow.suppression_factor() == 1
+
+
+def test_suppression_factor_matches_counting():
+    samples = _samples()
+    flow = CutFlow(samples, [Cut("x", "x", (-1, 0.3))])
+    efficiencies = [np.mean(np.asarray(samples[name]["x"]) < 0.3) for name in ("PiENu", "PiMuE")]
+    assert np.isclose(flow.suppression_factor(), efficiencies[0] / efficiencies[1])
+
+
+def test_bootstrap_does_not_depend_on_chunking():
+    flow = CutFlow(_samples(), [Cut("x", "x", (-1, 0.3))])
+    replicas = [flow.bootstrap(n_replicas=350, seed=3, chunk_size=chunk_size)["replicas"] for chunk_size in (1000, 100)]
+    assert np.array_equal(replicas[0], replicas[1])
@@ -0,0 +1,55 @@
+import functools
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import event_decoder
+import histogram
+import parallel_extraction
+from histogram import Histogram
+from streaming_stats import QuantileSketch, StreamingStats
+
+
+#Features of batches without hits: one pseudo-random value per entry, so that every chunk gives the same values wherever it is decoded.
+def _entry_values(batch):
+    return {"x": np.random.default_rng(batch.entries).normal(size=len(batch))}
+
+
+def _batches(n_entries, chunk_size):
+    return [event_decoder.decode_arrays(np.zeros(len(chunk) + 1, dtype=np.int64), [], [], [], [], entries=chunk)
+            for chunk in parallel_extraction.split_entries(np.arange(n_entries), chunk_size)]
+
+
+#histogram_file() with one worker fills every chunk in this process, and with several sends a pickled copy of the histograms with every chunk.
+def _histogram_chunks(batches, n_workers, seed):
+    template = {"x": Histogram(np.linspace(-3, 3, 13), stats=StreamingStats(k=50, seed=seed))}
+    batch_histograms = functools.partial(histogram._histogram_batch, histograms=template, features=_entry_values, split_dar=False)
+    if n_workers == 1:
+        parts = [batch_histograms(batch) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            parts = list(executor.map(batch_histograms, batches))
+    return histogram.merge_histograms(parts, template)["x"]
+
+
+def test_parallel_and_serial_quantiles_are_equal():
+    batches = _batches(20_000, 2_000)
+    serial = _histogram_chunks(batches, 1, seed=7)
+    parallel = _histogram_chunks(batches, 3, seed=7)
+    q = [0.05, 0.25, 0.5, 0.75, 0.95]
+    assert np.array_equal(serial.counts, parallel.counts)
+    assert np.array_equal(serial.stats.quantile(q), parallel.stats.quantile(q))
+    assert serial.stats.n == 20_000
+
+
+def test_keyed_seeds_differ_between_keys_and_not_between_copies():
+    sketch = QuantileSketch(seed=0)
+    copies = [pickle.loads(pickle.dumps(sketch)) for _ in range(2)]
+    assert copies[0].keyed_seed(5).generate_state(4).tolist() == copies[1].keyed_seed(5).generate_state(4).tolist()
+    assert sketch.keyed_seed(5).generate_state(4).tolist() != sketch.keyed_seed(6).generate_state(4).tolist()
+    assert sketch.keyed_seed(0).generate_state(4).tolist() != sketch.spawn_seed().generate_state(4).tolist()
+
+
+def test_merge_histograms_without_input_gives_empty_template():
+    merged = histogram.merge_histograms([], {"x": Histogram([0, 1, 2])})
+    assert merged["x"].total == 0
+    assert histogram.merge_histograms([]) == {}
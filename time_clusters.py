@@ -0,0 +1,180 @@
+'''
+Time structure of the hits of events: the gaps between consecutive hits in time, and the clusters of hits they separate. A pion that decays at rest
+leaves its track, then after a gap the track of the muon, and after another gap (of the order of the muon lifetime) that of the positron, so the
+clusters of a pi -> mu -> e decay at rest are the pion stop, the muon decay and the positron; a decay in flight gives fewer clusters.
+
+The hits of a batch are sorted by time once (see event_decoder.time_steps()), after which gaps and clusters at any threshold are vectorized passes
+over the sorted hits. TimeSteps counts the gaps of every event above many thresholds in one pass, and splits events into clusters with their times,
+energy, planes and particle types. To tune the DAR / DIF gap threshold, the largest gap of every event is extracted once per file, after which any
+number of thresholds are scanned in a fraction of a second without decoding the file again:
+
+    gaps = extract_gap_features("updated_remove_zeros.root", n_workers=32)
+    scan = scan_gap_threshold(gaps, np.linspace(0, 50, 501))
+    clusters = extract_time_clusters("updated_remove_zeros.root", gap_threshold=5, n_workers=32)
+'''
+
+import functools
+import numpy as np
+import cut_scan
+import event_decoder
+import parallel_extraction
+from atar_geometry import DEFAULT_ATAR_GEOMETRY
+from feature_extraction import PARTICLE_PDGS
+
+
+'''
+The hits of an EventBatch in time order, with the time from each hit to the next one of the same event.
+order: Indices of the hits in order of event and then time.
+steps: For each hit in that order, the time to the next hit of its event (NaN for the last hit of each event). A gap is a step above a threshold.
+'''
+class TimeSteps:
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.order, self.steps = event_decoder.time_steps(batch.hit_event_index, batch.times)
+        #The hits of each event keep their place in the arrays when they are sorted by time, so hit_offsets hold for the sorted hits as well.
+        self.event_index = batch.hit_event_index[self.order]
+
+    def __len__(self):
+        return len(self.batch)
+
+    #(n_events, len(thresholds)) number of gaps of each event above each threshold, in the order of thresholds. Every step is counted once, in the
+    #cell of the sorted thresholds it is above, and the counts are summed over the thresholds from the top down.
+    def count_gaps(self, thresholds):
+        thresholds = np.asarray(thresholds, dtype=np.float64).reshape(-1)
+        sorter = np.argsort(thresholds, kind="stable")
+        n_thresholds = len(thresholds) + 1
+        is_step = ~np.isnan(self.steps)
+        #A step is above sorted threshold i if i < the number of thresholds below the step.
+        n_below = np.searchsorted(thresholds[sorter], self.steps[is_step], side="left")
+        counts = np.bincount(self.event_index[is_step] * n_thresholds + n_below, minlength=len(self) * n_thresholds)
+        counts = np.cumsum(counts.reshape(len(self), n_thresholds)[:, ::-1], axis=1)[:, ::-1][:, 1:]
+        return counts[:, np.argsort(sorter)]
+
+    #Largest step of each event, 0 for events with fewer than two hits. An event has a gap above a threshold if its largest step is above it.
+    def max_gap(self):
+        max_gap = np.zeros(len(self))
+        has_hits = self.batch.n_hits > 0
+        if has_hits.any():
+            max_gap[has_hits] = np.maximum.reduceat(np.nan_to_num(self.steps, nan=0), self.batch.hit_offsets[:-1][has_hits])
+        return max_gap
+
+    '''
+    Split the hits of every event into clusters at the gaps above gap_threshold. Returns a dictionary of arrays with the clusters of all events in
+    time order, CSR-style (the clusters of event i are cluster_offsets[i] to cluster_offsets[i + 1]):
+      entries, cluster_offsets:                  per event.
+      cluster_entry, cluster_index:              entry of the event of each cluster, and its number in the event (0 for the earliest).
+      cluster_start, cluster_end:                times of its first and last hit.
+      cluster_n_hits, cluster_E:                 number of hits and energy deposited.
+      cluster_first_plane, cluster_last_plane:   lowest and highest plane hit.
+      cluster_main_pdg:                          the particle type that deposited the most energy.
+      cluster_E_pion, ...:                       energy deposited by each type of particle in feature_extraction.PARTICLE_PDGS.
+    '''
+    def clusters(self, gap_threshold = event_decoder.DEFAULT_GAP_THRESHOLD):
+        batch = self.batch
+        n_hits = len(self.order)
+        #A cluster starts at the first hit of every event and at every hit after a gap.
+        is_start = np.ones(n_hits, dtype=bool)
+        is_start[1:] = (self.event_index[1:] != self.event_index[:-1]) | (self.steps[:-1] > gap_threshold)
+        starts = np.flatnonzero(is_start)
+        ends = np.append(starts, n_hits)[1:]
+        cluster_id = np.cumsum(is_start) - 1
+        cluster_event = self.event_index[starts]
+        n_clusters = len(starts)
+        cluster_offsets = event_decoder.lengths_to_offsets(np.bincount(cluster_event, minlength=len(batch)))
+
+        times = batch.times[self.order].astype(np.float64)
+        edeps = batch.edeps[self.order].astype(np.float64)
+        planes = batch.planes[self.order].astype(np.int64)
+        pdgs = batch.pdgs[self.order].astype(np.int64)
+
+        clusters = {
+            "entries": batch.entries,
+            "cluster_offsets": cluster_offsets,
+            "cluster_entry": batch.entries[cluster_event],
+            "cluster_index": np.arange(n_clusters) - cluster_offsets[cluster_event],
+            "cluster_start": times[starts],
+            "cluster_end": times[ends - 1],
+            "cluster_n_hits": ends - starts,
+            "cluster_E": np.bincount(cluster_id, weights=edeps, minlength=n_clusters),
+            "cluster_first_plane": np.minimum.reduceat(planes, starts) if n_clusters else np.empty(0, dtype=np.int64),
+            "cluster_last_plane": np.maximum.reduceat(planes, starts) if n_clusters else np.empty(0, dtype=np.int64),
+            "cluster_main_pdg": _main_pdg(cluster_id, pdgs, edeps, n_clusters),
+        }
+        for name, particle_pdgs in PARTICLE_PDGS.items():
+            clusters["cluster_E_" + name] = np.bincount(cluster_id, weights=np.where(np.isin(pdgs, particle_pdgs), edeps, 0), minlength=n_clusters)
+        return clusters
+
+
+#The pdg that deposited the most energy in each cluster, from the cluster number, pdg and energy of every hit. The energy of every (cluster, pdg)
+#pair is summed over its run of hits after sorting the hits by pdg within their clusters.
+def _main_pdg(cluster_id, pdgs, edeps, n_clusters):
+    main_pdg = np.zeros(n_clusters, dtype=np.int64)
+    if n_clusters == 0:
+        return main_pdg
+    order = np.lexsort((pdgs, cluster_id))
+    cluster_id, pdgs = cluster_id[order], pdgs[order]
+    is_new = np.ones(len(order), dtype=bool)
+    is_new[1:] = (cluster_id[1:] != cluster_id[:-1]) | (pdgs[1:] != pdgs[:-1])
+    pair_starts = np.flatnonzero(is_new)
+    pair_E = np.add.reduceat(edeps[order], pair_starts)
+    pair_cluster, pair_pdg = cluster_id[pair_starts], pdgs[pair_starts]
+
+    #The last pair of each cluster after sorting by cluster and then energy has the most energy.
+    best = np.lexsort((pair_E, pair_cluster))
+    is_last = np.append(pair_cluster[best][1:] != pair_cluster[best][:-1], True)
+    main_pdg[pair_cluster[best][is_last]] = pair_pdg[best][is_last]
+    return main_pdg
+
+
+'''
+Per-event gap features of an EventBatch, as a dictionary of arrays: entries, pion_dar (-1 where unknown), max_gap (see TimeSteps.max_gap()) and,
+if thresholds are given, n_gaps, the (n_events, len(thresholds)) number of gaps above each threshold. Used as the features function of
+parallel_extraction.extract_features().
+'''
+def gap_features(batch, thresholds = None):
+    steps = TimeSteps(batch)
+    features = {
+        "entries": batch.entries,
+        "pion_dar": batch.pion_dar if batch.pion_dar is not None else np.full(len(batch), -1, dtype=np.int8),
+        "max_gap": steps.max_gap(),
+    }
+    if thresholds is not None:
+        features["n_gaps"] = steps.count_gaps(thresholds)
+    return features
+
+
+#The time clusters of an EventBatch at the given gap threshold (see TimeSteps.clusters()). Used as the features function of
+#parallel_extraction.extract_features().
+def cluster_features(batch, gap_threshold = event_decoder.DEFAULT_GAP_THRESHOLD):
+    return TimeSteps(batch).clusters(gap_threshold)
+
+
+#Gap features (see gap_features()) of the given entries of a .root file, decoded in parallel. See parallel_extraction.extract_features() for the
+#other arguments.
+def extract_gap_features(file_name, entries = None, thresholds = None, n_workers = None, chunk_size = parallel_extraction.DEFAULT_CHUNK_SIZE,
+                         geometry = DEFAULT_ATAR_GEOMETRY, backend = "pyroot"):
+    features = functools.partial(gap_features, thresholds=thresholds)
+    return parallel_extraction.extract_features(file_name, entries, n_workers, chunk_size, geometry, features=features, backend=backend)
+
+
+#Time clusters (see TimeSteps.clusters()) of the given entries of a .root file, decoded in parallel. See parallel_extraction.extract_features() for
+#the other arguments.
+def extract_time_clusters(file_name, entries = None, gap_threshold = event_decoder.DEFAULT_GAP_THRESHOLD, n_workers = None,
+                          chunk_size = parallel_extraction.DEFAULT_CHUNK_SIZE, geometry = DEFAULT_ATAR_GEOMETRY, backend = "pyroot"):
+    features = functools.partial(cluster_features, gap_threshold=gap_threshold)
+    return parallel_extraction.extract_features(file_name, entries, n_workers, chunk_size, geometry, gap_threshold, features=features,
+                                                backend=backend)
+
+
+'''
+Scan gap thresholds for telling decays at rest from decays in flight by whether an event has a gap above the threshold, from the max_gap and pion_dar
+of gap features (see gap_features()). Events where pion_dar is unknown are left out.
+Returns a DataFrame with one row per threshold: threshold, DAR_eff (fraction of decays at rest with a gap above it), DIF_eff (fraction of decays in
+flight with one) and supp (DAR_eff / DIF_eff).
+'''
+def scan_gap_threshold(features, thresholds):
+    pion_dar = np.asarray(features["pion_dar"])
+    max_gap = np.asarray(features["max_gap"], dtype=np.float64)
+    scan = cut_scan.scan_threshold({"max_gap": max_gap[pion_dar == 1]}, {"max_gap": max_gap[pion_dar == 0]}, "max_gap", thresholds, side="lower")
+    return scan.rename(columns={"signal_eff": "DAR_eff", "background_eff": "DIF_eff"})
@@ -0,0 +1,249 @@
+'''
+Readers that get the branches of the atar and calorimeter trees of a file into flat NumPy arrays, with interchangeable backends:
+  "pyroot":    PyROOT. Only the requested branches are enabled with SetBranchStatus, so GetEntry does not decompress the others.
+  "uproot":    uproot (pure Python, no ROOT install needed). The requested branches are read in bulk, one cluster of entries at a time, and only
+               the clusters containing requested entries are read.
+  "columnar":  the memory-mapped columnar cache of columnar_cache.py, converting the file first if needed.
+The caller names the branches it needs, e.g. studies of max_E only read the ATAR tree and never touch the calorimeter:
+
+    with open_reader("updated_remove_zeros.root", "uproot") as reader:
+        batch = reader.decode_entries(range(100_000), read_calo=False)
+
+read_entries() gives the same dictionary as event_decoder.read_entries(), so every backend decodes to exactly the same EventBatch.
+'''
+
+import numpy as np
+import event_decoder
+from atar_geometry import DEFAULT_ATAR_GEOMETRY
+
+ATAR_TREE = "atar"
+CALO_TREE = "calorimeter"
+
+#Branches of the trees that hold one vector per entry. Vector branches of the same tree have the same length in every entry, so they share offsets.
+VECTOR_BRANCHES = {"pixel_hits", "pixel_time", "pixel_edep", "pixel_pdg", "crystal", "edep"}
+
+#The ATAR and calorimeter branches the decoder needs.
+HIT_BRANCHES = ("pixel_hits", "pixel_time", "pixel_edep", "pixel_pdg")
+CALO_BRANCHES = ("crystal", "edep")
+
+#Data types of the branches as given by read_entries(), the same as those of event_decoder.read_entries().
+BRANCH_DTYPES = {
+    "pixel_hits": np.int64,
+    "pixel_time": np.float64,
+    "pixel_edep": np.float64,
+    "pixel_pdg": np.int64,
+    "pion_dar": np.int8,
+    "crystal": np.int64,
+    "edep": np.float64,
+}
+
+
+#Open a .root file and return (TFile, ATAR tree, calorimeter tree or None). ROOT is only imported here so that the workers are the ones that load it.
+def open_trees(file_name, read_calo = True):
+    import ROOT as r
+    r_TFile = r.TFile.Open(file_name)
+    if not r_TFile or r_TFile.IsZombie():
+        raise OSError("Could not open " + file_name)
+    tree_calo = r_TFile.Get(CALO_TREE) if read_calo else None
+    return r_TFile, r_TFile.Get(ATAR_TREE), tree_calo
+
+
+#Empty result of read_branches() for the given branches.
+def _empty_branches(branches):
+    data = {name: np.empty(0, dtype=BRANCH_DTYPES.get(name, np.float64)) for name in branches}
+    if any(name in VECTOR_BRANCHES for name in branches):
+        data["offsets"] = np.zeros(1, dtype=np.int64)
+    return data
+
+
+'''
+Interface of all readers. A backend implements n_entries, has_branch(), read_branches() and close(); decoding is shared.
+'''
+class TreeReader:
+
+    #Number of entries in the ATAR tree.
+    @property
+    def n_entries(self):
+        raise NotImplementedError
+
+    #True if the given tree of the file has the given branch.
+    def has_branch(self, tree_name, name):
+        raise NotImplementedError
+
+    #Read the given branches of one tree for the given (sorted or unsorted) entries. Returns a dictionary with one array per branch; vector branches
+    #are flattened over all entries and split up by the CSR-style "offsets" array that is added when any vector branch is read.
+    def read_branches(self, tree_name, branches, entries):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    #The same dictionary as event_decoder.read_entries(), reading only the branches the decoder needs. With read_calo = False, or if the file has no
+    #calorimeter tree, the calorimeter is not read at all.
+    def read_entries(self, entries, read_calo = True):
+        entries = np.asarray(entries, dtype=np.int64).reshape(-1)
+        read_pion_dar = self.has_branch(ATAR_TREE, "pion_dar")
+        atar = self.read_branches(ATAR_TREE, HIT_BRANCHES + (("pion_dar",) if read_pion_dar else ()), entries)
+
+        data = {"entries": entries, "hit_offsets": atar["offsets"]}
+        data.update({name: np.asarray(atar[name], dtype=BRANCH_DTYPES[name]) for name in HIT_BRANCHES})
+        data["pion_dar"] = np.asarray(atar["pion_dar"], dtype=np.int8) if read_pion_dar else None
+
+        if read_calo and self.has_branch(CALO_TREE, "crystal"):
+            calo = self.read_branches(CALO_TREE, CALO_BRANCHES, entries)
+            data["calo_offsets"] = calo["offsets"]
+            data.update({name: np.asarray(calo[name], dtype=BRANCH_DTYPES[name]) for name in CALO_BRANCHES})
+        return data
+
+    #Read and decode the given entries into an EventBatch, as event_decoder.decode_entries() does for trees.
+    def decode_entries(self, entries, geometry = DEFAULT_ATAR_GEOMETRY, gap_threshold = event_decoder.DEFAULT_GAP_THRESHOLD, compact = True,
+                       read_calo = True):
+        return event_decoder.decode_data(self.read_entries(entries, read_calo), geometry, gap_threshold, compact)
+
+
+#Reads with PyROOT, entry by entry, with all branches but the requested ones switched off.
+class PyROOTReader(TreeReader):
+
+    def __init__(self, file_name):
+        self.r_TFile, tree_atar, tree_calo = open_trees(file_name)
+        self.trees = {ATAR_TREE: tree_atar, CALO_TREE: tree_calo}
+
+    @property
+    def n_entries(self):
+        return self.trees[ATAR_TREE].GetEntries()
+
+    def has_branch(self, tree_name, name):
+        tree = self.trees[tree_name]
+        return bool(tree) and bool(tree.GetBranch(name))
+
+    def read_branches(self, tree_name, branches, entries):
+        entries = np.asarray(entries, dtype=np.int64).reshape(-1)
+        tree = self.trees[tree_name]
+        values = {name: [] for name in branches}
+        #Only the requested branches are read. The others are switched back on even if reading fails, since the trees are shared with every
+        #later read.
+        tree.SetBranchStatus("*", 0)
+        try:
+            for name in branches:
+                tree.SetBranchStatus(name, 1)
+            for entry in entries.tolist():
+                tree.GetEntry(entry)
+                #The vectors read by GetEntry are reused for the next entry, so each one is copied before moving on.
+                for name in branches:
+                    value = getattr(tree, name)
+                    values[name].append(np.array(value, dtype=BRANCH_DTYPES.get(name, np.float64)) if name in VECTOR_BRANCHES else value)
+        finally:
+            tree.SetBranchStatus("*", 1)
+
+        if len(entries) == 0:
+            return _empty_branches(branches)
+        data = {}
+        for name in branches:
+            if name in VECTOR_BRANCHES:
+                data["offsets"] = event_decoder.lengths_to_offsets([len(v) for v in values[name]])
+                data[name] = np.concatenate(values[name])
+            else:
+                data[name] = np.array(values[name])
+        return data
+
+    def close(self):
+        self.r_TFile.Close()
+
+
+#Reads with uproot and awkward, one cluster of entries at a time.
+class UprootReader(TreeReader):
+
+    def __init__(self, file_name):
+        import uproot
+        self.file = uproot.open(file_name)
+
+    @property
+    def n_entries(self):
+        return self.file[ATAR_TREE].num_entries
+
+    def has_branch(self, tree_name, name):
+        return tree_name in self.file and name in self.file[tree_name].keys()
+
+    def read_branches(self, tree_name, branches, entries):
+        import awkward as ak
+        entries = np.asarray(entries, dtype=np.int64).reshape(-1)
+        if len(entries) == 0:
+            return _empty_branches(branches)
+        tree = self.file[tree_name]
+
+        #Boundaries of the clusters (entry ranges stored together) of the branches, and which cluster every requested entry is in.
+        boundaries = np.asarray(tree.common_entry_offsets(filter_name=list(branches)), dtype=np.int64)
+        clusters = np.searchsorted(boundaries, entries, side="right") - 1
+
+        #Read each cluster that has requested entries once, from its first to its last requested entry, in the order the entries are requested.
+        order = np.argsort(clusters, kind="stable")
+        parts = []
+        for cluster in np.unique(clusters):
+            in_cluster = entries[clusters == cluster]
+            start, stop = int(in_cluster.min()), int(in_cluster.max()) + 1
+            arrays = tree.arrays(list(branches), entry_start=start, entry_stop=stop, library="ak")
+            parts.append(arrays[in_cluster - start])
+        arrays = ak.concatenate(parts)[np.argsort(order, kind="stable")]
+
+        data = {}
+        for name in branches:
+            if name in VECTOR_BRANCHES:
+                data["offsets"] = event_decoder.lengths_to_offsets(ak.to_numpy(ak.num(arrays[name])))
+                data[name] = ak.to_numpy(ak.flatten(arrays[name]))
+            else:
+                data[name] = ak.to_numpy(arrays[name])
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+#Reads from the memory-mapped columnar cache of a file (see columnar_cache.py), without ROOT once the file has been converted.
+class ColumnarReader(TreeReader):
+
+    def __init__(self, file_name, cache = None):
+        import columnar_cache
+        self.cache = cache if cache is not None else columnar_cache.get_columnar_cache(file_name)
+
+    @property
+    def n_entries(self):
+        return len(self.cache)
+
+    def has_branch(self, tree_name, name):
+        return name in self.cache.columns and (tree_name == CALO_TREE) == (name in CALO_BRANCHES)
+
+    def read_branches(self, tree_name, branches, entries):
+        import columnar_cache
+        entries = np.asarray(entries, dtype=np.int64).reshape(-1)
+        offsets_name = "calo_offsets" if tree_name == CALO_TREE else "hit_offsets"
+        vectors = [name for name in branches if name in VECTOR_BRANCHES]
+
+        data = {name: self.cache[name][entries] for name in branches if name not in VECTOR_BRANCHES}
+        if vectors:
+            data["offsets"], arrays = columnar_cache._take_ragged(self.cache[offsets_name], entries, [self.cache[name] for name in vectors])
+            data.update(zip(vectors, arrays))
+        return data
+
+    #Sliced straight out of the mapped columns, as views wherever the entries are consecutive.
+    def read_entries(self, entries, read_calo = True):
+        return self.cache.read_entries(entries, read_calo)
+
+
+BACKENDS = {
+    "pyroot": PyROOTReader,
+    "uproot": UprootReader,
+    "columnar": ColumnarReader,
+}
+
+
+#Open a reader of the given backend ("pyroot", "uproot" or "columnar") for a file.
+def open_reader(file_name, backend = "pyroot"):
+    if backend not in BACKENDS:
+        raise ValueError("backend must be one of " + ", ".join(map(repr, BACKENDS)) + ", got " + repr(backend))
+    return BACKENDS[backend](file_name)